@@ -1,7 +1,15 @@
+from __future__ import annotations
+
 import pathlib
 
+from typing import Callable
+
 import pytest
 
+import resource_report
+import result_cache
+import timing_history
+
 TESTS_ROOT = pathlib.Path(__file__).resolve().parent
 BMAD_REPO_ROOT = TESTS_ROOT.parent
 DEBUG_BIN_PATH = pathlib.Path("..") / "debug" / "bin"
@@ -14,6 +22,9 @@ DEFAULT_BIN_DIR = (
     PRODUCTION_BIN_PATH if PRODUCTION_BIN_PATH.is_dir() else DEBUG_BIN_PATH
 )
 
+# Per-commit benchmark results of test_benchmarks.py. Kept out of the source tree.
+DEFAULT_BENCHMARK_DIR = timing_history.cache_dir() / "benchmarks"
+
 
 def pytest_addoption(parser: pytest.Parser):
     parser.addoption(
@@ -22,6 +33,133 @@ def pytest_addoption(parser: pytest.Parser):
         default=str(DEFAULT_BIN_DIR),
         help="Bmad binary directory, which should include 'tao' and the other regression tests",
     )
+    parser.addoption(
+        "--timing-history",
+        action="store",
+        default=str(timing_history.DEFAULT_HISTORY_FILE),
+        help="Per-test timing history file. Used to run the longest Fortran tests first.",
+    )
+    parser.addoption(
+        "--fortran-timeout",
+        action="store",
+        type=float,
+        default=1800.0,
+        help="Time limit in seconds for each Fortran test program (0 for no limit)",
+    )
+    parser.addoption(
+        "--resource-report",
+        action="store",
+        default=None,
+        help="Write the resource usage of each Fortran test to this JSON file",
+    )
+    parser.addoption(
+        "--resource-baseline",
+        action="store",
+        default=None,
+        help=(
+            "A previous --resource-report file. Fortran tests whose wall time, CPU time "
+            "or peak memory grew by more than --resource-threshold fail"
+        ),
+    )
+    parser.addoption(
+        "--resource-threshold",
+        action="store",
+        type=float,
+        default=25.0,
+        help="Allowed increase in percent over --resource-baseline (default: 25)",
+    )
+    parser.addoption(
+        "--benchmarks",
+        action="store_true",
+        default=False,
+        help="Run the Tao example performance benchmarks in test_benchmarks.py",
+    )
+    parser.addoption(
+        "--benchmark-dir",
+        action="store",
+        default=str(DEFAULT_BENCHMARK_DIR),
+        help="Directory for the per-commit benchmark results",
+    )
+    parser.addoption(
+        "--cached",
+        action="store_true",
+        default=False,
+        help=(
+            "Reuse the result of Fortran tests that passed before with the same "
+            "binary, shared libraries, input files and output.correct"
+        ),
+    )
+    parser.addoption(
+        "--result-cache",
+        action="store",
+        default=str(result_cache.DEFAULT_CACHE_FILE),
+        help="Result cache file used with --cached",
+    )
+
+
+def _fortran_test_name(item: pytest.Item) -> str | None:
+    callspec = getattr(item, "callspec", None)
+    if callspec is None:
+        return None
+    return callspec.params.get("test_name")
+
+
+def pytest_configure(config: pytest.Config):
+    config.addinivalue_line(
+        "markers", "benchmark: performance benchmark, only run with --benchmarks"
+    )
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]):
+    if not config.getoption("--benchmarks"):
+        skip_benchmark = pytest.mark.skip(reason="Benchmarks only run with --benchmarks")
+        for item in items:
+            if "benchmark" in item.keywords:
+                item.add_marker(skip_benchmark)
+
+    # Run the Fortran tests that took the longest in previous runs first, so
+    # that a slow test at the end of the list does not leave workers idle
+    # when running in parallel.
+    history = timing_history.load_history(
+        pathlib.Path(config.getoption("--timing-history"))
+    )
+    positions = [
+        idx for idx, item in enumerate(items) if _fortran_test_name(item) is not None
+    ]
+    ordered = sorted(
+        (items[idx] for idx in positions),
+        key=lambda item: -timing_history.expected_duration(
+            history, _fortran_test_name(item)
+        ),
+    )
+    for idx, item in zip(positions, ordered):
+        items[idx] = item
+
+
+def pytest_report_teststatus(report: pytest.TestReport, config: pytest.Config):
+    if report.when == "call" and report.passed and ("cached", True) in report.user_properties:
+        return "cached", "c", "CACHED"
+
+
+# Resource usage of the Fortran tests, collected from the test reports so that
+# it also works when tests run in pytest-xdist workers.
+_resource_usage: dict[str, timing_history.Timing] = {}
+
+
+def pytest_runtest_logreport(report: pytest.TestReport):
+    if report.when != "call":
+        return
+    for name, value in report.user_properties:
+        if name == "resources":
+            test_name, usage = value
+            _resource_usage[test_name] = timing_history.Timing(**usage)
+
+
+def pytest_sessionfinish(session: pytest.Session):
+    report_file = session.config.getoption("--resource-report")
+    if report_file is None or hasattr(session.config, "workerinput"):
+        return
+    resource_report.write_report(_resource_usage, pathlib.Path(report_file))
 
 
 @pytest.fixture(scope="module")
@@ -30,3 +168,56 @@ def bmad_bin(request: pytest.FixtureRequest) -> pathlib.Path:
     if not bin.is_dir():
         raise ValueError(f"--bmad-bin path {bin} is not a directory")
     return bin
+
+
+@pytest.fixture(scope="session")
+def timing_history_file(request: pytest.FixtureRequest) -> pathlib.Path:
+    return pathlib.Path(str(request.config.getoption("--timing-history"))).resolve()
+
+
+@pytest.fixture(scope="session")
+def fortran_result_cache(
+    request: pytest.FixtureRequest,
+) -> result_cache.ResultCache | None:
+    if not request.config.getoption("--cached"):
+        return None
+    return result_cache.ResultCache(
+        pathlib.Path(str(request.config.getoption("--result-cache"))).resolve()
+    )
+
+
+@pytest.fixture(scope="session")
+def fortran_timeout(request: pytest.FixtureRequest) -> float | None:
+    timeout = request.config.getoption("--fortran-timeout")
+    return timeout if timeout > 0 else None
+
+
+@pytest.fixture(scope="session")
+def check_resource_usage(
+    request: pytest.FixtureRequest,
+) -> Callable[[str, timing_history.Timing], list[str]]:
+    """
+    Compare the resource usage of a Fortran test against --resource-baseline.
+
+    The returned function gives the list of regressions, which is empty if no
+    baseline is used.
+    """
+    baseline_file = request.config.getoption("--resource-baseline")
+    baseline = resource_report.load_report(pathlib.Path(baseline_file)) if baseline_file else {}
+    threshold = request.config.getoption("--resource-threshold")
+
+    def check(test_name: str, timing: timing_history.Timing) -> list[str]:
+        return resource_report.find_regressions({test_name: timing}, baseline, threshold)
+
+    return check
+
+
+@pytest.fixture(scope="session")
+def tao_pool():
+    """Warm Tao subprocesses shared by the PyTao tests of a session."""
+    # Imported here so that only the PyTao tests need pytao.
+    import tao_workers
+
+    pool = tao_workers.TaoPool()
+    yield pool
+    pool.close()
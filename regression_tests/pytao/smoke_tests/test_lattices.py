@@ -1,5 +1,4 @@
 from pathlib import Path
-from pytao import SubprocessTao
 import pytest
 
 
@@ -9,7 +8,7 @@ lattice_files = sorted(lattices_dir.glob("*.bmad"))
 
 
 @pytest.mark.parametrize("lattice_file", lattice_files, ids=lambda p: p.name)
-def test_load_lattice(lattice_file):
+def test_load_lattice(tao_pool, lattice_file):
     """Test that each lattice file can be loaded without errors."""
-    with SubprocessTao(lattice_file=lattice_file, noplot=True):
+    with tao_pool.lattice(lattice_file=lattice_file):
         pass
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+Resource usage report for the Fortran regression tests.
+
+The wall time, user/system CPU time, peak memory and major page faults of
+every test program are written to a JSON report:
+
+    {
+     "date": "...",
+     "host": "...",
+     "tests": {"<test_name>": {"wall": ..., "user_cpu": ..., ...}, ...}
+    }
+
+A previous report can be used as a baseline. Tests whose wall time, CPU time
+or peak memory grew by more than a threshold percentage are reported as
+regressions.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import pathlib
+import platform
+
+from timing_history import Timing
+
+# Metrics compared against the baseline, and the smallest baseline value for
+# which the comparison is meaningful. Short runs are dominated by noise.
+COMPARED_METRICS = {
+    "wall": 1.0,  # sec
+    "cpu": 1.0,  # sec
+    "max_rss": 0,  # kB
+}
+
+
+def write_report(timings: dict[str, Timing], path: pathlib.Path) -> None:
+    """
+    Write the resource usage of tests to a JSON report.
+
+    Parameters
+    ----------
+    timings : dict of str to Timing
+        Resource usage of each test that was run.
+    path : pathlib.Path
+        The report file.
+    """
+    report = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "tests": {name: timing._asdict() for name, timing in sorted(timings.items())},
+    }
+    with open(path, "w") as fp:
+        json.dump(report, fp, indent=1)
+
+
+def load_report(path: pathlib.Path) -> dict[str, dict]:
+    """
+    Load the per-test resource usage from a report.
+
+    Returns
+    -------
+    dict
+        Maps test name to a dict of metrics.
+    """
+    with open(path) as fp:
+        return json.load(fp)["tests"]
+
+
+def find_regressions(
+    timings: dict[str, Timing],
+    baseline: dict[str, dict],
+    threshold: float,
+) -> list[str]:
+    """
+    Compare resource usage against a baseline.
+
+    Parameters
+    ----------
+    timings : dict of str to Timing
+        Resource usage of each test that was run.
+    baseline : dict
+        Per-test metrics from `load_report`.
+    threshold : float
+        Allowed increase in percent.
+
+    Returns
+    -------
+    list of str
+        One message per metric that increased by more than `threshold`.
+        Tests missing from the baseline are not compared.
+    """
+    regressions = []
+    for name, timing in timings.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, min_value in COMPARED_METRICS.items():
+            base_value = base.get(metric)
+            if base_value is None or base_value <= 0 or base_value < min_value:
+                continue
+            value = getattr(timing, metric)
+            change = 100 * (value - base_value) / base_value
+            if change > threshold:
+                regressions.append(
+                    f"{name}: {metric} increased from {base_value:.6g} to {value:.6g} "
+                    f"(+{change:.0f}%, threshold {threshold:g}%)"
+                )
+    return regressions
@@ -0,0 +1,170 @@
+"""
+Opt-in cache of passing Fortran regression test results.
+
+A test result is keyed on the hash of the test binary (or the binaries used
+by the test's `run.py`), the shared libraries of the build, the input files
+in the test directory and `output.correct`. When none of those have changed
+since the test last passed, `test_fortran.py` reuses the result and reports
+the test as "cached" instead of running it.
+
+Enable with `pytest --cached`. Without the flag every test is run.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+import re
+import subprocess
+
+import timing_history
+
+DEFAULT_CACHE_FILE = timing_history.cache_dir() / "result_cache.json"
+
+# Files written by the tests themselves are not inputs.
+GENERATED_FILES = {"output.now"}
+
+
+def _sha256_file(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_files(test_path: pathlib.Path) -> list[pathlib.Path]:
+    """
+    Input files of a test: the files in the test directory under version
+    control, or all files if the directory is not in a git checkout.
+
+    `output.correct` is always included.
+    """
+    try:
+        listing = subprocess.run(
+            ["git", "ls-files", "-z", "."],
+            cwd=test_path,
+            capture_output=True,
+            check=True,
+        ).stdout.decode()
+        files = {test_path / name for name in listing.split("\0") if name}
+    except (OSError, subprocess.CalledProcessError):
+        files = {path for path in test_path.rglob("*") if path.is_file()}
+
+    files = {path for path in files if path.name not in GENERATED_FILES}
+    files.add(test_path / "output.correct")
+    return sorted(path for path in files if path.is_file())
+
+
+def binaries_for_test(bmad_bin_dir: pathlib.Path, test_path: pathlib.Path) -> list[pathlib.Path]:
+    """
+    Binaries run by a test: the binary named after the test directory, or the
+    binaries that `run.py` runs as `sys.argv[1] + 'name'`.
+    """
+    run_py = test_path / "run.py"
+    if not run_py.exists():
+        return [bmad_bin_dir / test_path.name]
+
+    names = re.findall(r"argv\[1\]\s*\+\s*['\"](\w+)['\"]", run_py.read_text())
+    return sorted({bmad_bin_dir / name for name in names})
+
+
+def shared_libraries(bmad_bin_dir: pathlib.Path) -> list[pathlib.Path]:
+    """
+    Shared libraries of the build: the `lib*.so*` files in the `lib` directory
+    next to the binary directory.
+
+    In a shared build (`ACC_ENABLE_SHARED_ONLY`) the Bmad code is in these
+    libraries, so a change to a Bmad module may not change the test binaries.
+    """
+    lib_dir = pathlib.Path(bmad_bin_dir).resolve().parent / "lib"
+    if not lib_dir.is_dir():
+        return []
+    return sorted(path for path in lib_dir.glob("lib*.so*") if path.is_file())
+
+
+class ResultCache:
+    """
+    Cache of the keys of passing tests, stored in a JSON file.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        The cache file.
+    """
+
+    def __init__(self, path: pathlib.Path = DEFAULT_CACHE_FILE) -> None:
+        self.path = pathlib.Path(path)
+        self._data = self._load()
+        self._new_binary_hashes: dict[str, dict] = {}
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # A corrupt cache only means that tests are run again.
+            return {"binaries": {}, "passed": {}}
+
+    def _binary_hash(self, path: pathlib.Path) -> str:
+        # Binaries are large, so their hashes are reused while the file's
+        # size and modification time are unchanged.
+        if not path.is_file():
+            return "missing"
+
+        stat = path.stat()
+        entry = self._data["binaries"].get(str(path))
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry["sha256"]
+
+        entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": _sha256_file(path)}
+        self._data["binaries"][str(path)] = entry
+        self._new_binary_hashes[str(path)] = entry
+        return entry["sha256"]
+
+    def key(self, bmad_bin_dir: pathlib.Path, test_path: pathlib.Path) -> str:
+        """
+        Hash of everything that determines the result of a test.
+
+        Parameters
+        ----------
+        bmad_bin_dir : pathlib.Path
+            Bmad binary directory.
+        test_path : pathlib.Path
+            The test directory.
+
+        Returns
+        -------
+        str
+        """
+        digest = hashlib.sha256()
+        for binary in binaries_for_test(bmad_bin_dir, test_path):
+            digest.update(f"bin {binary.name} {self._binary_hash(binary)}\n".encode())
+        for library in shared_libraries(bmad_bin_dir):
+            digest.update(f"lib {library.name} {self._binary_hash(library)}\n".encode())
+        for path in input_files(test_path):
+            rel_path = path.relative_to(test_path).as_posix()
+            digest.update(f"input {rel_path} {_sha256_file(path)}\n".encode())
+        return digest.hexdigest()
+
+    def is_cached(self, test_name: str, key: str) -> bool:
+        """True if the test passed with the same key."""
+        return self._data["passed"].get(test_name) == key
+
+    def store(self, test_name: str, key: str) -> None:
+        """Record that the test passed with the given key."""
+        self._data["passed"][test_name] = key
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with timing_history.file_lock(self.path):
+            # Merge with results stored by other processes in the meantime.
+            data = self._load()
+            data["binaries"].update(self._new_binary_hashes)
+            data["passed"][test_name] = key
+
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp{os.getpid()}")
+            with open(tmp_path, "w") as fp:
+                json.dump(data, fp, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
@@ -9,6 +9,11 @@ import os
 import sys
 import time
 import math
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import timing_history
+import resource_report
 
 num_tests = 0
 num_failures = 0
@@ -38,143 +43,71 @@ def print_all(string, terminate = False, color = False, failing = False):
     global num_flow_failures
     num_flow_failures += 1
 
+#----------------------------------------------------------
+# Output of a single test directory.
+# When running tests in parallel, each test gets its own buffer and print_all calls are
+# recorded so that they can be replayed into regression.results in TESTS.LIST order.
+# With live = True (serial running) the calls are passed straight through to print_all.
+# Captured program output is recorded in between so that it is printed (to the terminal only)
+# at the point where the program was run.
+
+class TestOutput:
+  def __init__(self, live):
+    self.live = live
+    self.lines = []
+
+  def print_all(self, string, terminate = False, color = False, failing = False):
+    if self.live:
+      print_all(string, terminate, color, failing)
+    else:
+      self.lines.append((string, terminate, color, failing))
+
+  def program_output(self, output):
+    if not self.live: self.lines.append(output)
+
 #----------------------------------------------------------
 def print_help():
   print('''
 Usage:
-   run_test.py {-bin <bin_dir>} {-debug} {-test <test_dir>} {-list <test_list_file>}
+   run_test.py {-bin <bin_dir>} {-debug} {-test <test_dir>} {-list <test_list_file>} {-j <num_jobs>}
+               {-history <history_file>} {-timing} {-report <report_file>}
+               {-baseline <baseline_file>} {-threshold <percent>}
 Note: Do not use -debug with -bin
 Defaults:
    <bin_dir>  = "../production/bin" ! Relative to current directory.
               = "../debug/bin"      ! If -debug switch is present
    <test_dir> = ""                  ! For running a single test. Overrides test.list list.
-   <test_list_file> = "test.list"   ! For running multiple tests.''')
+   <test_list_file> = "test.list"   ! For running multiple tests.
+   <num_jobs> = 1                   ! Number of test directories to run at the same time.
+   <history_file> = "~/.cache/bmad-regression/timing_history.json"  ! Per-test timing history. Used to start the longest tests first.
+   -timing                          ! Print the timing trend of the tests in the history file and exit.
+   <report_file> = ""               ! Write wall/CPU time, peak memory and page faults per test to this JSON file.
+   <baseline_file> = ""             ! A previous report file. Tests using more resources fail.
+   <percent> = 25                   ! Allowed increase in wall time, CPU time and peak memory over the baseline.''')
   exit()
 
 #----------------------------------------------------------
-# List of tests is in "test.list".
-
-results = open('regression.results', 'w')
+# Run the program(s) for one test directory.
+# The program is run with the test directory as its working directory so that tests
+# running in parallel do not interfere with each other.
+# Program output is captured when not running live.
+# Returns the wall time, CPU time and peak memory of the run.
 
-bin_dir = '../production/bin/'
-test_dir_list = []
-test_list_file = 'TESTS.LIST'
-time0 = time.time()
+def run_program(command, subdir, out):
+  run = timing_history.run_timed(command, subdir, shell = True, capture = not out.live)
+  out.program_output(run.output)
+  return run.timing
 
-i = 1
-while i < len(sys.argv):
-  if sys.argv[i] == '-bin':
-    bin_dir = sys.argv[i+1]
-    i += 1
-  elif sys.argv[i] == '-test':
-    test_dir_list = [sys.argv[i+1]]
-    i += 1
-  elif sys.argv[i] == '-list':
-    test_list_file = [sys.argv[i+1]]
-    i += 1
-  elif sys.argv[i] == '-debug':
-    bin_dir = '../debug/bin'
-  else:
-    print_help()
-
-  i += 1
-
-if bin_dir[0] != '/' and bin_dir[0] != '$': bin_dir = '../' + bin_dir
-if bin_dir[-1] != '/': bin_dir = bin_dir + '/'
-if len(test_dir_list) == 1 and test_dir_list[0] == 'all': test_dir_list = []
-
-if len(test_dir_list) == 0:
-  dir_file = open (test_list_file, 'r')
-  test_dir_list = dir_file.readlines()
-
-#-------------------------------------------------------------
-
-for test_dir in test_dir_list:
-  time0_test = time.time()
-  test_dir = test_dir.strip()
-  ix = test_dir.find('!')
-  if ix != -1: test_dir = test_dir[:ix]
-  if len(test_dir) == 0: continue
-
-  # Is this a note:
-
-  if test_dir[:5] == 'NOTE:':
-    print_all ('Note in TESTS.LIST file: ' + test_dir, False, True, False)
-    continue
-
-  #-----------------------------------------------------------
-  # Run the programs
+#----------------------------------------------------------
+# Compare the output of the program "output.now" to the expected output "output.correct".
+# Returns the number of tests and the number of failed tests.
 
-  dir_split = test_dir.split()
-  num_programs += 1
+def compare_output(subdir, out):
   num_local_tests = 0
   num_local_failures = 0
 
-  if len(dir_split) > 2:
-    print_all ('\nExtra stuff on line in "TESTS.LIST": ' + dir_split, True, True, True)
-    continue
-
-  max_fail = 0
-  if len(dir_split) == 2: max_fail = int(dir_split[1])
-
-  subdir = dir_split[0]
-  if subdir[-1] == "/": subdir = subdir[:-1]
-
-  if not os.path.exists(subdir):
-    print_all ('\nNon-existant subdirectory given in "TESTS.LIST": ' + subdir, True, True, True)
-    continue
-
-  os.chdir(subdir)
-
-  print_all ('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-  print_all ('Starting testing in subdirectory: ' + subdir)
-
-  # Remove output.now
-
-  if os.path.exists('output.now'):
-    os.system('rm -f output.now')
-#  if pathlib.Path('output.now'.exists('output.now'):
-#     os.system('rm output.now')
-#  else:
-#    print ('did not find output.now')
-
-  # Run process and make sure output.now has been created
-
-  program = subdir
-  if program[-1] == '/': program = program[:-1]
-
-  # run.py
-  if os.path.exists('run.py'):
-    print_all ('     Found run.py. Running this script with python3.')        
-    os.system('python3 run.py ' + bin_dir)
-
-  else:
-    program = bin_dir + program
-    print_all ('     Running program: ' + program)
-  
-    if not os.path.isfile(program):
-      print_all ('     !!! Program does not exist!', True, True, True)
-      os.chdir('..')
-      continue
-
-    os.system(program)
-
-  # Look for output
-
-  if not os.path.isfile('output.now'):
-    print_all ('    ' + subdir + ': !!! Program failed to create "output.now" file', True, True, True)
-    os.chdir('..')
-    continue
-
-  if not os.path.isfile('output.correct'):
-    print_all ('    ' + subdir + ': !!! No "output.correct" file', True, True, True)
-    os.chdir('..')
-    continue
-
-  # Compare the output of the program "output.now" to the expected output "output.correct"
-
-  now_file = open('output.now', 'r')  
-  correct_file = open('output.correct', 'r')
+  now_file = open(os.path.join(subdir, 'output.now'), 'r')  
+  correct_file = open(os.path.join(subdir, 'output.correct'), 'r')
   test_count = 0
 
   while True:
@@ -194,11 +127,11 @@ for test_dir in test_dir_list:
       break
 
     if len(now_line) == 0 or len(correct_line) == 0: 
-      print_all ('')
+      out.print_all ('')
       if len(now_line) != 0:
-        print_all ('    ' + subdir + ': Confusion! End of "output.correct" reached before End of "output.now"', True, True, True)
+        out.print_all ('    ' + subdir + ': Confusion! End of "output.correct" reached before End of "output.now"', True, True, True)
       if len(correct_line) != 0:
-        print_all ('    ' + subdir + ': Confusion! End of "output.now" reached before End of "output.correct"', True, True, True)
+        out.print_all ('    ' + subdir + ': Confusion! End of "output.now" reached before End of "output.correct"', True, True, True)
       break
 
     now_line = now_line.strip()
@@ -208,16 +141,16 @@ for test_dir in test_dir_list:
     correct_split = correct_line.split('"', 2)
     
     if now_split[0] != '' or len(now_split) != 3:
-      print_all ('    ' + subdir + ': Cannot parse line from "output.now": ' + now_line, True, True, True)
+      out.print_all ('    ' + subdir + ': Cannot parse line from "output.now": ' + now_line, True, True, True)
       break
 
     if correct_split[0] != '' or len(correct_split) != 3:
-      print_all ('    ' + subdir + ': Cannot parse line from "output.correct": ' + correct_line, True, True, True)
+      out.print_all ('    ' + subdir + ': Cannot parse line from "output.correct": ' + correct_line, True, True, True)
       break
 
     if now_split[1] != correct_split[1]:
-      print_all ('    ' + subdir + ': Identification string for a line in "output.now":    ' + now_split[1], False, True, True)
-      print_all ('    ' + subdir + ': Does not match corresponding ID in "output.correct": ' + correct_split[1], True, True, True)
+      out.print_all ('    ' + subdir + ': Identification string for a line in "output.now":    ' + now_split[1], False, True, True)
+      out.print_all ('    ' + subdir + ': Does not match corresponding ID in "output.correct": ' + correct_split[1], True, True, True)
 
     now_end = now_split[2].strip().split()
 
@@ -231,26 +164,26 @@ for test_dir in test_dir_list:
       correct2_split = correct_split[2].split('"')[1:]
 
       if len(now2_split) < 2:
-        print_all ('    ' + subdir + ': Bad line line "output.now": ' + now_line, True, True, True)
+        out.print_all ('    ' + subdir + ': Bad line line "output.now": ' + now_line, True, True, True)
         break
 
       now2_split.pop(0)    # Get rid of STR item.
 
       if len(now2_split) != len(correct2_split):
-        print_all ('    ' + subdir + ': Number of components in "output.now" line: ' + now_line, False, True, True)
-        print_all ('    ' + subdir + ': Does not match number in "output.correct:  ' + correct_line, True, True, True)
+        out.print_all ('    ' + subdir + ': Number of components in "output.now" line: ' + now_line, False, True, True)
+        out.print_all ('    ' + subdir + ': Does not match number in "output.correct:  ' + correct_line, True, True, True)
         break
 
       for ix, (now1, correct1) in enumerate(list(zip(now2_split, correct2_split))):
         if now1 != correct1:
-          print_all ('')
+          out.print_all ('')
           if len(now2_split) == 2:     # Will always have blank item in list.
-            print_all ('    ' + subdir + ': Regression test failed:', color = True)
+            out.print_all ('    ' + subdir + ': Regression test failed:', color = True)
           else:
-            print_all ('    ' + subdir + ': Regression test failed for datum number: ' + str(ix+1), color = True)
+            out.print_all ('    ' + subdir + ': Regression test failed for datum number: ' + str(ix+1), color = True)
 
-          print_all ('          Line from "output.now": ' + now_line, color = True)
-          print_all ('          Line from "output.correct": ' + correct_line, color = True)
+          out.print_all ('          Line from "output.now": ' + now_line, color = True)
+          out.print_all ('          Line from "output.correct": ' + correct_line, color = True)
           num_local_failures += 1
           break
 
@@ -262,15 +195,15 @@ for test_dir in test_dir_list:
       correct2_split = correct_split[2].strip().split()[2:]   # [2:] -> Throw away EG: "ABS 2E-7"
       
       if len(now2_split) < 3:
-        print_all ('    ' + subdir + ': Bad line in "output.now": ' + now_line, True, True, True)
+        out.print_all ('    ' + subdir + ': Bad line in "output.now": ' + now_line, True, True, True)
         break
 
       tol_type = now2_split.pop(0)           # Pop REL or ABS item.
       tol_val  = float(now2_split.pop(0))    # Pop tollerance
 
       if len(now2_split) != len(correct2_split):
-        print_all ('    ' + subdir + ': Number of components in "output.now" line: ' + now_line, False, True, True)
-        print_all ('    ' + subdir + ': Does not match number in "output.correct:  ' + correct_line, True, True, True)
+        out.print_all ('    ' + subdir + ': Number of components in "output.now" line: ' + now_line, False, True, True)
+        out.print_all ('    ' + subdir + ': Does not match number in "output.correct:  ' + correct_line, True, True, True)
         break
 
       bad_at = -1
@@ -302,61 +235,263 @@ for test_dir in test_dir_list:
           bad_abs_val = abs_val
 
       if bad_at > -1:
-        print_all ('')
+        out.print_all ('')
         if now_end[0] == 'STR':
-          print_all ('    ' + subdir + ': Regression test failed for: "' + now_split[1] + '"', color = True)
+          out.print_all ('    ' + subdir + ': Regression test failed for: "' + now_split[1] + '"', color = True)
         else:
-          print_all ('    ' + subdir + ': Regression test failed for: "' + now_split[1] + '"   ' + now_end[0] + '   ' + now_end[1], color = True)
+          out.print_all ('    ' + subdir + ': Regression test failed for: "' + now_split[1] + '"   ' + now_end[0] + '   ' + now_end[1], color = True)
 
         if len(now2_split) != 1: 
-          print_all ('     Regression test failed for datum number: ' + str(bad_at+1), color = True)
+          out.print_all ('     Regression test failed for datum number: ' + str(bad_at+1), color = True)
 
-        print_all ('        Data from "output.now":     ' + str(now2_split), color = True)
-        print_all ('        Data from "output.correct": ' + str(correct2_split), color = True)
-        print_all ('        Diff: ' + str(bad_diff_val) + '  Diff/Val: ' + str(abs(bad_diff_val) / bad_abs_val), color = True)
+        out.print_all ('        Data from "output.now":     ' + str(now2_split), color = True)
+        out.print_all ('        Data from "output.correct": ' + str(correct2_split), color = True)
+        out.print_all ('        Diff: ' + str(bad_diff_val) + '  Diff/Val: ' + str(abs(bad_diff_val) / bad_abs_val), color = True)
         num_local_failures += 1
 
     #----------------------------------------------
     # Error test
 
     else:
-      print_all ('     Bad data ID string in "output.now" file: ' + now_line, False, True, True)
-      print_all ('     Should be one of: STR, REL, or ABS.', True, True, True)
+      out.print_all ('     Bad data ID string in "output.now" file: ' + now_line, False, True, True)
+      out.print_all ('     Should be one of: STR, REL, or ABS.', True, True, True)
       break
 
+  now_file.close()
+  correct_file.close()
+
+  return num_local_tests, num_local_failures
+
+#----------------------------------------------------------
+# Run the regression test for one line of TESTS.LIST.
+# Returns a dict with the test results. The print_all output is in result['out'].
+
+def run_test(test_dir, bin_dir, live):
+  time0_test = time.time()
+  out = TestOutput(live)
+  result = {'out': out, 'is_program': False, 'num_tests': 0, 'num_failures': 0, 'subdir': '', 'timing': None}
+
+  # Is this a note:
+
+  if test_dir[:5] == 'NOTE:':
+    out.print_all ('Note in TESTS.LIST file: ' + test_dir, False, True, False)
+    return result
+
+  #-----------------------------------------------------------
+  # Run the programs
+
+  dir_split = test_dir.split()
+  result['is_program'] = True
+
+  if len(dir_split) > 2:
+    out.print_all ('\nExtra stuff on line in "TESTS.LIST": ' + test_dir, True, True, True)
+    return result
+
+  max_fail = 0
+  if len(dir_split) == 2: max_fail = int(dir_split[1])
+
+  subdir = dir_split[0]
+  if subdir[-1] == "/": subdir = subdir[:-1]
+  result['subdir'] = subdir
+
+  if not os.path.exists(subdir):
+    out.print_all ('\nNon-existant subdirectory given in "TESTS.LIST": ' + subdir, True, True, True)
+    return result
+
+  out.print_all ('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+  out.print_all ('Starting testing in subdirectory: ' + subdir)
+
+  # Remove output.now
+
+  if os.path.exists(os.path.join(subdir, 'output.now')):
+    os.remove(os.path.join(subdir, 'output.now'))
+
+  # Run process and make sure output.now has been created
+
+  program = subdir
+
+  # run.py
+  if os.path.exists(os.path.join(subdir, 'run.py')):
+    out.print_all ('     Found run.py. Running this script with python3.')        
+    result['timing'] = run_program('python3 run.py ' + bin_dir, subdir, out)
+
+  else:
+    program = bin_dir + program
+    out.print_all ('     Running program: ' + program)
+  
+    if not os.path.isfile(os.path.join(subdir, program)):
+      out.print_all ('     !!! Program does not exist!', True, True, True)
+      return result
+
+    result['timing'] = run_program(program, subdir, out)
+
+  # Look for output
+
+  if not os.path.isfile(os.path.join(subdir, 'output.now')):
+    out.print_all ('    ' + subdir + ': !!! Program failed to create "output.now" file', True, True, True)
+    return result
+
+  if not os.path.isfile(os.path.join(subdir, 'output.correct')):
+    out.print_all ('    ' + subdir + ': !!! No "output.correct" file', True, True, True)
+    return result
+
+  num_local_tests, num_local_failures = compare_output(subdir, out)
+
   #------------------
 
-  print_all ('    ' + subdir + ': Number of tests:        ' + str(num_local_tests))
-  print_all ('     Number of failed tests: ' + str(num_local_failures), False, color = (num_local_failures != 0))
-  print_all ('     Duration of test (sec): ' + str(time.time() - time0_test))
-  print_all ('     Maximum allowed failed tests: ' + str(max_fail))
+  out.print_all ('    ' + subdir + ': Number of tests:        ' + str(num_local_tests))
+  out.print_all ('     Number of failed tests: ' + str(num_local_failures), False, color = (num_local_failures != 0))
+  out.print_all ('     Duration of test (sec): ' + str(time.time() - time0_test))
+  out.print_all ('     Maximum allowed failed tests: ' + str(max_fail))
   if num_local_failures > max_fail: 
-    print_all ('     Grade for tests in subdirectory ' + subdir + ': FAILED!', False, True, True)
+    out.print_all ('     Grade for tests in subdirectory ' + subdir + ': FAILED!', False, True, True)
   else:
-    print_all ('     Grade for tests in subdirectory ' + subdir + ': Passed.')
+    out.print_all ('     Grade for tests in subdirectory ' + subdir + ': Passed.')
+
+  result['num_tests'] = num_local_tests
+  result['num_failures'] = num_local_failures
+  return result
 
+#----------------------------------------------------------
+# Merge the result of one test into the totals and into regression.results.
 
-  num_tests += num_local_tests
-  num_failures += num_local_failures
+def merge_result(result):
+  global num_tests, num_failures, num_programs
 
-  os.chdir('..')
-  
-#------------------------------------------------------------
+  for line in result['out'].lines:
+    if isinstance(line, str):
+      print(line, end = '')
+    else:
+      print_all(*line)
+
+  if result['is_program']: num_programs += 1
+  num_tests += result['num_tests']
+  num_failures += result['num_failures']
+  if result['timing'] is not None: timings[result['subdir']] = result['timing']
+
+#----------------------------------------------------------
+# List of tests is in "test.list".
+
+if __name__ == '__main__':
+  bin_dir = '../production/bin/'
+  test_dir_list = []
+  test_list_file = 'TESTS.LIST'
+  num_jobs = 1
+  history_file = timing_history.DEFAULT_HISTORY_FILE
+  print_timing = False
+  report_file = ''
+  baseline_file = ''
+  threshold = 25.0
+  timings = {}
+  time0 = time.time()
+
+  i = 1
+  while i < len(sys.argv):
+    if sys.argv[i] == '-bin':
+      bin_dir = sys.argv[i+1]
+      i += 1
+    elif sys.argv[i] == '-test':
+      test_dir_list = [sys.argv[i+1]]
+      i += 1
+    elif sys.argv[i] == '-list':
+      test_list_file = sys.argv[i+1]
+      i += 1
+    elif sys.argv[i] == '-j':
+      num_jobs = int(sys.argv[i+1])
+      i += 1
+    elif sys.argv[i] == '-history':
+      history_file = sys.argv[i+1]
+      i += 1
+    elif sys.argv[i] == '-timing':
+      print_timing = True
+    elif sys.argv[i] == '-report':
+      report_file = sys.argv[i+1]
+      i += 1
+    elif sys.argv[i] == '-baseline':
+      baseline_file = sys.argv[i+1]
+      i += 1
+    elif sys.argv[i] == '-threshold':
+      threshold = float(sys.argv[i+1])
+      i += 1
+    elif sys.argv[i] == '-debug':
+      bin_dir = '../debug/bin'
+    else:
+      print_help()
+
+    i += 1
+
+  history = timing_history.load_history(history_file)
+
+  if print_timing:
+    print(timing_history.format_trend(history))
+    exit()
+
+  results = open('regression.results', 'w')
+
+  if bin_dir[0] != '/' and bin_dir[0] != '$': bin_dir = '../' + bin_dir
+  if bin_dir[-1] != '/': bin_dir = bin_dir + '/'
+  if len(test_dir_list) == 1 and test_dir_list[0] == 'all': test_dir_list = []
+
+  if len(test_dir_list) == 0:
+    dir_file = open (test_list_file, 'r')
+    test_dir_list = dir_file.readlines()
+
+  # Strip comments and blank lines
+
+  test_list = []
+  for test_dir in test_dir_list:
+    test_dir = test_dir.strip()
+    ix = test_dir.find('!')
+    if ix != -1: test_dir = test_dir[:ix]
+    if len(test_dir) == 0: continue
+    test_list.append(test_dir)
 
-print_all ('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-print_all ('Total number of tests:           ' + str(num_tests))
-print_all ('Total number of failed tests:    ' + str(num_failures), color = (num_failures != 0))
-print_all ('Number of Program flow failures: ' + str(num_flow_failures), color = (num_flow_failures != 0))
-print_all ('Duration of all tests (sec): %5.2f' % (time.time() - time0))
+  #-------------------------------------------------------------
+  # Results are merged in TESTS.LIST order independent of the order in which tests finish.
+  # When running in parallel, the tests that took the longest in previous runs are started first
+  # so that a slow test at the end of the list does not leave the other workers idle.
 
-print('Results file: regression.results')
+  if num_jobs < 2:
+    for test_dir in test_list:
+      merge_result(run_test(test_dir, bin_dir, True))
 
-if pass_all_tests:
-  print_all ('\nBottom line for all tests: The code PASSES regression testing.')
-  exit(0)
-else:
-  print_all ('\nBottom line for all tests: The code FAILS regression testing.', color = True)
-  exit(1)
+  else:
+    with ProcessPoolExecutor(max_workers = num_jobs) as pool:
+      cost = lambda ix: timing_history.expected_duration(history, test_list[ix].split()[0].rstrip('/'))
+      futures = len(test_list) * [None]
+      for ix in sorted(range(len(test_list)), key = lambda ix: -cost(ix)):
+        futures[ix] = pool.submit(run_test, test_list[ix], bin_dir, False)
+      for future in futures:
+        merge_result(future.result())
+
+  timing_history.record_timings(timings, history_file)
+  if report_file != '': resource_report.write_report(timings, report_file)
+
+  # Compare resource usage with the baseline
+
+  if baseline_file != '':
+    regressions = resource_report.find_regressions(timings, resource_report.load_report(baseline_file), threshold)
+    print_all ('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+    print_all ('Resource usage compared to baseline: ' + baseline_file)
+    for regression in regressions:
+      print_all ('     Resource usage regression: ' + regression, False, True, True)
+    print_all ('Number of resource usage regressions: ' + str(len(regressions)), color = (len(regressions) != 0))
 
-results.close()
+  #------------------------------------------------------------
 
+  print_all ('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+  print_all ('Total number of tests:           ' + str(num_tests))
+  print_all ('Total number of failed tests:    ' + str(num_failures), color = (num_failures != 0))
+  print_all ('Number of Program flow failures: ' + str(num_flow_failures), color = (num_flow_failures != 0))
+  print_all ('Duration of all tests (sec): %5.2f' % (time.time() - time0))
+
+  print('Results file: regression.results')
+
+  if pass_all_tests:
+    print_all ('\nBottom line for all tests: The code PASSES regression testing.')
+    results.close()
+    exit(0)
+  else:
+    print_all ('\nBottom line for all tests: The code FAILS regression testing.', color = True)
+    results.close()
+    exit(1)
@@ -0,0 +1,192 @@
+"""
+Compressed, chunked storage of PyTao snapshot data.
+
+A snapshot is a zip archive of arrays together with a JSON schema file next
+to it:
+
+    snapshots/{example}/lat_list.zip
+    snapshots/{example}/lat_list.json
+
+Each array is split into chunks of `chunk_size` elements, and every chunk is
+a separately compressed `.npy` member of the archive. The schema records the
+dtype, shape, number of chunks and comparison tolerance of each key:
+
+    {
+     "version": 1,
+     "chunk_size": 65536,
+     "keys": {
+      "ele.a.beta": {"dtype": "<f8", "shape": [868], "chunks": 1,
+                     "rtol": 1e-05, "atol": 0.0},
+      ...
+     }
+    }
+
+The archive is memory-mapped when opened, and only the chunks of the keys
+that are read are decompressed, so checking one attribute does not load the
+whole snapshot.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import pathlib
+import zipfile
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+
+# Elements per chunk.
+DEFAULT_CHUNK_SIZE = 65536
+
+
+class Tolerance(NamedTuple):
+    atol: float
+    rtol: float
+
+
+class _MappedFile(mmap.mmap):
+    # zipfile needs seekable(), which mmap only provides from Python 3.13.
+    def seekable(self) -> bool:
+        return True
+
+
+def schema_path(path: pathlib.Path) -> pathlib.Path:
+    """The schema file that belongs to the snapshot archive `path`."""
+    return path.with_suffix(".json")
+
+
+def _member_name(key: str, chunk: int) -> str:
+    return f"{key}/{chunk:05d}.npy"
+
+
+def write_snapshot(
+    path: pathlib.Path,
+    arrays: dict[str, np.ndarray],
+    tolerances: dict[str, Tolerance],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """
+    Write a snapshot archive and its schema.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        The archive file. The schema is written to `schema_path(path)`.
+    arrays : dict of str to np.ndarray
+        Arrays to store. Arrays are chunked along their flattened length.
+    tolerances : dict of str to Tolerance
+        Comparison tolerance of each key in `arrays`.
+    chunk_size : int, optional
+        Number of elements per chunk.
+    """
+    path = pathlib.Path(path)
+    schema = {"version": SCHEMA_VERSION, "chunk_size": chunk_size, "keys": {}}
+
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for key, value in arrays.items():
+            value = np.asarray(value)
+            flat = value.reshape(-1)
+            num_chunks = max(1, -(-flat.size // chunk_size))
+            for chunk in range(num_chunks):
+                with zf.open(_member_name(key, chunk), "w") as fp:
+                    np.lib.format.write_array(
+                        fp,
+                        np.ascontiguousarray(flat[chunk * chunk_size : (chunk + 1) * chunk_size]),
+                        allow_pickle=False,
+                    )
+            tol = tolerances[key]
+            schema["keys"][key] = {
+                "dtype": value.dtype.str,
+                "shape": list(value.shape),
+                "chunks": num_chunks,
+                "rtol": tol.rtol,
+                "atol": tol.atol,
+            }
+
+    os.replace(tmp_path, path)
+    with open(schema_path(path), "w") as fp:
+        json.dump(schema, fp, indent=1)
+
+
+class SnapshotStore:
+    """
+    Read access to a snapshot written by `write_snapshot`.
+
+    Arrays are read on first access. Use as a context manager, or call
+    `close`, to release the memory map.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        The archive file.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        with open(schema_path(self.path)) as fp:
+            schema = json.load(fp)
+        if schema.get("version") != SCHEMA_VERSION:
+            raise ValueError(
+                f"Unsupported snapshot schema version {schema.get('version')} in {schema_path(self.path)}"
+            )
+        self.chunk_size: int = schema["chunk_size"]
+        self._keys: dict[str, dict] = schema["keys"]
+
+        with open(self.path, "rb") as fp:
+            self._mmap = _MappedFile(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._zip = zipfile.ZipFile(self._mmap)
+
+    def __enter__(self) -> SnapshotStore:
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._zip.close()
+        self._mmap.close()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def keys(self) -> list[str]:
+        return list(self._keys)
+
+    def tolerance(self, key: str) -> Tolerance:
+        """The comparison tolerance stored for `key`."""
+        info = self._keys[key]
+        return Tolerance(atol=info["atol"], rtol=info["rtol"])
+
+    def _read_chunk(self, key: str, chunk: int) -> np.ndarray:
+        with self._zip.open(_member_name(key, chunk)) as fp:
+            return np.lib.format.read_array(fp, allow_pickle=False)
+
+    def read(self, key: str, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """
+        Read the flattened elements `start:stop` of `key`.
+
+        Only the chunks that overlap the range are decompressed.
+        """
+        info = self._keys[key]
+        size = int(np.prod(info["shape"]))
+        start, stop, _ = slice(start, stop).indices(size)
+        if stop <= start:
+            return np.empty(0, dtype=info["dtype"])
+
+        first = start // self.chunk_size
+        last = (stop - 1) // self.chunk_size
+        data = np.concatenate([self._read_chunk(key, chunk) for chunk in range(first, last + 1)])
+        offset = first * self.chunk_size
+        return data[start - offset : stop - offset]
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        info = self._keys[key]
+        return self.read(key).reshape(info["shape"])
@@ -0,0 +1,141 @@
+"""
+Pool of warm Tao subprocesses for the PyTao regression tests.
+
+Starting a `SubprocessTao` for every test spends most of the test time on
+process startup. The pool keeps idle Tao subprocesses around and
+reinitializes them with the lattice of the next test using `tao.init()`:
+
+    def test_something(tao_pool):
+        with tao_pool.lattice(lattice_file="lat.bmad") as tao:
+            ...
+
+Reinitializing reloads the lattice and the Tao state, but not Bmad globals
+such as `bmad_com`. Tests that change those pass `discard=True` so that the
+worker is not reused. Workers that crashed are always discarded and replaced
+by a new subprocess on the next request.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+from typing import Any, Iterator
+
+from pytao import SubprocessTao
+
+logger = logging.getLogger(__name__)
+
+# Idle workers kept in the pool. Tests in one pytest process run one at a
+# time, so a single worker is normally enough.
+DEFAULT_MAX_IDLE = 1
+
+# Workers are replaced after this many lattices to bound any memory growth
+# from repeated reinitialization.
+DEFAULT_MAX_USES = 50
+
+
+class TaoPool:
+    """
+    Pool of reusable `SubprocessTao` workers.
+
+    Parameters
+    ----------
+    max_idle : int, optional
+        Maximum number of idle workers kept for reuse.
+    max_uses : int, optional
+        Number of lattices a worker is initialized with before it is
+        replaced.
+    """
+
+    def __init__(
+        self,
+        max_idle: int = DEFAULT_MAX_IDLE,
+        max_uses: int = DEFAULT_MAX_USES,
+    ) -> None:
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self._idle: list[SubprocessTao] = []
+        self._uses: dict[int, int] = {}
+        self.num_started = 0
+
+    def _start(self, init_kwargs: dict[str, Any]) -> SubprocessTao:
+        tao = SubprocessTao(**init_kwargs)
+        self.num_started += 1
+        self._uses[id(tao)] = 1
+        return tao
+
+    def _discard(self, tao: SubprocessTao) -> None:
+        self._uses.pop(id(tao), None)
+        try:
+            tao.close_subprocess(force=not tao.subprocess_alive)
+        except Exception as ex:
+            logger.debug("Failed to close Tao subprocess: %s", ex)
+
+    def _acquire(self, init_kwargs: dict[str, Any]) -> SubprocessTao:
+        while self._idle:
+            tao = self._idle.pop()
+            if not tao.subprocess_alive:
+                self._discard(tao)
+                continue
+
+            try:
+                tao.init(**init_kwargs)
+            except Exception:
+                if tao.subprocess_alive:
+                    # The lattice itself failed to load. Keep the worker.
+                    self._release(tao)
+                    raise
+                # The worker died while loading. Retry in a fresh subprocess
+                # in case the crash came from state left by an earlier test.
+                logger.debug("Tao worker died during init; starting a new one")
+                self._discard(tao)
+                break
+            else:
+                self._uses[id(tao)] += 1
+                return tao
+
+        return self._start(init_kwargs)
+
+    def _release(self, tao: SubprocessTao) -> None:
+        if (
+            not tao.subprocess_alive
+            or self._uses.get(id(tao), 0) >= self.max_uses
+            or len(self._idle) >= self.max_idle
+        ):
+            self._discard(tao)
+        else:
+            self._idle.append(tao)
+
+    @contextlib.contextmanager
+    def lattice(self, *, discard: bool = False, **init_kwargs: Any) -> Iterator[SubprocessTao]:
+        """
+        Get a Tao worker initialized with the given startup options.
+
+        Parameters
+        ----------
+        discard : bool, optional
+            Close the worker afterwards instead of returning it to the pool.
+            Use this for tests that change state which `tao.init()` does not
+            reset, such as `bmad_com` settings.
+        **init_kwargs
+            Options for `tao.init()`, for example `lattice_file` or
+            `init_file`. `noplot` defaults to True.
+
+        Yields
+        ------
+        SubprocessTao
+        """
+        init_kwargs.setdefault("noplot", True)
+        tao = self._acquire(init_kwargs)
+        try:
+            yield tao
+        finally:
+            if discard:
+                self._discard(tao)
+            else:
+                self._release(tao)
+
+    def close(self) -> None:
+        """Close all idle workers."""
+        while self._idle:
+            self._discard(self._idle.pop())
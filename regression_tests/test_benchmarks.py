@@ -0,0 +1,225 @@
+"""
+Performance benchmarks of the bmad-doc Tao examples through PyTao.
+
+For each example in `bmad-doc/tao_examples` this times lattice loading,
+`lat_list` over all elements, single particle tracking, beam tracking and a
+few optimizer cycles. Timings are stored per commit in
+`~/.cache/bmad-regression/benchmarks/{commit}.json` so that slowdowns in the
+Fortran core show up between commits.
+
+The benchmarks only run when requested:
+
+    pytest -v --benchmarks test_benchmarks.py
+
+To compare the timings of two commits:
+
+    python test_benchmarks.py {commit_a} {commit_b}
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import time
+from typing import Callable, NamedTuple
+
+import pytest
+from pytao import SubprocessTao
+
+import conftest
+import timing_history
+
+pytestmark = pytest.mark.benchmark
+
+# Number of times each timed step is repeated. The fastest time is stored.
+NUM_REPEATS = 3
+
+# Number of optimizer cycles timed in the optimizer benchmark.
+NUM_OPTI_CYCLES = 10
+
+LAT_LIST_WHO = ("ele.s", "ele.a.beta", "ele.b.beta", "orbit.vec.1", "orbit.vec.3")
+
+EXAMPLES = [
+    pytest.param("cbeta_cell"),
+    pytest.param("cbeta_ffag"),
+    pytest.param("cesr"),
+    pytest.param("csr_beam_tracking"),
+    pytest.param(
+        "custom_tao_with_measured_data",
+        marks=pytest.mark.skip(reason="Requires the custom Tao program built in the example"),
+    ),
+    pytest.param("driving_terms"),
+    pytest.param("dynamic_aperture"),
+    pytest.param("erl"),
+    pytest.param("fodo"),
+    pytest.param("multi_turn_orbit"),
+    pytest.param("optics_matching"),
+    pytest.param("space_charge"),
+    pytest.param("x_axis_param_plot"),
+]
+
+
+class Example(NamedTuple):
+    name: str
+    tao: SubprocessTao
+    load_time: float
+
+
+def get_commit() -> str:
+    """
+    The commit of the Bmad checkout, with "-dirty" appended when tracked
+    files are modified.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=conftest.BMAD_REPO_ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=conftest.BMAD_REPO_ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if status.strip() else commit
+
+
+def record_benchmark(
+    results_dir: pathlib.Path, example_name: str, step: str, seconds: float
+) -> None:
+    """Store the time of a benchmark step in the results file of the current commit."""
+    results_dir.mkdir(parents=True, exist_ok=True)
+    commit = get_commit()
+    path = results_dir / f"{commit}.json"
+
+    with timing_history.file_lock(path):
+        try:
+            with open(path) as fp:
+                results = json.load(fp)
+        except FileNotFoundError:
+            results = {"commit": commit, "host": platform.node(), "benchmarks": {}}
+
+        results["date"] = datetime.datetime.now().isoformat(timespec="seconds")
+        results["benchmarks"].setdefault(example_name, {})[step] = seconds
+
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        with open(tmp_path, "w") as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def best_time(func: Callable[[], object], repeats: int = NUM_REPEATS) -> float:
+    """Fastest wall time of `repeats` calls of `func`."""
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+@pytest.fixture(scope="module", params=EXAMPLES)
+def example(request: pytest.FixtureRequest):
+    name = request.param
+    t0 = time.perf_counter()
+    with SubprocessTao(
+        init_file=conftest.TAO_EXAMPLES_ROOT / name / "tao.init",
+        noplot=True,
+    ) as tao:
+        yield Example(name=name, tao=tao, load_time=time.perf_counter() - t0)
+
+
+@pytest.fixture(scope="session")
+def benchmark_dir(request: pytest.FixtureRequest) -> pathlib.Path:
+    return pathlib.Path(str(request.config.getoption("--benchmark-dir"))).resolve()
+
+
+def recalculate(tao: SubprocessTao) -> None:
+    tao.cmd("set universe * recalculate")
+
+
+def test_load(example: Example, benchmark_dir: pathlib.Path) -> None:
+    record_benchmark(benchmark_dir, example.name, "load", example.load_time)
+
+
+def test_lat_list(example: Example, benchmark_dir: pathlib.Path) -> None:
+    def lat_list():
+        for who in LAT_LIST_WHO:
+            example.tao.lat_list("*", who, flags="-array_out -track_only")
+
+    record_benchmark(benchmark_dir, example.name, "lat_list", best_time(lat_list))
+
+
+def test_single_tracking(example: Example, benchmark_dir: pathlib.Path) -> None:
+    example.tao.cmd("set global track_type = single")
+    seconds = best_time(lambda: recalculate(example.tao))
+    record_benchmark(benchmark_dir, example.name, "single_tracking", seconds)
+
+
+def test_beam_tracking(example: Example, benchmark_dir: pathlib.Path) -> None:
+    if example.tao.beam_init(0).get("n_particle", 0) <= 0:
+        pytest.skip("No beam defined in this example")
+
+    example.tao.cmd("set global track_type = beam")
+    try:
+        seconds = best_time(lambda: recalculate(example.tao), repeats=1)
+    finally:
+        example.tao.cmd("set global track_type = single")
+    record_benchmark(benchmark_dir, example.name, "beam_tracking", seconds)
+
+
+def test_optimizer(example: Example, benchmark_dir: pathlib.Path) -> None:
+    # Runs last for each example as it changes the lattice.
+    if not example.tao.var_general():
+        pytest.skip("No optimizer variables defined in this example")
+
+    example.tao.cmd(f"set global n_opti_cycles = {NUM_OPTI_CYCLES}")
+    example.tao.cmd("set global n_opti_loops = 1")
+    seconds = best_time(lambda: example.tao.cmd("run lmdif"), repeats=1)
+    record_benchmark(benchmark_dir, example.name, "optimizer", seconds)
+
+
+def compare_commits(results_dir: pathlib.Path, commit_a: str, commit_b: str) -> None:
+    def load(commit: str) -> dict:
+        with open(results_dir / f"{commit}.json") as fp:
+            return json.load(fp)["benchmarks"]
+
+    results_a = load(commit_a)
+    results_b = load(commit_b)
+
+    print(f"{'Example':<30} {'Step':<16} {commit_a[:10]:>10} {commit_b[:10]:>10} {'Ratio':>7}")
+    for example_name in sorted(set(results_a) | set(results_b)):
+        steps_a = results_a.get(example_name, {})
+        steps_b = results_b.get(example_name, {})
+        for step in sorted(set(steps_a) | set(steps_b)):
+            time_a = steps_a.get(step)
+            time_b = steps_b.get(step)
+            ratio = f"{time_b / time_a:.2f}" if time_a and time_b else ""
+            fmt = lambda value: "" if value is None else f"{value:.3f}"
+            print(f"{example_name:<30} {step:<16} {fmt(time_a):>10} {fmt(time_b):>10} {ratio:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare Tao example benchmark timings of two commits."
+    )
+    parser.add_argument("commit_a")
+    parser.add_argument("commit_b")
+    parser.add_argument(
+        "--benchmark-dir",
+        type=pathlib.Path,
+        default=conftest.DEFAULT_BENCHMARK_DIR,
+    )
+    args = parser.parse_args()
+    compare_commits(args.benchmark_dir, args.commit_a, args.commit_b)
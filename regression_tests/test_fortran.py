@@ -2,14 +2,16 @@ from __future__ import annotations
 
 import logging
 import math
-import os
 import pathlib
 import shlex
 import sys
 from typing import NamedTuple
 
+import numpy as np
 import pytest
 
+import result_cache
+import timing_history
 from conftest import TESTS_ROOT
 
 logger = logging.getLogger(__name__)
@@ -118,7 +120,7 @@ class Line(NamedTuple):
             raise ValueError("Blank line")
         elif line[0] == "!":
             raise ValueError("Comment line")
-        name, type_, *values = shlex.split(line)
+        name, type_, values = _split_line(line)
 
         if type_ == "STR":
             tolerance = None
@@ -135,14 +137,49 @@ class Line(NamedTuple):
         )
 
 
-def load_output_file(fn: pathlib.Path) -> list[Line]:
+def _split_line(line: str) -> tuple[str, str, list[str]]:
     """
-    Load and parse a file to extract relevant lines.
+    Split a specification line into its name, type and value strings.
 
-    This function reads a file specified by `fn`, processes each line, and
-    returns a list of `Line` objects. It skips blank lines and those prefixed
-    with '!'. If a line cannot be parsed into a `Line` object, an exception is
-    raised.
+    The common case of a quoted name without escapes is split with plain
+    string methods; `shlex` is only needed for STR values and unusual names.
+    """
+    if line[0] == '"' and "\\" not in line:
+        _, name, rest = line.split('"', 2)
+        type_, *values = rest.split()
+        if type_ == "STR":
+            values = shlex.split(rest)[1:]
+        return name, type_, values
+
+    name, type_, *values = shlex.split(line)
+    return name, type_, values
+
+
+# Integer codes for line types in `OutputData.kinds`.
+LINE_KINDS = {"STR": 0, "ABS": 1, "REL": 2, "VEC_REL": 3}
+UNKNOWN_KIND = -1
+
+
+class OutputData(NamedTuple):
+    """
+    Parsed "output.now" or "output.correct" file.
+
+    The real values of all lines are stored in one flat array so that the
+    tolerances can be checked for the whole file at once.
+    """
+
+    lines: list[Line]
+    kinds: np.ndarray  # Line type code per line (see LINE_KINDS)
+    tolerances: np.ndarray  # Tolerance per line (0 for STR lines)
+    values: np.ndarray  # Real values of all lines, flattened
+    offsets: np.ndarray  # values of lines[i] are values[offsets[i]:offsets[i+1]]
+
+
+def load_output_data(fn: pathlib.Path) -> OutputData:
+    """
+    Load and parse a file into `Line` objects and flat arrays of real values.
+
+    Blank lines and those prefixed with '!' are skipped.
 
     Parameters
     ----------
@@ -151,14 +188,18 @@ def load_output_file(fn: pathlib.Path) -> list[Line]:
 
     Returns
     -------
-    list of Line
+    OutputData
 
     Raises
     ------
     ValueError
         If a line cannot be parsed into a `Line` object.
     """
-    lines = []
+    parsed = []  # (lineno, line, name, type, values)
+    tolerance_strs = []
+    value_strs = []
+    counts = []
+
     with open(fn) as fp:
         for lineno, line in enumerate(fp.read().splitlines(), start=1):
             line = line.strip()
@@ -167,16 +208,123 @@ def load_output_file(fn: pathlib.Path) -> list[Line]:
             elif line[0] == "!":
                 continue  # Skip comment line
             try:
-                lines.append(Line.from_string(line, lineno=lineno))
+                name, type_, values = _split_line(line)
+                if type_ != "STR":
+                    tolerance_str, *values = values
+            except Exception:
+                raise ValueError(f"Cannot parse line from '{fn}':{lineno} {line!r}")
+
+            parsed.append((lineno, line, name, type_, values))
+            if type_ == "STR":
+                tolerance_strs.append("0")
+                counts.append(0)
+            else:
+                tolerance_strs.append(tolerance_str)
+                value_strs.extend(values)
+                counts.append(len(values))
+
+    try:
+        tolerances = np.array(tolerance_strs, dtype=float)
+        values = np.array(value_strs, dtype=float)
+    except ValueError:
+        # Find the offending line for the error message.
+        for lineno, line, *_ in parsed:
+            try:
+                Line.from_string(line, lineno=lineno)
             except Exception:
                 raise ValueError(f"Cannot parse line from '{fn}':{lineno} {line!r}")
-    return lines
+        raise
+
+    offsets = np.zeros(len(counts) + 1, dtype=int)
+    np.cumsum(counts, out=offsets[1:])
+
+    lines = []
+    for idx, (lineno, _, name, type_, line_values) in enumerate(parsed):
+        if type_ == "STR":
+            tolerance = None
+        else:
+            tolerance = float(tolerances[idx])
+            line_values = values[offsets[idx] : offsets[idx + 1]].tolist()
+        lines.append(
+            Line(
+                name=name,
+                type=type_,
+                values=line_values,
+                tolerance=tolerance,
+                lineno=lineno,
+            )
+        )
+
+    kinds = np.array(
+        [LINE_KINDS.get(line.type, UNKNOWN_KIND) for line in lines], dtype=np.int8
+    )
+    return OutputData(
+        lines=lines,
+        kinds=kinds,
+        tolerances=tolerances,
+        values=values,
+        offsets=offsets,
+    )
+
+
+def load_output_file(fn: pathlib.Path) -> list[Line]:
+    """
+    Load and parse a file to extract relevant lines.
+
+    This function reads a file specified by `fn`, processes each line, and
+    returns a list of `Line` objects. It skips blank lines and those prefixed
+    with '!'. If a line cannot be parsed into a `Line` object, an exception is
+    raised.
+
+    Parameters
+    ----------
+    fn : pathlib.Path
+        The path to the file that needs to be loaded and parsed.
+
+    Returns
+    -------
+    list of Line
+
+    Raises
+    ------
+    ValueError
+        If a line cannot be parsed into a `Line` object.
+    """
+    return load_output_data(fn).lines
 
 
 def run_fortran_code(
     bmad_bin_dir: pathlib.Path,
     test_path: pathlib.Path,
-):
+    timeout: float | None = None,
+) -> timing_history.Timing:
+    """
+    Run the test program (or its `run.py` script) in the test directory.
+
+    The program is run with the test directory as its working directory, so
+    tests can run in parallel (for example with pytest-xdist). Its stdout
+    and stderr are captured and printed when it finishes.
+
+    Parameters
+    ----------
+    bmad_bin_dir : pathlib.Path
+        Bmad binary directory.
+    test_path : pathlib.Path
+        The test directory.
+    timeout : float, optional
+        Time limit for the program in seconds.
+
+    Returns
+    -------
+    timing_history.Timing
+        Wall time, CPU time and peak memory of the run.
+
+    Raises
+    ------
+    TimeoutError
+        If the program did not finish within `timeout`. The output up to
+        that point is printed.
+    """
     output_fn = test_path / "output.now"
     output_fn.unlink(missing_ok=True)
 
@@ -185,8 +333,8 @@ def run_fortran_code(
     run_py = test_path / "run.py"
     if run_py.exists():
         print("     Found run.py. Running this script with python3.")
-        if os.system(f"{sys.executable} run.py {bmad_bin_dir}/") != 0:
-            raise RuntimeError("`run.py` returned a non-zero exit code")
+        command = [sys.executable, "run.py", f"{bmad_bin_dir}/"]
+        description = "`run.py`"
 
     else:
         program = bmad_bin_dir / program
@@ -195,8 +343,20 @@ def run_fortran_code(
         if not program.exists():
             raise FileNotFoundError(f"Test binary does not exist: {program}")
 
-        if os.system(str(program)) != 0:
-            raise RuntimeError(f"`{program}` returned a non-zero exit code")
+        command = [str(program)]
+        description = f"`{program}`"
+
+    run = timing_history.run_timed(command, test_path, timeout=timeout)
+    print(run.output, end="")
+
+    if run.timed_out:
+        raise TimeoutError(
+            f"{description} timed out after {timeout} s (partial output above)"
+        )
+    if run.returncode != 0:
+        raise RuntimeError(f"{description} returned a non-zero exit code")
+
+    return run.timing
 
 
 def check_real_line(now: Line, correct: Line) -> bool:
@@ -282,6 +442,70 @@ def check_real_line(now: Line, correct: Line) -> bool:
     return True
 
 
+def real_lines_within_tolerance(now: OutputData, correct: OutputData) -> np.ndarray:
+    """
+    Check the tolerances of all real lines of two output files at once.
+
+    This gives the same result as `check_real_line` for each line, but
+    evaluates ABS, REL and VEC_REL tolerances for the whole file with NumPy.
+    Lines that cannot be checked in bulk - STR lines, lines with differing
+    types, and lines with a differing number of values - are reported as not
+    within tolerance so that they are checked (and reported) individually.
+
+    Parameters
+    ----------
+    now : OutputData
+        The current output.
+    correct : OutputData
+        The correct - or expected - output.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array with one entry per line pair. True if the line was
+        checked in bulk and all values are within tolerance.
+    """
+    num_lines = min(len(now.lines), len(correct.lines))
+    now_counts = np.diff(now.offsets)[:num_lines]
+    correct_counts = np.diff(correct.offsets)[:num_lines]
+    now_kinds = now.kinds[:num_lines]
+
+    checkable = np.flatnonzero(
+        (now_kinds > LINE_KINDS["STR"])
+        & (now_kinds == correct.kinds[:num_lines])
+        & (now_counts == correct_counts)
+    )
+
+    # Gather the values of the checkable lines into aligned flat arrays.
+    counts = now_counts[checkable]
+    line_id = np.repeat(np.arange(len(checkable)), counts)
+    starts = np.zeros(len(checkable), dtype=int)
+    np.cumsum(counts[:-1], out=starts[1:])
+    position = np.arange(len(line_id)) - starts[line_id]
+    now_values = now.values[now.offsets[checkable][line_id] + position]
+    correct_values = correct.values[correct.offsets[checkable][line_id] + position]
+
+    with np.errstate(all="ignore"):
+        diff_val = np.abs(now_values - correct_values)
+        abs_val = (np.abs(now_values) + np.abs(correct_values)) / 2
+        vec_amp = np.sqrt(
+            np.bincount(line_id, weights=abs_val**2, minlength=len(checkable))
+        )
+
+        kind = now_kinds[checkable][line_id]
+        factor = np.where(
+            kind == LINE_KINDS["REL"],
+            abs_val,
+            np.where(kind == LINE_KINDS["VEC_REL"], vec_amp[line_id], 1.0),
+        )
+        bad = (diff_val > factor * now.tolerances[checkable][line_id]) & (diff_val > 0)
+
+    num_bad = np.bincount(line_id, weights=bad, minlength=len(checkable))
+    within_tolerance = np.zeros(num_lines, dtype=bool)
+    within_tolerance[checkable] = num_bad == 0
+    return within_tolerance
+
+
 def compare_lines(now: Line, correct: Line) -> bool:
     """
     Compares two Line objects to determine if they match based on their type and values.
@@ -327,7 +551,15 @@ def compare_lines(now: Line, correct: Line) -> bool:
 
 
 @fortran_tests
-def test_fortran(bmad_bin: pathlib.Path, test_name: str) -> None:
+def test_fortran(
+    bmad_bin: pathlib.Path,
+    timing_history_file: pathlib.Path,
+    fortran_result_cache: result_cache.ResultCache | None,
+    fortran_timeout: float | None,
+    check_resource_usage,
+    record_property,
+    test_name: str,
+) -> None:
     """
     Runs a Fortran test and compares its output to the expected output.
 
@@ -342,16 +574,31 @@ def test_fortran(bmad_bin: pathlib.Path, test_name: str) -> None:
     if not test_path.exists():
         raise FileNotFoundError(f"Test path does not exist: {test_path}")
 
-    os.chdir(test_path)
+    if fortran_result_cache is not None:
+        cache_key = fortran_result_cache.key(bmad_bin, test_path)
+        if fortran_result_cache.is_cached(test_name, cache_key):
+            record_property("cached", True)
+            print(f"{test_name} passed before with the same binary and inputs (cached).")
+            return
 
-    run_fortran_code(bmad_bin, test_path)
+    timing = run_fortran_code(bmad_bin, test_path, timeout=fortran_timeout)
+    timing_history.record_timings({test_name: timing}, timing_history_file)
+    record_property("resources", (test_name, timing._asdict()))
 
     # Compare the output of the program "output.now" to the expected output "output.correct"
-    now_lines = load_output_file(test_path / "output.now")
-    correct_lines = load_output_file(test_path / "output.correct")
+    now = load_output_data(test_path / "output.now")
+    correct = load_output_data(test_path / "output.correct")
+    now_lines = now.lines
+    correct_lines = correct.lines
     num_local_failures = 0
 
-    for now_line, correct_line in zip(now_lines, correct_lines):
+    # Real lines are checked in bulk. Everything else, including real lines
+    # that fail, goes through `compare_lines` for the detailed report.
+    within_tolerance = real_lines_within_tolerance(now, correct)
+
+    for now_line, correct_line, ok in zip(now_lines, correct_lines, within_tolerance):
+        if ok:
+            continue
         if not compare_lines(now_line, correct_line):
             num_local_failures += 1
 
@@ -363,3 +610,48 @@ def test_fortran(bmad_bin: pathlib.Path, test_name: str) -> None:
         raise ValueError("One or more local failures were found")
 
     print(f"{test_name} 'output.now' and 'output.correct' match.")
+
+    regressions = check_resource_usage(test_name, timing)
+    if regressions:
+        pytest.fail("Resource usage regression:\n" + "\n".join(regressions))
+
+    if fortran_result_cache is not None:
+        fortran_result_cache.store(test_name, cache_key)
+
+
+def test_bulk_tolerance_check_matches_check_real_line(tmp_path: pathlib.Path) -> None:
+    correct_fn = tmp_path / "output.correct"
+    correct_fn.write_text(
+        '"abs" ABS 1e-6 1.0 2.0\n'
+        '"rel" REL 1e-3 100.0 -200.0\n'
+        "! comment\n"
+        '"vec" VEC_REL 1e-4 1.0 0.0 1e3\n'
+        '"str" STR "T" "abc"\n'
+        '"count" ABS 1e-6 1.0 2.0\n'
+        '"type" ABS 1e-6 1.0\n'
+    )
+    now_fn = tmp_path / "output.now"
+    now_fn.write_text(
+        '"abs" ABS 1e-6 1.0 2.001\n'
+        '"rel" REL 1e-3 100.05 -200.1\n'
+        '"vec" VEC_REL 1e-4 1.01 0.05 1e3\n'
+        '"str" STR "T" "abc"\n'
+        '"count" ABS 1e-6 1.0\n'
+        '"type" REL 1e-6 1.0\n'
+    )
+    now = load_output_data(now_fn)
+    correct = load_output_data(correct_fn)
+
+    assert now.lines == load_output_file(now_fn)
+
+    within_tolerance = real_lines_within_tolerance(now, correct)
+    assert list(within_tolerance) == [
+        False,  # Out of tolerance
+        True,
+        True,
+        False,  # STR lines are not checked in bulk
+        False,  # Number of values differs
+        False,  # Types differ
+    ]
+    for now_line, correct_line, ok in zip(now.lines[:3], correct.lines[:3], within_tolerance):
+        assert check_real_line(now_line, correct_line) == ok
@@ -1,22 +1,18 @@
 from __future__ import annotations
 
 import pathlib
-from typing import NamedTuple
+from typing import NamedTuple, Sequence
 
 import numpy as np
 import pytest
 from pytao import SubprocessTao, Tao
 
 import conftest
+from snapshot_store import SnapshotStore, Tolerance, write_snapshot
 
 SNAPSHOTS = conftest.TESTS_ROOT / "snapshots"
 
 
-class Tolerance(NamedTuple):
-    atol: float
-    rtol: float
-
-
 class SnapshotPaths(NamedTuple):
     lat_list: pathlib.Path
 
@@ -41,6 +37,8 @@ examples = pytest.mark.parametrize(
 )
 
 
+# Keys and tolerances of new snapshots. Snapshots are compared using the
+# tolerances stored in their schema file.
 lat_list_to_tolerance = {
     "ele.a.beta": Tolerance(rtol=1e-5, atol=0),
     "ele.b.beta": Tolerance(rtol=1e-5, atol=0),
@@ -60,15 +58,73 @@ def get_snapshot_paths(example_name: str) -> SnapshotPaths:
     example_snapshots.mkdir(parents=True, exist_ok=True)
 
     return SnapshotPaths(
-        lat_list=example_snapshots / "lat_list.npz",
+        lat_list=example_snapshots / "lat_list.zip",
     )
 
 
-def snapshot_lat_list(tao: Tao) -> dict[str, np.ndarray]:
-    return {
-        who: tao.lat_list(elements="*", who=who, flags="-array_out -track_only")
-        for who in lat_list_to_tolerance
-    }
+# `lat_list` attributes with more than one value per element.
+LAT_LIST_WIDTHS = {"ele.mat6": 36, "ele.vec0": 6, "ele.c_mat": 4}
+# `lat_list` attributes with integer values.
+LAT_LIST_INTEGER_WHO = {"orbit.state", "ele.ix_ele", "ele.ix_branch"}
+
+
+def parse_lat_list(lines: Sequence[str], who: Sequence[str]) -> np.ndarray:
+    """
+    Parse the output of a multi-attribute `pipe lat_list` command.
+
+    Each line holds the ';'-separated values of all `who` attributes of one
+    element.
+
+    Returns
+    -------
+    np.recarray
+        One record per element with a field per `who` attribute.
+    """
+    widths = [LAT_LIST_WIDTHS.get(name, 1) for name in who]
+    values = np.array(";".join(lines).split(";") if lines else [], dtype=float)
+    values = values.reshape(len(lines), sum(widths))
+
+    columns = []
+    offset = 0
+    for name, width in zip(who, widths):
+        column = values[:, offset] if width == 1 else values[:, offset : offset + width]
+        if name in LAT_LIST_INTEGER_WHO:
+            column = column.astype(int)
+        columns.append(column)
+        offset += width
+
+    dtype = [(name, column.dtype, column.shape[1:]) for name, column in zip(who, columns)]
+    records = np.recarray(len(lines), dtype=dtype)
+    for name, column in zip(who, columns):
+        records[name] = column
+    return records
+
+
+def lat_list_records(
+    tao: Tao,
+    who: Sequence[str],
+    elements: str = "*",
+    flags: str = "-track_only",
+) -> np.ndarray:
+    """
+    Get several `lat_list` attributes with a single Tao command.
+
+    `tao.lat_list` takes one attribute per call, and each call is a round trip
+    to the Tao subprocess. Without `-array_out`, `pipe lat_list` accepts a
+    comma-separated list of attributes instead. `ele.name` and `ele.key` are
+    not supported as they are not numeric.
+
+    Returns
+    -------
+    np.recarray
+        One record per element with a field per `who` attribute.
+    """
+    lines = tao.cmd(f"pipe lat_list {flags} {elements} {','.join(who)}")
+    return parse_lat_list(lines, who)
+
+
+def snapshot_lat_list(tao: Tao) -> np.ndarray:
+    return lat_list_records(tao, list(lat_list_to_tolerance))
 
 
 @examples
@@ -76,18 +132,53 @@ def test_lat_list_against_snapshot(example_name: str) -> None:
     tao = load_example(example_name)
     paths = get_snapshot_paths(example_name)
 
-    expected_lat_list = np.load(paths.lat_list)
     lat_list = snapshot_lat_list(tao)
 
-    for key, current_value in lat_list.items():
-        tol = lat_list_to_tolerance[key]
-        print(f"Checking {key} with tolerance {tol}")
-        np.testing.assert_allclose(
-            current_value,
-            expected_lat_list[key],
-            atol=tol.atol,
-            rtol=tol.rtol,
-        )
+    with SnapshotStore(paths.lat_list) as expected_lat_list:
+        for key in lat_list.dtype.names:
+            current_value = lat_list[key]
+            if key not in expected_lat_list:
+                pytest.fail(f"{key} is not in the snapshot; run update_snapshots()")
+            tol = expected_lat_list.tolerance(key)
+            print(f"Checking {key} with tolerance {tol}")
+            np.testing.assert_allclose(
+                current_value,
+                expected_lat_list[key],
+                atol=tol.atol,
+                rtol=tol.rtol,
+            )
+
+
+def test_parse_lat_list() -> None:
+    lines = [
+        "  1.00000000000000E+00;  2.50000000000000E+00;1" + ";0" * 6,
+        "  3.00000000000000E+00; -4.00000000000000E-01;0" + ";1" * 6,
+    ]
+    records = parse_lat_list(lines, ["ele.s", "ele.a.beta", "orbit.state", "ele.vec0"])
+    np.testing.assert_array_equal(records["ele.s"], [1.0, 3.0])
+    np.testing.assert_array_equal(records["ele.a.beta"], [2.5, -0.4])
+    np.testing.assert_array_equal(records["orbit.state"], [1, 0])
+    assert records["orbit.state"].dtype.kind == "i"
+    assert records["ele.vec0"].shape == (2, 6)
+    assert parse_lat_list([], ["ele.s"]).shape == (0,)
+
+
+def test_snapshot_store_chunked_reads(tmp_path: pathlib.Path) -> None:
+    arrays = {
+        "a": np.arange(1000, dtype=float),
+        "b": np.arange(24, dtype=np.int64).reshape(4, 6),
+    }
+    tolerances = {"a": Tolerance(atol=1e-9, rtol=0), "b": Tolerance(atol=0, rtol=1e-3)}
+    path = tmp_path / "lat_list.zip"
+    write_snapshot(path, arrays, tolerances, chunk_size=64)
+
+    with SnapshotStore(path) as store:
+        assert store.keys() == ["a", "b"]
+        assert store.tolerance("a") == tolerances["a"]
+        np.testing.assert_array_equal(store["a"], arrays["a"])
+        np.testing.assert_array_equal(store["b"], arrays["b"])
+        np.testing.assert_array_equal(store.read("a", 60, 200), arrays["a"][60:200])
+        assert store.read("a", 10, 10).size == 0
 
 
 def update_snapshots() -> None:
@@ -102,7 +193,11 @@ def update_snapshots() -> None:
         tao = load_example(example_name)
         lat_list = snapshot_lat_list(tao)
 
-        np.savez(paths.lat_list, **lat_list)
+        write_snapshot(
+            paths.lat_list,
+            {key: lat_list[key] for key in lat_list.dtype.names},
+            lat_list_to_tolerance,
+        )
 
 
 if __name__ == "__main__":
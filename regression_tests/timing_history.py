@@ -0,0 +1,333 @@
+"""
+Per-test timing history for the Fortran regression tests.
+
+Both `scripts/run_tests.py` and `test_fortran.py` record the wall time, CPU
+time and peak memory of every test program they run in a small JSON file
+(`~/.cache/bmad-regression/timing_history.json` by default). The history is
+used to schedule the longest tests first, and the per-test trend can be
+printed with:
+
+    python timing_history.py [test_name ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import warnings
+from typing import NamedTuple, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def cache_dir() -> pathlib.Path:
+    """
+    Directory for the files the regression tests keep between runs.
+
+    This is `$XDG_CACHE_HOME/bmad-regression` (`~/.cache/bmad-regression` by
+    default) so that test runs do not leave files in the source tree.
+    """
+    base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return pathlib.Path(base_dir) / "bmad-regression"
+
+
+DEFAULT_HISTORY_FILE = cache_dir() / "timing_history.json"
+
+# Number of runs kept per test.
+MAX_RUNS = 20
+# Number of recent runs used to estimate the duration of a test.
+NUM_COST_RUNS = 5
+
+
+class Timing(NamedTuple):
+    wall: float  # Wall time (sec)
+    cpu: float  # User + system CPU time (sec)
+    max_rss: int  # Peak resident set size (kB)
+    user_cpu: float = 0.0  # User CPU time (sec)
+    sys_cpu: float = 0.0  # System CPU time (sec)
+    major_faults: int = 0  # Page faults that required I/O
+
+
+class TimedRun(NamedTuple):
+    returncode: int
+    output: str
+    timing: Timing
+    timed_out: bool = False
+
+
+def run_timed(
+    command: str | Sequence[str],
+    cwd: str | os.PathLike,
+    *,
+    shell: bool = False,
+    capture: bool = True,
+    timeout: float | None = None,
+) -> TimedRun:
+    """
+    Run a command and measure its resource usage.
+
+    The resource usage is that of the child process together with all of the
+    processes it waited on, so that wrapper scripts like `run.py` are
+    measured including the test binaries they start.
+
+    Parameters
+    ----------
+    command : str or sequence of str
+        The command to run.
+    cwd : path-like
+        Working directory for the command.
+    shell : bool, optional
+        Run the command through the shell.
+    capture : bool, optional
+        Capture stdout and stderr (combined). Otherwise output goes to the
+        terminal and the returned output is empty.
+    timeout : float, optional
+        Time limit in seconds. The command, and any processes it started,
+        are killed when the limit is reached. The output up to that point is
+        returned with `timed_out` set.
+
+    Returns
+    -------
+    TimedRun
+    """
+    t0 = time.monotonic()
+    proc = subprocess.Popen(
+        command,
+        cwd=cwd,
+        shell=shell,
+        stdout=subprocess.PIPE if capture else None,
+        stderr=subprocess.STDOUT if capture else None,
+        errors="replace",
+        # A separate process group so that a timed out command can be killed
+        # together with its children.
+        start_new_session=timeout is not None,
+    )
+
+    chunks = []
+    reader = None
+    if capture:
+        reader = threading.Thread(target=lambda: chunks.append(proc.stdout.read()))
+        reader.start()
+
+    timed_out = False
+    if timeout is None:
+        _, status, usage = os.wait4(proc.pid, 0)
+    else:
+        while True:
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            if time.monotonic() - t0 > timeout:
+                timed_out = True
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                _, status, usage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(0.05)
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if reader is not None:
+        reader.join()
+        proc.stdout.close()
+
+    max_rss = usage.ru_maxrss
+    if sys.platform == "darwin":
+        max_rss //= 1024  # Bytes on macOS
+
+    timing = Timing(
+        wall=time.monotonic() - t0,
+        cpu=usage.ru_utime + usage.ru_stime,
+        max_rss=max_rss,
+        user_cpu=usage.ru_utime,
+        sys_cpu=usage.ru_stime,
+        major_faults=usage.ru_majflt,
+    )
+    return TimedRun(
+        returncode=proc.returncode,
+        output="".join(chunks),
+        timing=timing,
+        timed_out=timed_out,
+    )
+
+
+def load_history(path: pathlib.Path = DEFAULT_HISTORY_FILE) -> dict[str, list[dict]]:
+    """
+    Load the timing history.
+
+    Returns
+    -------
+    dict
+        Maps test name to a list of runs, oldest first. Each run is a dict
+        with the key "date" and the fields of `Timing` ("wall", "cpu",
+        "max_rss", "user_cpu", "sys_cpu" and "major_faults"). Older runs may
+        lack the last three. Empty if the history file does not exist or
+        cannot be read.
+    """
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as ex:
+        # The history only decides the order of the tests, so a damaged file
+        # must not stop a test run. It is rewritten by the next record_timings.
+        warnings.warn(f"Ignoring unreadable timing history {path}: {ex}")
+        return {}
+
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path):
+    """Serialize updates of a file shared between concurrent test processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def record_timings(
+    timings: dict[str, Timing],
+    path: pathlib.Path = DEFAULT_HISTORY_FILE,
+) -> None:
+    """
+    Append test timings to the history file.
+
+    Parameters
+    ----------
+    timings : dict of str to Timing
+        Timing of each test that was run.
+    path : pathlib.Path, optional
+        The history file.
+    """
+    if not timings:
+        return
+
+    date = datetime.datetime.now().isoformat(timespec="seconds")
+    path = pathlib.Path(path)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with file_lock(path):
+        history = load_history(path)
+        for test_name, timing in timings.items():
+            runs = history.setdefault(test_name, [])
+            runs.append({"date": date, **timing._asdict()})
+            del runs[:-MAX_RUNS]
+
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        with open(tmp_path, "w") as fp:
+            json.dump(history, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def expected_duration(history: dict[str, list[dict]], test_name: str) -> float:
+    """
+    Expected wall time of a test: the median of its most recent runs.
+
+    Tests without a history are assumed to be slow (infinite duration) so
+    that they are started early.
+    """
+    runs = history.get(test_name)
+    if not runs:
+        return float("inf")
+    return statistics.median(run["wall"] for run in runs[-NUM_COST_RUNS:])
+
+
+def order_by_cost(
+    test_names: Sequence[str],
+    history: dict[str, list[dict]],
+) -> list[str]:
+    """
+    Order tests longest first according to the history.
+
+    Tests with equal expected duration keep their original order.
+    """
+    return sorted(test_names, key=lambda name: -expected_duration(history, name))
+
+
+def format_trend(
+    history: dict[str, list[dict]],
+    test_names: Sequence[str] | None = None,
+    num_runs: int = 8,
+) -> str:
+    """
+    Format the timing trend of tests as a table.
+
+    Parameters
+    ----------
+    history : dict
+        The timing history.
+    test_names : sequence of str, optional
+        Tests to show. Defaults to all tests in the history, longest first.
+    num_runs : int, optional
+        Number of recent wall times to show per test.
+
+    Returns
+    -------
+    str
+    """
+    if not test_names:
+        test_names = order_by_cost(sorted(history), history)
+
+    lines = [
+        f"{'Test':<30} {'Runs':>4} {'Wall(s)':>9} {'CPU(s)':>9} {'RSS(MB)':>9} {'Change':>8}   Recent wall times (s), oldest first"
+    ]
+    for test_name in test_names:
+        runs = history.get(test_name, [])
+        if not runs:
+            lines.append(f"{test_name:<30} {0:>4}   No timing history")
+            continue
+
+        last = runs[-1]
+        change = ""
+        if len(runs) > 1:
+            previous = statistics.median(run["wall"] for run in runs[-NUM_COST_RUNS - 1 : -1])
+            if previous > 0:
+                change = f"{100 * (last['wall'] - previous) / previous:+.0f}%"
+
+        recent = " ".join(f"{run['wall']:.1f}" for run in runs[-num_runs:])
+        lines.append(
+            f"{test_name:<30} {len(runs):>4} {last['wall']:>9.2f} {last['cpu']:>9.2f} "
+            f"{last['max_rss'] / 1024:>9.1f} {change:>8}   {recent}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Print the timing trend of the Fortran regression tests."
+    )
+    parser.add_argument("test_names", nargs="*", help="Tests to show (default: all)")
+    parser.add_argument(
+        "--history",
+        type=pathlib.Path,
+        default=DEFAULT_HISTORY_FILE,
+        help="Timing history file",
+    )
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    if not history:
+        print(f"No timing history in: {args.history}")
+        return
+    print(format_trend(history, args.test_names))
+
+
+if __name__ == "__main__":
+    main()
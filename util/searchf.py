@@ -4,16 +4,32 @@
 # searchf.py is the file that holds the code for the scripts:
 #   getf
 #   listf
+#   raw_list
 #   create_searchf_namelist
+#   searchf_daemon
 #
 # See the Bmad manual for a description of listf and getf.
 # See create_searchf_namelist for documentation on the searchf.namelist files
 #-
 
+import bisect
+import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
+import pickle
+import socket
+import struct
 import sys
 import re
-from multiprocessing import Pool, Process
+import signal
+import sqlite3
+import time
+from multiprocessing import get_all_start_methods, get_context
+
+import searchf_client
 
 # The idea is to look for a local copy of the library to search.
 # We have found a local copy when we find one specific file that we know 
@@ -34,6 +50,21 @@ class search_com_class:
     self.namelist_file  = ''
     self.file_name_rel_root = ''   # File name relative to the root search directory
     self.search_only_for = ''
+    self.use_index      = True     # Use the symbol index if it can be opened.
+    self.index          = None     # symbol_index_class instance. Opened when first needed.
+    self.watcher        = None     # file_watch_class instance. Only used by the daemon.
+    self.n_processes    = os.cpu_count() or 1   # Number of processes used to search files.
+    self.json           = False    # Print the matches as JSON.
+    self.xref           = ''       # '', 'callers' or 'callees'. See search_xref.
+    self.fuzzy          = False    # Ranked fuzzy search. See search_fuzzy.
+    self.n_top          = 10       # Number of names listed by a fuzzy search.
+    # Patterns compiled from match_str by compile_search_patterns
+    self.re_match_str            = None
+    self.re_type_interface_match = None
+    self.re_f90_prefilter        = None
+    self.f90_prefilter_literal   = b''
+    self.re_c_function           = None
+    self.re_c_name               = None
 
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
@@ -81,6 +112,128 @@ def choose_path (dir_list, root_dir, base_dir, base_file, release_sub_dir):
   if this_dir != '': dir_list.append(this_dir)
   return
 
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# read_cache and write_cache functions
+#
+# Per-user cache files in the searchf cache directory. read_cache returns None if the cache file does
+# not exist or cannot be read. Errors writing a cache file are ignored.
+
+def cache_file (name):
+  return os.path.join(searchf_client.cache_dir(), name + '.pickle')
+
+def read_cache (name):
+  try:
+    with open(cache_file(name), 'rb') as f:
+      return pickle.load(f)
+  except Exception:
+    return None
+
+def write_cache (name, data):
+  file_name = cache_file(name)
+  try:
+    if not os.path.isdir(os.path.dirname(file_name)): os.makedirs(os.path.dirname(file_name))
+    with open(file_name + '.tmp' + str(os.getpid()), 'wb') as f:
+      pickle.dump(data, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(file_name + '.tmp' + str(os.getpid()), file_name)
+  except OSError:
+    pass
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# standard_dir_list function
+#
+# Returns the list of standard search directories found by choose_path.
+# The result, along with anything choose_path printed, is cached per current directory, root_dir,
+# release_dir and dist_dir. The cached result is used as long as the modification times of the
+# directories that choose_path looks in are unchanged, which is the case unless a library has been
+# added or removed there.
+
+MAX_PATH_CACHE = 100
+
+def dir_stamps (root_dir):
+  if root_dir == '':
+    dirs = ['.', '..', '../..', release_dir, dist_dir]
+  else:
+    dirs = [root_dir]
+
+  stamps = []
+  for dir in dirs:
+    if dir == '': continue
+    try:
+      stamps.append((dir, os.stat(dir).st_mtime_ns))
+    except OSError:
+      stamps.append((dir, None))
+  return stamps
+
+def standard_dir_list (root_dir):
+
+  key = (os.getcwd(), root_dir, release_dir, dist_dir)
+  stamps = dir_stamps(root_dir)
+
+  cache = read_cache('paths')
+  if not isinstance(cache, dict): cache = {}
+  if key in cache and cache[key][0] == stamps:
+    stamps, dir_list, output = cache[key]
+    sys.stdout.write(output)
+    return list(dir_list)
+
+  stdout = sys.stdout
+  sys.stdout = io.StringIO()
+  try:
+    dir_list = []
+    choose_path (dir_list, root_dir, r'util_programs', '/mad_to_bmad/madx_to_bmad.py', '')
+    choose_path (dir_list, root_dir, r'forest', '/code/i_tpsa.f90', '')
+    choose_path (dir_list, root_dir, r'bsim', '/code/bsim_interface.f90', '')
+    choose_path (dir_list, root_dir, r'code_examples', '/simple_bmad_program/simple_bmad_program.f90', '')
+    choose_path (dir_list, root_dir, r'sim_utils', '/interfaces/sim_utils.f90', '')
+    choose_path (dir_list, root_dir, r'tao', '/code/tao_struct.f90', '')
+    choose_path (dir_list, root_dir, r'bmad', '/modules/bmad_struct.f90', '')
+    output = sys.stdout.getvalue()
+  finally:
+    sys.stdout = stdout
+
+  sys.stdout.write(output)
+  cache.pop(key, None)
+  cache[key] = (stamps, dir_list, output)
+  while len(cache) > MAX_PATH_CACHE: del cache[next(iter(cache))]    # Drop the oldest entries
+  write_cache('paths', cache)
+  return list(dir_list)
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# read_namelist function
+#
+# Returns the contents of a searchf.namelist file as a list of (file, names, name_lines) tuples where
+# file is the file name relative to the search directory, name_lines are the non-blank lines listed
+# for the file and names is these lines joined together.
+# The parsed namelist is cached per namelist file and used while the file's modification time and size
+# are unchanged.
+
+def read_namelist (namelist_file):
+
+  namelist_file = os.path.abspath(namelist_file)
+  stat = os.stat(namelist_file)
+  cache_name = os.path.join('namelists', hashlib.sha1(namelist_file.encode()).hexdigest())
+
+  cache = read_cache(cache_name)
+  if isinstance(cache, tuple) and cache[0] == (namelist_file, stat.st_mtime_ns, stat.st_size): return cache[1]
+
+  entries = []
+  name_lines = None
+  with open(namelist_file) as f_namelist:
+    for line in f_namelist:
+      if line.strip() == '': continue
+      if line[0:5] == 'File:':
+        name_lines = []
+        entries.append((line[6:].strip(), name_lines))
+      elif name_lines is not None:
+        name_lines.append(line)
+
+  entries = [(file, ''.join(name_lines), name_lines) for file, name_lines in entries]
+  write_cache(cache_name, ((namelist_file, stat.st_mtime_ns, stat.st_size), entries))
+  return entries
+
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
 # print_help_message function
@@ -88,13 +241,28 @@ def choose_path (dir_list, root_dir, base_dir, base_file, release_sub_dir):
 def print_help_message ():
   print ('''
   Usage for getf and listf:
-    getf  {options} <search_string>
-    listf {options} <search_string>
+    getf  {options} <search_string> {<search_string> ...}
+    listf {options} <search_string> {<search_string> ...}
+
+  If the last <search_string> is "-", search strings are read from standard input.
+  With more than one search string, the search directories are scanned once for all of them and
+  the output is the same as running getf/listf for each search string in turn.
 
   Options:
+     --json      # Print the matches as a JSON list with one entry per search string. Each entry has the
+                 #   search string ("query") and a list of "matches" with the "name", "kind", "file",
+                 #   "line", "end_line" and "doc_line" (first line of the comment block, 0 if none) of a match.
+     --callers   # List the routines that call or reference the routines matching <search_string>.
+     --callees   # List the routines called or referenced by the routines matching <search_string>.
+                 #   Only Fortran files are cross-referenced. The references are kept in the symbol index.
+     --fuzzy     # List the names closest to <search_string>, best first, with their kind and file.
+                 #   Names are scored by the fraction of three letter sequences they share with <search_string>.
+     --top <n>   # Number of names listed with --fuzzy. Default is 10.
      -c          # Case sensitive search when searching C/C++ files.
      -d <s_dir>  # Use <s_dir> as the search directory. Will not search standard directories. 
      -h          # Print this help message.
+     -j <n>      # Number of processes used to search files. Default is the number of CPUs.
+     -n          # Do not use the symbol index.
      -r <r_dir>  # Use <r_dir> as the root directory to search for the search directories.
      -s <what>   # Search only for: <what> = "struct", "routine", "parameter", or "module".
 
@@ -105,6 +273,16 @@ def print_help_message ():
   module that matches <search_string>. Wild cards "*" and "." may be used. See the Bmad
   manual for more details.
 
+  getf/listf keep an index of the symbols in each search directory in an SQLite database,
+  by default ~/.cache/searchf/index.sqlite (set with the SEARCHF_INDEX environment variable).
+  Files that have changed since the last search are re-indexed automatically.
+
+  Searches are faster if the searchf daemon is running. Start it with:
+      searchf_daemon &
+  The daemon keeps the index open and only re-indexes after files have changed. getf and listf
+  use the daemon when it is running unless the "-n" option is given. The daemon listens on
+  ~/.cache/searchf/daemon.sock (set with the SEARCHF_SOCKET environment variable).
+
   Note: getf/listf look for search directories locally and then, if not found, look for the
   search directories in a release or distribution. The exception is that if the "-r <r_dir>" option
   is used, getf/listf will only look at the subdirectories of <r_dir> for the search directories.
@@ -118,6 +296,81 @@ def print_help_message ():
 ''')
   sys.exit()
 
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# compile_search_patterns function
+#
+# Compiles the patterns for search_com.match_str once per search.
+#
+# re_f90_prefilter matches any name that search_f90 could match, as a whole word anywhere in a file.
+# It is run over the bytes of each Fortran file so that files without a possible match are
+# skipped without being parsed. There is no prefilter in 'LIST' mode or if match_str has anchors.
+# f90_prefilter_literal is the longest literal (lower case) part of match_str, if any. Checking for
+# it in the lower case bytes is much faster than the case insensitive regex search.
+
+def compile_search_patterns (search_com):
+
+  match_str = search_com.match_str.lower()
+  search_com.re_match_str = re.compile(match_str + '$')
+  search_com.re_type_interface_match = re.compile(r'^(type|interface) +' + match_str + r'\s') 
+
+  if search_com.case_sensitive:
+    search_com.re_c_function = re.compile(' ' + search_com.match_str + r'_?\s*(\(.*\))\s*{')
+    search_com.re_c_name = re.compile(search_com.match_str + '_?$')
+  else:
+    search_com.re_c_function = re.compile(' ' + search_com.match_str + r'_?\s*(\(.*\))\s*{', re.I)
+    search_com.re_c_name = re.compile(search_com.match_str + '_?$', re.I)
+
+  search_com.re_f90_prefilter = None
+  search_com.f90_prefilter_literal = b''
+  name_str = match_str
+  while name_str[-1:] == '$' and name_str[-2:] != '\\$': name_str = name_str[:-1]
+  if search_com.doc_type == 'LIST' or '^' in name_str or '$' in name_str.replace('\\$', ''): return
+  try:
+    search_com.re_f90_prefilter = re.compile((r'(?<!\w)(?:' + name_str + r')(?!\w)').encode('latin-1'), re.I)
+  except (re.error, UnicodeEncodeError):
+    return
+  parts = literal_parts(name_str)[0]
+  if len(parts) > 0: search_com.f90_prefilter_literal = max(parts, key = len).lower().encode('latin-1')
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# f90_file_class and f90_read_file function
+#
+# f90_read_file memory maps a Fortran file and returns a f90_file_class holding its lines. If re_prefilter
+# is not None, None is returned without decoding the file when re_prefilter does not match anywhere in it.
+# If prefilter_literal is not empty, the file is first checked for it in lower case and the lower case
+# copy is also used for re_prefilter and f90_file_class.lower.
+# f90_file_class.lower is the lower case text of the file as bytes for searches that span many lines.
+# Line endings are converted to "\n" in both.
+
+class f90_file_class:
+  def __init__(self, data, lower = None):
+    if b'\r' in data:
+      data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+      lower = None
+    self.lines = io.StringIO(data.decode('ISO-8859-1')).readlines()
+    self.lower = data.lower() if lower is None else lower
+    self.line_starts = None   # Offset of the start of each line. Set by f90_routine_end.
+
+def f90_read_file (file_name, re_prefilter = None, prefilter_literal = b''):
+
+  with open(file_name, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0: return f90_file_class(b'')
+    mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+      if re_prefilter is None: return f90_file_class(mapped[:])
+      if prefilter_literal == b'':
+        if not re_prefilter.search(mapped): return None
+        return f90_file_class(mapped[:])
+      data = mapped[:]
+    finally:
+      mapped.close()
+
+  lower = data.lower()
+  if prefilter_literal not in lower or not re_prefilter.search(lower): return None
+  return f90_file_class(data, lower)
+
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
 # routine_here function
@@ -137,6 +390,38 @@ def routine_here (line2, routine_name):
   else:
     return False
 
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# f90_routine_end function
+#
+# Returns the index of the line after the end of the routine whose body starts at f90_file.lines[n].
+# Contained routines are skipped. Rather than looping over every line of the body, only the lines
+# found by re_f90_routine_bound are looked at. Returns None if the end of file is reached.
+
+re_f90_routine_bound = re.compile((r'\n[^\S\n]*(?:end|' + re_routine.pattern + ')').encode())
+
+def f90_routine_end (f90_file, n, routine_name):
+
+  lines = f90_file.lines
+  if f90_file.line_starts is None:
+    f90_file.line_starts = [0] + list(itertools.accumulate(map(len, lines)))
+  line_starts = f90_file.line_starts
+
+  count = 1
+  for match in re_f90_routine_bound.finditer(f90_file.lower, line_starts[n] - 1):
+    ix = bisect.bisect_right(line_starts, match.start())
+    line2 = lines[ix].lstrip().lower()
+
+    if re_end.match(line2):
+      if re_routine_name_here.match(line2[4:].lstrip()):
+        count -= 1
+    elif routine_here(line2, routine_name):
+      count += 1
+
+    if count == 0: return ix + 1
+
+  return None
+
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
 # search_f90 function
@@ -154,10 +439,15 @@ re_type_interface_end    = re.compile(r'end +(type|interface)')
 re_end                   = re.compile(r'end')
 re_routine_name_here     = re.compile(r'program|subroutine|function|interface')
 
+# Every type, interface, module, routine and "end" statement starts with one of these. Other
+# lines do not need to be checked for them.
+re_f90_header = re.compile(r'interface|type|module|contains|end|program|subroutine|recursive|elemental|' +
+                           r'function|real|integer|logical')
+
 def search_f90 (file_name, search_com):
 
-  re_match_str  = re.compile(search_com.match_str.lower() + '$')
-  re_type_interface_match = re.compile(r'^(type|interface) +' + search_com.match_str.lower() + r'\s') 
+  re_match_str = search_com.re_match_str
+  re_type_interface_match = search_com.re_type_interface_match
 
   found_one_in_this_file = False
   have_printed_file_name = False
@@ -169,17 +459,18 @@ def search_f90 (file_name, search_com):
   comments = []
 
   try:
-    if sys.version_info[0] < 3:
-      f90_file = open(file_name, 'r')
-    else:
-      f90_file = open(file_name, 'r', encoding = 'ISO-8859-1')
+    f90_file = f90_read_file(file_name, search_com.re_f90_prefilter, search_com.f90_prefilter_literal)
   except:
     print ('Note: Cannot open: ' + file_name)
     return
-
-  while True:
-    line = f90_file.readline()
-    if line == '': return
+  if f90_file is None: return
+  lines = f90_file.lines
+  n_lines = len(lines)
+  n = 0
+
+  while n < n_lines:
+    line = lines[n]
+    n += 1
     line2 = line.lstrip().lower()
     if line2.rstrip() == '': 
       blank_line_found = True
@@ -189,9 +480,9 @@ def search_f90 (file_name, search_com):
 
     if re_blank_interface_begin.match(line2):
       while True:
-        line = f90_file.readline()
-        if line == '': return
-        line2 = line.lstrip().lower()
+        if n == n_lines: return
+        line2 = lines[n].lstrip().lower()
+        n += 1
         if re_interface_end.match(line2): break
 
     # Skip "type (" constructs and separator comments.
@@ -205,7 +496,8 @@ def search_f90 (file_name, search_com):
 
     line_list = [line2]
     while line2.rstrip()[-1] == '&':
-      aline = f90_file.readline()
+      aline = lines[n] if n < n_lines else ''
+      n += 1
       line_list.append(aline)
       line2 = line2.rstrip()[:-1] + aline
 
@@ -273,6 +565,10 @@ def search_f90 (file_name, search_com):
       if search_com.doc_type == 'FULL': comments.append(line)
       continue
 
+    if not re_f90_header.match(line2):
+      comments = []
+      continue
+
     # Match to type or interface statement
     # These we type the whole definition
 
@@ -294,8 +590,9 @@ def search_f90 (file_name, search_com):
         if len(comments) > 0: print ('')
         print (line.rstrip())
         while True:
-          line = f90_file.readline()
-          if line == '': return
+          if n == n_lines: return
+          line = lines[n]
+          n += 1
           line2 = line.lstrip().lower()
           print (line.rstrip())
           if re_type_interface_end.match(line2): break
@@ -305,8 +602,9 @@ def search_f90 (file_name, search_com):
         print ('    ' + line.rstrip())
       elif search_com.doc_type == 'RAW':
         while True:
-          line = f90_file.readline()
-          if line == '': return
+          if n == n_lines: return
+          line = lines[n]
+          n += 1
           line2 = line.lstrip().lower()
           if re_type_interface_end.match(line2): break
           print (line.rstrip())
@@ -335,19 +633,8 @@ def search_f90 (file_name, search_com):
 
       # Skip rest of routine including contained routines
 
-      count = 1
-      while True:
-        line = f90_file.readline()
-        if line == '': return
-        line2 = line.lstrip().lower()
-
-        if re_end.match(line2):
-          if re_routine_name_here.match(line2[4:].lstrip()):
-            count -= 1
-        elif routine_here(line2, routine_name):
-            count += 1
-
-        if count == 0: break
+      n = f90_routine_end(f90_file, n, routine_name)
+      if n is None: return
 
     #
 
@@ -355,30 +642,37 @@ def search_f90 (file_name, search_com):
 
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
-# search_c function
+# c_function_defs function
 
 re_quote = re.compile(r'"|\'')
+re_c_token = re.compile(r'[{};]')
+re_c_special = re.compile(r'[{}"\'/]')
 
-def search_c (file_name, search_com):
+# c_function_defs yields, for each top level "{" in a C/C++ file, the text before the "{" since the
+# last top level statement (function_line), the line number, and the comment block and code lines
+# leading up to it.
+#
+# The file is read in one go. Quoted strings and comments are only searched for on lines that contain
+# them, and the braces and semicolons of a line are found with re_c_token instead of looking at
+# each character. Lines inside a function body are skipped unless they have braces, quotes or comments.
+
+def c_function_defs (file_name):
 
-  found_one_in_this_file = False
   in_extended_comment = False
   blank_line_here = False
   n_curly = 0
+  n_line = 0
   comments = []
   lines_after_comments = []
   function_line = ''
-  have_printed_file_name = False
 
-  c_file = open(file_name)
-  while True:
-    try:
-      line = c_file.readline()
-    except:
-      continue    # If line contains a non-ascii character.
-    if line == '': return
+  with open(file_name, errors = 'replace') as c_file:
+    lines = c_file.readlines()
+
+  for line in lines:
+    n_line += 1
     line2 = line.lstrip()
-    if line2.rstrip() == '':
+    if line2 == '':
       blank_line_here = True
       continue
 
@@ -386,16 +680,20 @@ def search_c (file_name, search_com):
 
     if line[0] == '#': continue
 
+    # Inside a function body, only lines with braces, quotes or comments matter.
+
+    if n_curly != 0 and not in_extended_comment and not re_c_special.search(line2): continue
+
     # Throw out quoted substrings
 
-    line2.replace(r'\"', '').replace(r"\'", '')
-    while True:
-      match = re_quote.search(line2)
-      if not match: break
-      char = match.group(0)      
-      ix = line2.find(char, match.end(0))
-      if ix == -1: break
-      line2 = line2[0:match.start(0)] + line2[ix+1:]
+    if '"' in line2 or "'" in line2:
+      while True:
+        match = re_quote.search(line2)
+        if not match: break
+        char = match.group(0)      
+        ix = line2.find(char, match.end(0))
+        if ix == -1: break
+        line2 = line2[0:match.start(0)] + line2[ix+1:]
 
     # Look For multiline comment "/* ... */" construct and remove if present.
 
@@ -409,19 +707,19 @@ def search_c (file_name, search_com):
       else:
         lines_after_comments.append(line)
 
-
-    while True:
-      ix_save = 0
-      if in_extended_comment:
-        ix = line2.find('*/')
-        if ix == -1: break
-        in_extended_comment = False
-        line2 = line2[0:ix_save] + line2[ix+2:]
-      else:
-        ix = line2.find('/*')
-        if ix == -1: break
-        in_extended_comment = True
-        ix_save = ix
+    if in_extended_comment or '/*' in line2:
+      while True:
+        ix_save = 0
+        if in_extended_comment:
+          ix = line2.find('*/')
+          if ix == -1: break
+          in_extended_comment = False
+          line2 = line2[0:ix_save] + line2[ix+2:]
+        else:
+          ix = line2.find('/*')
+          if ix == -1: break
+          in_extended_comment = True
+          ix_save = ix
 
     if line2[0:2] == '//': continue
     if line2.strip() == '': continue
@@ -429,39 +727,26 @@ def search_c (file_name, search_com):
     ix = line2.find('//')
     if ix > -1: line2 = line2[0:ix]
 
-    # Count curly brackets
+    # Count curly brackets. Text at the top level is added to function_line.
 
-    for char in line2:
+    if n_curly != 0 and '{' not in line2 and '}' not in line2: continue
+
+    ix0 = 0
+    for match in re_c_token.finditer(line2):
+      char = match.group(0)
+      ix = match.start(0)
 
       if n_curly == 0: 
-        function_line = function_line + char
+        function_line = function_line + line2[ix0:ix+1]
         if char == ';': 
           function_line = ''
           comments = []
           lines_after_comments = []
+      ix0 = ix + 1
 
       if char == '{':
         n_curly += 1
-        if n_curly == 1:
-          if search_com.case_sensitive:
-            is_match = re.search(' ' + search_com.match_str + r'_?\s*(\(.*\))\s*{', function_line)
-          else:
-            is_match = re.search(' ' + search_com.match_str + r'_?\s*(\(.*\))\s*{', function_line, re.I)
-          if is_match and 'routine'.startswith(search_com.search_only_for):
-            search_com.found_one = True
-            if search_com.doc_type == 'LIST':
-              if not have_printed_file_name: search_com.namelist_file.write('\nFile: '  + search_com.file_name_rel_root + '\n')
-              have_printed_file_name = True
-              search_com.namelist_file.write(is_match.group(1) + '\n')
-            elif search_com.doc_type == 'FULL':
-              print ('\nFile: ' + file_name)
-              for com in comments: print (com.rstrip())
-              for com in lines_after_comments: print (com.rstrip())
-            else:
-              if not found_one_in_this_file: 
-                print ('\nFile: ' + file_name)
-                found_one_in_this_file = True
-              for com in lines_after_comments: print ('    ' + com.rstrip())
+        if n_curly == 1: yield function_line, n_line, comments, lines_after_comments
 
       elif char == '}':
         n_curly -= 1
@@ -469,19 +754,841 @@ def search_c (file_name, search_com):
           function_line = ''
           comments = []
           lines_after_comments = []
-  return
+
+    if n_curly == 0: function_line = function_line + line2[ix0:]
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_c function
+
+def search_c (file_name, search_com):
+
+  found_one_in_this_file = False
+  have_printed_file_name = False
+
+  re_function = search_com.re_c_function
+
+  for function_line, n_line, comments, lines_after_comments in c_function_defs(file_name):
+    is_match = re_function.search(function_line)
+    if is_match and 'routine'.startswith(search_com.search_only_for):
+      search_com.found_one = True
+      if search_com.doc_type == 'LIST':
+        if not have_printed_file_name: search_com.namelist_file.write('\nFile: '  + search_com.file_name_rel_root + '\n')
+        have_printed_file_name = True
+        search_com.namelist_file.write(is_match.group(1) + '\n')
+      elif search_com.doc_type == 'FULL':
+        print ('\nFile: ' + file_name)
+        for com in comments: print (com.rstrip())
+        for com in lines_after_comments: print (com.rstrip())
+      else:
+        if not found_one_in_this_file: 
+          print ('\nFile: ' + file_name)
+          found_one_in_this_file = True
+        for com in lines_after_comments: print ('    ' + com.rstrip())
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# f90_symbols function
+#
+# Returns the modules, parameters, structs (type and interface blocks) and routines found in a
+# Fortran file as a list of (kind, name, line, end_line, doc_line) tuples. Line numbers start at 1.
+# doc_line is the first line of the comment block before the symbol, or 0 if there is none.
+# The file is parsed the same way search_f90 does in 'LIST' mode.
+
+re_type_interface_name = re.compile(r'(type|interface) +(\w+)\s')
+
+def f90_symbols (file_name):
+
+  symbols = []
+  in_module_header = False
+  in_type_def = False
+  routine_name = ['']
+  blank_line_found = False
+  doc_line = 0
+
+  try:
+    f90_file = f90_read_file(file_name)
+  except:
+    return symbols
+  lines = f90_file.lines
+
+  n_lines = len(lines)
+  n = 0
+
+  while n < n_lines:
+    line = lines[n]
+    n += 1
+    line2 = line.lstrip().lower()
+    if line2.rstrip() == '': 
+      blank_line_found = True
+      continue
+
+    # Skip blank interface blocks
+
+    if re_blank_interface_begin.match(line2):
+      while n < n_lines:
+        line2 = lines[n].lstrip().lower()
+        n += 1
+        if re_interface_end.match(line2): break
+      else:
+        return symbols
+
+    # Skip "type (" constructs and separator comments.
+
+    if re_type_var.match(line2): continue
+    if line2[0] == '#': continue
+    if line2[0:10] == '!---------': continue   # ignore separator comment
+    if line2[:11] == 'recursive &': 
+      if doc_line == 0: doc_line = n
+      continue
+
+    start_line = n
+    while line2.rstrip()[-1] == '&' and n < n_lines:
+      line2 = line2.rstrip()[:-1] + lines[n]
+      n += 1
+
+    # In the header section of a module
+
+    match = re_module_begin.match(line2)
+    if match:
+      in_module_header = True
+      name_match = re.match(r'\w+', line2[match.end(0):].lstrip())
+      if name_match: symbols.append(('module', name_match.group(0), start_line, n, doc_line))
+
+    if not in_type_def and re_module_header_end.match(line2): in_module_header = False
+
+    # Parameters
+
+    if in_module_header and re_parameter.search(line2):
+      for chunk in re_parameter.split(line2)[1].split(','):
+        chunk_match = re_parameter1.match(chunk)
+        if chunk_match: symbols.append(('parameter', chunk_match.group(1), start_line, n, doc_line))
+
+    # Comment block
+
+    if line2[0] == '!':
+      if blank_line_found:
+        doc_line = 0
+        blank_line_found = False
+      if doc_line == 0: doc_line = n
+      continue
+
+    if not re_f90_header.match(line2):
+      doc_line = 0
+      continue
+
+    # Type and interface blocks. The end line is found without skipping the block since
+    # interface blocks contain routine definitions.
+
+    if in_type_def and re_type_def_end.match(line2): in_type_def = False
+    if not in_type_def and re_type_def.match(line2): in_type_def = True
+
+    match = re_type_interface_name.match(line2)
+    if match:
+      end_line = n
+      for ix in range(n, n_lines):
+        if re_type_interface_end.match(lines[ix].lstrip().lower()):
+          end_line = ix + 1
+          break
+      symbols.append(('struct', match.group(2), start_line, end_line, doc_line))
+      doc_line = 0
+      continue
+
+    # Routines. Contained routines are skipped.
+
+    if routine_here(line2, routine_name):
+      name = routine_name[0]
+      n = f90_routine_end(f90_file, n, routine_name)
+      if n is None: n = n_lines
+      symbols.append(('routine', name, start_line, n, doc_line))
+
+    doc_line = 0
+
+  return symbols
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# c_symbols function
+#
+# Returns the functions defined in a C/C++ file in the same form as f90_symbols.
+# end_line is the line of the opening "{" of the function body.
+# Like search_c, any name followed by an argument list before the "{" counts. For example,
+# the member names in a constructor initializer list.
+
+re_c_function_name = re.compile(r' (\w+)(?=_?\s*\(.*\)\s*{)')
+
+def c_symbols (file_name):
+
+  symbols = []
+  for function_line, n_line, comments, lines_after_comments in c_function_defs(file_name):
+    line = n_line - len(lines_after_comments) + 1
+    if len(comments) == 0:
+      doc_line = 0
+    else:
+      doc_line = line - len(comments)
+    names = []
+    for match in re_c_function_name.finditer(function_line):
+      if match.group(1) in names: continue
+      names.append(match.group(1))
+      symbols.append(('routine', match.group(1), line, n_line, doc_line))
+
+  return symbols
+
+def file_symbols (file_name):
+  if is_f90_file(file_name): return f90_symbols(file_name)
+  return c_symbols(file_name)
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# f90_calls function
+#
+# Returns the routine references in a Fortran file as a list of (caller, callee, kind, line) tuples.
+# kind is "call" for "call xxx(" statements and "ref" for "xxx(" in other statements. Most "ref"s are
+# array references and not function calls. They are sorted out when the cross-reference is printed by
+# keeping only the names of known routines. Each (caller, callee, kind) is only listed once with the
+# line of the first reference. Names are lower case and the caller of a reference in a contained
+# routine is the contained routine.
+
+re_f90_interface_block = re.compile(r'(abstract +)?interface\s*$')
+re_f90_string          = re.compile(r"'[^']*'|" + r'"[^"]*"')
+re_f90_call            = re.compile(r'(?<![\w%])call\s+(\w+)(?![\w%])')
+re_f90_ref             = re.compile(r'(?<![\w%])([a-z_]\w*)\s*\(')
+
+# Statements that are followed by "(" and intrinsics. Not stored as references.
+f90_non_routines = set('''if elseif while allocate deallocate nullify write read print open close inquire
+  rewind backspace select case where elsewhere forall format return stop go goto do call result
+  real integer logical character complex double type class kind len dimension intent
+  abs sqrt exp log log10 sin cos tan asin acos atan atan2 sinh cosh tanh mod modulo sign nint int
+  floor ceiling dble cmplx conjg aimag max min maxval minval maxloc minloc sum product any all count
+  size shape reshape lbound ubound allocated associated present trim adjustl adjustr index scan
+  verify len_trim achar char ichar iachar huge tiny epsilon matmul transpose dot_product pack merge
+  spread transfer ibset ibclr btest iand ior ieor ishft not'''.split())
+
+def f90_calls (file_name):
+
+  calls = []
+  found = set()
+  routine_stack = []
+  routine_name = ['']
+
+  try:
+    f90_file = f90_read_file(file_name)
+  except:
+    return calls
+
+  lines = f90_file.lines
+  n_lines = len(lines)
+  n = 0
+
+  while n < n_lines:
+    line2 = lines[n].lstrip().lower()
+    n += 1
+    if line2 == '' or line2[0] == '!' or line2[0] == '#': continue
+
+    # Skip interface blocks that only hold routine declarations.
+
+    if re_f90_interface_block.match(line2):
+      while n < n_lines:
+        n += 1
+        if re_interface_end.match(lines[n-1].lstrip().lower()): break
+      continue
+
+    if re_end.match(line2):
+      if re_routine_name_here.match(line2[4:].lstrip()):
+        if len(routine_stack) > 0: routine_stack.pop()
+        continue
+    elif routine_here(line2, routine_name):
+      routine_stack.append(routine_name[0])
+      continue
+
+    if len(routine_stack) == 0: continue
+
+    # Strip strings and comments
+
+    code = line2
+    if "'" in code or '"' in code: code = re_f90_string.sub("''", code)
+    ix = code.find('!')
+    if ix > -1: code = code[:ix]
+
+    caller = routine_stack[-1]
+    call_starts = set()
+
+    for match in re_f90_call.finditer(code):
+      call_starts.add(match.start(1))
+      key = (caller, match.group(1), 'call')
+      if key not in found:
+        found.add(key)
+        calls.append(key + (n,))
+
+    if '(' not in code or '::' in code: continue   # Declarations do not have routine references.
+
+    for match in re_f90_ref.finditer(code):
+      name = match.group(1)
+      if match.start(1) in call_starts or name in f90_non_routines: continue
+      key = (caller, name, 'ref')
+      if key not in found:
+        found.add(key)
+        calls.append(key + (n,))
+
+  return calls
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# file_index_entries function
+#
+# Returns the symbols and routine references of a file for the symbol index.
+
+def file_index_entries (file_name):
+  if is_f90_file(file_name): return f90_symbols(file_name), f90_calls(file_name)
+  return c_symbols(file_name), []
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# walk_search_files function
+#
+# Yields (directory, file_name) for the files below search_base_dir that getf/listf search,
+# in os.walk order. Hidden directories and "production" and "debug" directories are skipped.
+# If dirs is a list, the directories walked are appended to it.
+
+def walk_search_files (search_base_dir, dirs = None):
+
+  for this_search_base_dir, sub_dirs, files in os.walk(search_base_dir):
+    if dirs is not None: dirs.append(this_search_base_dir)
+
+    # Remove from searching hidden directories plus "production" and "debug" derectories
+    i = 0
+    while i < len(sub_dirs):
+      if sub_dirs[i] == 'production' or sub_dirs[i] == 'debug' or sub_dirs[i][0] == '.': 
+        del sub_dirs[i]
+      else:
+        i += 1
+
+    for this_file in files:
+      if is_search_file(this_file): yield this_search_base_dir, this_file
+
+# Modification time of a file or directory. -1 if it does not exist.
+
+def file_mtime_ns (file_name):
+  try:
+    return os.stat(file_name).st_mtime_ns
+  except OSError:
+    return -1
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# symbol_index_class
+#
+# Persistent index of the symbols in the search directories. The index is an SQLite database,
+# by default in the user's cache directory. Before a search directory is looked up, its new
+# files and files whose modification time or size changed are re-scanned, and symbols of
+# deleted files are removed.
+#
+# Lookups return candidate files only. These are then searched by search_file so the output
+# is the same as without the index.
+#
+# The routine references found by f90_calls are also stored for the --callers and --callees
+# cross-reference searches.
+
+INDEX_VERSION = 3
+
+def default_index_file ():
+  if 'SEARCHF_INDEX' in os.environ: return os.environ['SEARCHF_INDEX']
+  return os.path.join(searchf_client.cache_dir(), 'index.sqlite')
+
+# literal_parts returns the literal substrings that any name matched by the regular
+# expression match_str must contain, and whether the first of these is a prefix of the name.
+
+def literal_parts (match_str):
+
+  if '|' in match_str or '(' in match_str or '[' in match_str: return [], False
+
+  parts = ['']
+  is_prefix = True
+  i = 0
+  while i < len(match_str):
+    char = match_str[i]
+    if char == '\\':
+      parts.append('')
+      i += 2
+      continue
+    if char in '*?{':       # Quantifier: the previous character is optional.
+      parts[-1] = parts[-1][:-1]
+      parts.append('')
+      if char == '{':
+        ix = match_str.find('}', i)
+        if ix == -1: return [], False
+        i = ix
+    elif char in '.^$+':
+      parts.append('')
+    else:
+      parts[-1] += char
+    if parts[0] == '': is_prefix = False
+    i += 1
+
+  return [part for part in parts if part != ''], is_prefix
+
+class symbol_index_class:
+
+  def __init__(self, index_file):
+    index_dir = os.path.dirname(index_file)
+    if index_dir != '' and not os.path.isdir(index_dir): os.makedirs(index_dir)
+    self.db = sqlite3.connect(index_file, timeout = 60)
+
+    if self.db.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+      self.db.executescript("""
+        DROP TABLE IF EXISTS files;
+        DROP TABLE IF EXISTS symbols;
+        DROP TABLE IF EXISTS symbols_fts;
+        DROP TABLE IF EXISTS calls;
+        DROP TABLE IF EXISTS stamps;
+      """)
+
+    self.db.executescript("""
+      CREATE TABLE IF NOT EXISTS files (
+        id       INTEGER PRIMARY KEY,
+        root     TEXT NOT NULL,       -- Search directory
+        rel_name TEXT NOT NULL,       -- File name relative to root
+        seq      INTEGER NOT NULL,    -- Position in search order
+        mtime_ns INTEGER NOT NULL,
+        size     INTEGER NOT NULL,
+        UNIQUE (root, rel_name)
+      );
+      CREATE TABLE IF NOT EXISTS symbols (
+        id         INTEGER PRIMARY KEY,
+        file_id    INTEGER NOT NULL,
+        name       TEXT NOT NULL,
+        lower_name TEXT NOT NULL,
+        kind       TEXT NOT NULL,     -- "routine", "struct", "parameter" or "module"
+        line       INTEGER NOT NULL,
+        end_line   INTEGER NOT NULL,
+        doc_line   INTEGER NOT NULL   -- First line of the doc comment. 0 if none.
+      );
+      CREATE TABLE IF NOT EXISTS calls (
+        id      INTEGER PRIMARY KEY,
+        file_id INTEGER NOT NULL,
+        caller  TEXT NOT NULL,        -- Lower case names. See f90_calls.
+        callee  TEXT NOT NULL,
+        kind    TEXT NOT NULL,        -- "call" or "ref"
+        line    INTEGER NOT NULL
+      );
+      CREATE TABLE IF NOT EXISTS stamps (
+        root     TEXT NOT NULL,
+        rel_name TEXT NOT NULL,       -- Directory walked, or searchf.namelist, relative to root
+        mtime_ns INTEGER NOT NULL,    -- -1 if the file does not exist
+        UNIQUE (root, rel_name)
+      );
+      CREATE INDEX IF NOT EXISTS symbols_file_id ON symbols (file_id);
+      CREATE INDEX IF NOT EXISTS symbols_lower_name ON symbols (lower_name);
+      CREATE INDEX IF NOT EXISTS calls_file_id ON calls (file_id);
+      CREATE INDEX IF NOT EXISTS calls_caller ON calls (caller);
+      CREATE INDEX IF NOT EXISTS calls_callee ON calls (callee);
+    """)
+
+    # Substring lookups use a trigram full text index when SQLite supports it.
+    try:
+      self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS symbols_fts USING fts5(lower_name, tokenize = 'trigram')")
+      self.has_fts = True
+    except sqlite3.OperationalError:
+      self.has_fts = False
+
+    self.db.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+    self.db.commit()
+
+  #---------------------
+  # Update the index for the files of a search directory.
+  #
+  # A directory's modification time changes when files are added, removed or renamed in it. If no
+  # directory walked last time, and not the searchf.namelist file, has changed, the set of files and
+  # their order are unchanged. Then the walk is skipped and only the known files are checked for changes.
+  #
+  # Files are in the order of searchf.namelist, if it exists, so that the output is in the same order
+  # as a search using the namelist. Files not in searchf.namelist come after, in walk order.
+
+  def refresh (self, search_base_dir, n_processes = 1):
+    db = self.db
+    root = os.path.abspath(search_base_dir)
+    known = {}
+    for file_id, rel_name, seq, mtime_ns, size in db.execute(
+                'SELECT id, rel_name, seq, mtime_ns, size FROM files WHERE root = ?', (root,)):
+      known[rel_name] = (file_id, seq, mtime_ns, size)
+
+    stamps = db.execute('SELECT rel_name, mtime_ns FROM stamps WHERE root = ?', (root,)).fetchall()
+    if len(stamps) > 0 and all(file_mtime_ns(os.path.join(search_base_dir, rel_name)) == old_mtime_ns
+                                                                    for rel_name, old_mtime_ns in stamps):
+      changed = []
+      for rel_name, (file_id, seq, old_mtime_ns, old_size) in known.items():
+        try:
+          stat = os.stat(search_base_dir + rel_name)
+        except OSError:
+          break       # Deleted and the directory time not changed. Do a full refresh.
+        if stat.st_mtime_ns == old_mtime_ns and stat.st_size == old_size: continue
+        self.remove_symbols(file_id)
+        db.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?', (stat.st_mtime_ns, stat.st_size, file_id))
+        changed.append((file_id, search_base_dir + rel_name))
+      else:
+        self.index_files(changed, n_processes)
+        db.commit()
+        return
+
+    # Walk the directory
+
+    dirs = []
+    walked = []
+    for this_search_base_dir, this_file in walk_search_files(search_base_dir, dirs):
+      full_file_name = os.path.join(this_search_base_dir, this_file)
+      walked.append((full_file_name.replace(search_base_dir, '', 1), full_file_name))
+
+    namelist_file = search_base_dir + 'searchf.namelist'
+    namelist_order = {}
+    if os.path.isfile(namelist_file):
+      for file, names, name_lines in read_namelist(namelist_file):
+        namelist_order.setdefault(file, len(namelist_order))
+    walked.sort(key = lambda file: namelist_order.get(file[0], len(namelist_order)))   # Stable sort
+
+    seq = 0
+    changed = []
+    for rel_name, full_file_name in walked:
+      try:
+        stat = os.stat(full_file_name)
+      except OSError:
+        continue
+      seq += 1
+
+      old = known.pop(rel_name, None)
+      if old is not None and old[2] == stat.st_mtime_ns and old[3] == stat.st_size:
+        if old[1] != seq: db.execute('UPDATE files SET seq = ? WHERE id = ?', (seq, old[0]))
+        continue
+
+      if old is None:
+        file_id = db.execute('INSERT INTO files (root, rel_name, seq, mtime_ns, size) VALUES (?, ?, ?, ?, ?)',
+                             (root, rel_name, seq, stat.st_mtime_ns, stat.st_size)).lastrowid
+      else:
+        file_id = old[0]
+        self.remove_symbols(file_id)
+        db.execute('UPDATE files SET seq = ?, mtime_ns = ?, size = ? WHERE id = ?',
+                   (seq, stat.st_mtime_ns, stat.st_size, file_id))
+
+      changed.append((file_id, full_file_name))
+
+    self.index_files(changed, n_processes)
+
+    # Files that no longer exist
+
+    for file_id, seq, mtime_ns, size in known.values():
+      self.remove_symbols(file_id)
+      db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    db.execute('DELETE FROM stamps WHERE root = ?', (root,))
+    db.executemany('INSERT INTO stamps (root, rel_name, mtime_ns) VALUES (?, ?, ?)',
+                   [(root, rel_name, file_mtime_ns(search_base_dir + rel_name))
+                    for rel_name in [this_dir.replace(search_base_dir, '', 1) for this_dir in dirs] + ['searchf.namelist']])
+
+    db.commit()
+
+  #---------------------
+  # Parse the files of the (file_id, full_file_name) list and add their symbols and references.
+
+  def index_files (self, files, n_processes):
+    db = self.db
+    file_names = [full_file_name for file_id, full_file_name in files]
+    for (file_id, full_file_name), (symbols, calls) in zip(files, map_files(file_index_entries, file_names, n_processes)):
+      for kind, name, line, end_line, doc_line in symbols:
+        symbol_id = db.execute('INSERT INTO symbols (file_id, name, lower_name, kind, line, end_line, doc_line) ' +
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (file_id, name, name.lower(), kind, line, end_line, doc_line)).lastrowid
+        if self.has_fts: db.execute('INSERT INTO symbols_fts (rowid, lower_name) VALUES (?, ?)', (symbol_id, name.lower()))
+      db.executemany('INSERT INTO calls (file_id, caller, callee, kind, line) VALUES (?, ?, ?, ?, ?)',
+                     [(file_id,) + call for call in calls])
+
+  #---------------------
+  # Return all symbols of a search directory as (rel_name, kind, name, line, end_line, doc_line) tuples
+  # in search order.
+
+  def symbols (self, search_base_dir):
+    return self.db.execute('SELECT f.rel_name, s.kind, s.name, s.line, s.end_line, s.doc_line ' +
+                           'FROM symbols s JOIN files f ON f.id = s.file_id WHERE f.root = ? ORDER BY f.seq, s.id',
+                           (os.path.abspath(search_base_dir),)).fetchall()
+
+  #---------------------
+  # Return the routine references of a search directory that may match match_str, as
+  # (rel_name, caller, callee, kind, line) tuples in search order. With xref = 'callers' the callee
+  # is matched and with 'callees' the caller. match_str must be lower case. As with lookup, the
+  # references returned are candidates that search_xref then matches against match_str.
+
+  def calls (self, search_base_dir, xref, match_str):
+    column = 'c.callee' if xref == 'callers' else 'c.caller'
+    parts, is_prefix = literal_parts(match_str)
+
+    join = 'JOIN'
+    where = ''
+    args = [os.path.abspath(search_base_dir)]
+
+    if is_prefix:
+      join = 'CROSS JOIN'     # Forces the calls_caller or calls_callee index to be used instead of calls_file_id.
+      where = ' AND ' + column + ' >= ? AND ' + column + ' < ?'
+      args += [parts[0], parts[0] + '\uffff']
+    elif len(parts) > 0:
+      where = ' AND instr(' + column + ', ?) > 0'
+      args.append(max(parts, key = len))
+
+    return self.db.execute('SELECT f.rel_name, c.caller, c.callee, c.kind, c.line FROM calls c ' + join +
+                           ' files f ON f.id = c.file_id WHERE f.root = ?' + where + ' ORDER BY f.seq, c.id', args).fetchall()
+
+  #---------------------
+  # Return the set of the lower case names in names that are routines of the search directories.
+
+  def routines (self, search_base_dirs, names):
+    roots = [os.path.abspath(search_base_dir) for search_base_dir in search_base_dirs]
+    names = list(names)
+    found = set()
+
+    for i in range(0, len(names), 500):     # Keep below the SQLite limit on the number of parameters.
+      these_names = names[i:i+500]
+      query = ('SELECT DISTINCT s.lower_name FROM symbols s JOIN files f ON f.id = s.file_id ' +
+               "WHERE s.kind = 'routine' AND s.lower_name IN (%s) AND f.root IN (%s)" %
+               (', '.join('?' * len(these_names)), ', '.join('?' * len(roots))))
+      found.update(name for (name,) in self.db.execute(query, these_names + roots))
+
+    return found
+
+  def remove_symbols (self, file_id):
+    if self.has_fts:
+      self.db.execute('DELETE FROM symbols_fts WHERE rowid IN (SELECT id FROM symbols WHERE file_id = ?)', (file_id,))
+    self.db.execute('DELETE FROM symbols WHERE file_id = ?', (file_id,))
+    self.db.execute('DELETE FROM calls WHERE file_id = ?', (file_id,))
+
+  #---------------------
+  # Return the names, relative to the search directory, of the files with symbols that may match
+  # match_str, in search order. Names are matched case insensitively and a trailing "$" or "_" is
+  # ignored, which covers the matching done by search_f90 and search_c.
+
+  def lookup (self, search_base_dir, match_str):
+    root = os.path.abspath(search_base_dir)
+    re_name = re.compile('(?:' + match_str + ')$', re.I)
+    parts, is_prefix = literal_parts(match_str.lower())
+
+    query = 'SELECT f.rel_name, f.seq, s.name FROM symbols s JOIN files f ON f.id = s.file_id WHERE f.root = ?'
+    args = [root]
+    long_parts = [part for part in parts if len(part) >= 3]
+
+    if self.has_fts and len(long_parts) > 0:
+      part = max(long_parts, key = len)
+      query += ' AND s.id IN (SELECT rowid FROM symbols_fts WHERE symbols_fts MATCH ?)'
+      args.append('"' + part.replace('"', '""') + '"')
+    elif is_prefix:
+      query += ' AND s.lower_name >= ? AND s.lower_name < ?'
+      args += [parts[0], parts[0] + '\uffff']
+
+    files = {}
+    for rel_name, seq, name in self.db.execute(query, args):
+      if rel_name in files: continue
+      if re_name.match(name) or (name[-1] in '$_' and re_name.match(name[:-1])): files[rel_name] = seq
+
+    return sorted(files, key = files.get)
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# get_symbol_index function
+#
+# Returns the symbol index, or None if the index is not used or cannot be opened.
+
+def get_symbol_index (search_com):
+
+  if not search_com.use_index: return None
+  if search_com.index is None:
+    try:
+      search_com.index = symbol_index_class(default_index_file())
+    except (sqlite3.Error, OSError) as err:
+      print ('Note: Cannot open the symbol index: ' + str(err))
+      search_com.use_index = False
+      return None
+  return search_com.index
 
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
 # search_file function
 
+def is_f90_file (file_name):
+  return file_name[-4:] == '.f90' or file_name[-4:] == '.inc'
+
+def is_c_file (file_name):
+  return file_name[-4:] == '.cpp' or file_name[-2:] == '.h' or file_name[-2:] == '.c'
+
+def is_search_file (file_name):
+  if re.search ('#', file_name): return False
+  if file_name[0] == '.': return False
+  return is_f90_file(file_name) or is_c_file(file_name)
+
 def search_file (search_base_dir, file_dir, file_name, search_com):
-  if re.search ('#', file_name): return
-  if file_name[0] == '.': return
+  if not is_search_file(file_name): return
   full_file_name = os.path.join(file_dir, file_name)
   search_com.file_name_rel_root = full_file_name.replace(search_base_dir, '', 1)
-  if file_name[-4:] == '.f90' or file_name[-4:] == '.inc': search_f90(full_file_name, search_com)
-  if file_name[-4:] == '.cpp' or file_name[-2:] == '.h' or file_name[-2:] == '.c': search_c(full_file_name, search_com)
+  if is_f90_file(file_name): search_f90(full_file_name, search_com)
+  if is_c_file(file_name): search_c(full_file_name, search_com)
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# map_files function
+#
+# Yields func(arg) for each arg in arg_list, in order. The calls are run in a pool of n_processes
+# worker processes when there are enough files to make this worthwhile.
+# Worker processes are forked so this is only done where fork is available.
+
+PARALLEL_MIN_FILES = 50
+
+def map_files (func, arg_list, n_processes):
+
+  if n_processes < 2 or len(arg_list) < PARALLEL_MIN_FILES or 'fork' not in get_all_start_methods():
+    for arg in arg_list: yield func(arg)
+    return
+
+  pool = get_context('fork').Pool(n_processes)
+  try:
+    for result in pool.imap(func, arg_list, chunksize = max(1, len(arg_list) // (4 * n_processes))):
+      yield result
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_file_job function
+#
+# Runs search_file in a worker process. The printed output and the searchf.namelist output are
+# returned as strings so that the parent process can write them in file order.
+
+def search_file_job (job):
+
+  search_base_dir, file_dir, file_name, settings = job
+  search_com = search_com_class()
+  search_com.doc_type, search_com.match_str, search_com.case_sensitive, search_com.search_only_for = settings
+  search_com.namelist_file = io.StringIO()
+  compile_search_patterns(search_com)
+
+  stdout = sys.stdout
+  sys.stdout = io.StringIO()
+  try:
+    search_file(search_base_dir, file_dir, file_name, search_com)
+    output = sys.stdout.getvalue()
+  finally:
+    sys.stdout = stdout
+
+  return output, search_com.namelist_file.getvalue(), search_com.found_one
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_files function
+#
+# Searches a list of (directory, file_name) files. The output is the same as calling search_file
+# for each file in turn.
+
+def search_files (search_base_dir, file_list, search_com):
+
+  if search_com.n_processes < 2 or len(file_list) < PARALLEL_MIN_FILES:
+    for file_dir, file_name in file_list: search_file (search_base_dir, file_dir, file_name, search_com)
+    return
+
+  settings = (search_com.doc_type, search_com.match_str, search_com.case_sensitive, search_com.search_only_for)
+  jobs = [(search_base_dir, file_dir, file_name, settings) for file_dir, file_name in file_list]
+
+  for output, namelist_output, found_one in map_files(search_file_job, jobs, search_com.n_processes):
+    sys.stdout.write(output)
+    if namelist_output != '': search_com.namelist_file.write(namelist_output)
+    if found_one: search_com.found_one = True
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# create_namelist function
+#
+# Writes the searchf.namelist file of a search directory. The namelist lines of each file are kept,
+# together with the file's modification time, size and content hash, in the state file
+# .searchf.namelist.state next to the namelist. Only files that are new or whose content has changed
+# since the last run are re-scanned. The state is not used if searchf.py has changed.
+
+def file_hash (file_name):
+  digest = hashlib.sha1()
+  with open(file_name, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''): digest.update(chunk)
+  return digest.hexdigest()
+
+def create_namelist (search_base_dir, search_com):
+
+  namelist_file = search_base_dir + 'searchf.namelist'
+  state_file = search_base_dir + '.searchf.namelist.state'
+  parser_hash = file_hash(os.path.abspath(__file__).replace('.pyc', '.py'))
+
+  # State of the last run. Maps file name to [mtime_ns, size, hash, namelist_lines]
+
+  old_files = {}
+  try:
+    with open(state_file) as f:
+      state = json.load(f)
+    if state['parser'] == parser_hash: old_files = state['files']
+  except (OSError, ValueError, KeyError):
+    pass
+
+  new_files = {}
+  file_list = []
+  to_scan = []
+
+  for this_search_base_dir, this_file in walk_search_files(search_base_dir):
+    full_file_name = os.path.join(this_search_base_dir, this_file)
+    rel_name = full_file_name.replace(search_base_dir, '', 1)
+    file_list.append(rel_name)
+    try:
+      stat = os.stat(full_file_name)
+      digest = ''
+      old = old_files.get(rel_name)
+      if old is not None and old[0] == stat.st_mtime_ns and old[1] == stat.st_size:
+        new_files[rel_name] = old
+        continue
+      digest = file_hash(full_file_name)
+      if old is not None and old[2] == digest:
+        new_files[rel_name] = [stat.st_mtime_ns, stat.st_size, digest, old[3]]
+        continue
+      file_state = [stat.st_mtime_ns, stat.st_size, digest]
+    except OSError:
+      file_state = None   # search_file will print a note.
+    to_scan.append((rel_name, this_search_base_dir, this_file, file_state))
+
+  # Scan new and changed files
+
+  settings = (search_com.doc_type, search_com.match_str, search_com.case_sensitive, search_com.search_only_for)
+  jobs = [(search_base_dir, file_dir, file_name, settings) for rel_name, file_dir, file_name, file_state in to_scan]
+
+  for (rel_name, file_dir, file_name, file_state), (output, namelist_output, found_one) in \
+                                  zip(to_scan, map_files(search_file_job, jobs, search_com.n_processes)):
+    sys.stdout.write(output)
+    if file_state is None:
+      new_files[rel_name] = [0, 0, '', namelist_output]
+    else:
+      new_files[rel_name] = file_state + [namelist_output]
+
+  # Write the namelist and state files
+
+  with open(namelist_file + '.tmp', 'w') as f:
+    for rel_name in file_list: f.write(new_files[rel_name][3])
+  os.replace(namelist_file + '.tmp', namelist_file)
+
+  with open(state_file + '.tmp', 'w') as f:
+    json.dump({'parser': parser_hash, 'files': new_files}, f)
+  os.replace(state_file + '.tmp', state_file)
+
+  print ('  Scanned ' + str(len(to_scan)) + ' of ' + str(len(file_list)) + ' files.')
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# refresh_index function
+#
+# Brings the symbol index of a search directory up to date. With the daemon, this is skipped if no
+# files have changed.
+
+def refresh_index (index, search_base_dir, search_com):
+  watcher = search_com.watcher
+  if watcher is None or watcher.needs_refresh(search_base_dir):
+    index.refresh(search_base_dir, search_com.n_processes)
+    if watcher is not None: watcher.refreshed(search_base_dir)
 
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
@@ -493,75 +1600,503 @@ def search_tree (search_base_dir, search_com):
   if search_base_dir[-1] != '/': search_base_dir = search_base_dir + '/'
   namelist_file = search_base_dir + 'searchf.namelist'
 
-  # Open file for namelist output if needed
+  # Create the namelist file if needed
 
   if search_com.doc_type == 'LIST':
     if os.access(search_base_dir, os.W_OK):
       print ('Creating: ' + namelist_file)
-      search_com.namelist_file = open(namelist_file, 'w')
+      create_namelist (search_base_dir, search_com)
     else:
       print ('CANNOT WRITE TO: ' + namelist_file)
+    return
+
+  # Use the symbol index to find the files with matches.
+
+  if search_com.doc_type != 'LIST':
+    index = get_symbol_index(search_com)
+    if index is not None:
+      refresh_index(index, search_base_dir, search_com)
+      for rel_name in index.lookup(search_base_dir, search_com.match_str):
+        file = rel_name.rsplit('/', 1)
+        if len(file) == 1:
+          search_file (search_base_dir, search_base_dir, file[0], search_com)
+        else:
+          search_file (search_base_dir, search_base_dir + file[0], file[1], search_com)
       return
 
   # If there is an existing searchf.namelist file then use this to see if there are matches.
+  # The names of a file are only searched line by line if the pattern matches somewhere in them.
 
   if search_com.doc_type != 'LIST' and os.path.isfile(namelist_file):
 
-    f_namelist = open(namelist_file)
-    have_searched_file = False
+    re_name = re.compile(search_com.match_str)
+    re_names = re.compile(search_com.match_str, re.M)
 
-    for line in f_namelist:
-      if line == '': return
-      if line.strip() == '': continue
+    for file, names, name_lines in read_namelist(namelist_file):
+      if not re_names.search(names): continue
+      for line in name_lines:
+        if re_name.search(line):
+          file = file.rsplit('/', 1)
+          if len(file) == 1:     # No directory spec
+            search_file (search_base_dir, search_base_dir, file[0], search_com)
+          else:
+            search_file (search_base_dir, search_base_dir + file[0], file[1], search_com)
+          break
 
-      if line[0:5] == 'File:':
-        file = line[6:].strip().rsplit('/', 1)
-        have_searched_file = False
-        if len(file) == 1:     # No directory spec
-          this_search_base_dir = search_base_dir
-          this_file = file[0]
-        else:
-          this_search_base_dir = search_base_dir + file[0]
-          this_file = file[1]
-        continue
-      elif have_searched_file:
-        continue
+    return
 
-      if re.search(search_com.match_str, line):
-        search_file (search_base_dir, this_search_base_dir, this_file, search_com)
-        have_searched_file = True
+  # No searchf.namelist: Search all files
 
-    return
+  search_files (search_base_dir, list(walk_search_files(search_base_dir)), search_com)
 
-  # No searchf.namelist: Loop over all directories
+  # End
 
-  for this_search_base_dir, sub_dirs, files in os.walk(search_base_dir):
+  return
 
-    # Remove from searching hidden directories plus "production" and "debug" derectories
-    i = 0
-    while i < len(sub_dirs):
-      if sub_dirs[i] == 'production' or sub_dirs[i] == 'debug' or sub_dirs[i][0] == '.': 
-        del sub_dirs[i]
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# tree_symbols function
+#
+# Returns the symbols of all files of a search directory as a list of
+# (rel_name, kind, name, line, end_line, doc_line) tuples in search order.
+# The symbol index is used if it can be opened. Otherwise every file is parsed.
+
+def tree_symbols (search_base_dir, search_com):
+
+  index = get_symbol_index(search_com)
+  if index is not None:
+    refresh_index(index, search_base_dir, search_com)
+    return index.symbols(search_base_dir)
+
+  file_names = [os.path.join(file_dir, file_name) for file_dir, file_name in walk_search_files(search_base_dir)]
+  symbols = []
+  for full_file_name, these_symbols in zip(file_names, map_files(file_symbols, file_names, search_com.n_processes)):
+    rel_name = full_file_name.replace(search_base_dir, '', 1)
+    for symbol in these_symbols: symbols.append((rel_name,) + tuple(symbol))
+  return symbols
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_batch function
+#
+# Searches for each string of match_list. The search directories are scanned once, with tree_symbols,
+# for all the search strings. The files with a matching symbol are then searched with search_file,
+# except with --json where the matches are printed as JSON.
+
+def symbol_matches (search_com, rel_name, name):
+  if is_f90_file(rel_name):
+    return search_com.re_match_str.match(name) or (name[-1] == '$' and search_com.re_match_str.match(name[:-1]))
+  else:
+    return search_com.re_c_name.match(name)
+
+def search_batch (dir_list, match_list, search_com):
+
+  tree_list = []
+  for search_base_dir in dir_list:
+    if search_base_dir == '': continue    # Directory not found by choose_path
+    if search_base_dir[-1] != '/': search_base_dir = search_base_dir + '/'
+    tree_list.append((search_base_dir, tree_symbols(search_base_dir, search_com)))
+
+  results = []
+
+  for match_str_in in match_list:
+    search_com.match_str = match_str_in.replace(r'*', r'\w*')
+    search_com.found_one = False
+    compile_search_patterns(search_com)
+    matches = []
+
+    for search_base_dir, symbols in tree_list:
+      matched_files = {}
+      for rel_name, kind, name, line, end_line, doc_line in symbols:
+        if not kind.startswith(search_com.search_only_for): continue
+        if not symbol_matches(search_com, rel_name, name): continue
+        matched_files[rel_name] = True
+        matches.append({'name': name, 'kind': kind, 'file': search_base_dir + rel_name,
+                        'line': line, 'end_line': end_line, 'doc_line': doc_line})
+
+      if search_com.json: continue
+
+      for rel_name in matched_files:
+        file_dir, file_name = os.path.split(search_base_dir + rel_name)
+        search_file (search_base_dir, file_dir, file_name, search_com)
+
+    if search_com.json:
+      results.append({'query': match_str_in, 'matches': matches})
+    elif not search_com.found_one:
+      print ('Cannot match String: ' + match_str_in)
+      print ('Use "-h" command line option to list options.')
+    else:
+      print ('')
+
+  if search_com.json: print (json.dumps(results, indent = 1))
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# tree_calls function
+#
+# Returns the routine references of all files of a search directory as a list of
+# (rel_name, caller, callee, kind, line) tuples in search order. See f90_calls.
+# Every Fortran file is parsed. This is used when the symbol index cannot be opened.
+
+def tree_calls (search_base_dir, search_com):
+
+  file_names = [os.path.join(file_dir, file_name) for file_dir, file_name in walk_search_files(search_base_dir)
+                                                                         if is_f90_file(file_name)]
+  calls = []
+  for full_file_name, these_calls in zip(file_names, map_files(f90_calls, file_names, search_com.n_processes)):
+    rel_name = full_file_name.replace(search_base_dir, '', 1)
+    for call in these_calls: calls.append((rel_name,) + tuple(call))
+  return calls
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_xref function
+#
+# Cross-reference search. With search_com.xref = 'callers', lists the routines that call or reference
+# the routines matching each string of match_list. With 'callees', lists the routines that the
+# matching routines call or reference. References that are not "call" statements are only listed
+# if the referenced name is a routine in one of the search directories.
+#
+# With the symbol index, the references and routines are looked up in the index for each search string.
+# Otherwise the references and routines of all files are found once for all the search strings.
+
+def search_xref (dir_list, match_list, search_com):
+
+  index = get_symbol_index(search_com)
+  tree_list = []
+  routine_names = set()
+  for search_base_dir in dir_list:
+    if search_base_dir == '': continue    # Directory not found by choose_path
+    if search_base_dir[-1] != '/': search_base_dir = search_base_dir + '/'
+    if index is None:
+      for rel_name, kind, name, line, end_line, doc_line in tree_symbols(search_base_dir, search_com):
+        if kind == 'routine': routine_names.add(name.lower())
+      tree_list.append((search_base_dir, tree_calls(search_base_dir, search_com)))
+    else:
+      refresh_index(index, search_base_dir, search_com)
+      tree_list.append((search_base_dir, None))
+
+  results = []
+
+  for match_str_in in match_list:
+    search_com.match_str = match_str_in.replace(r'*', r'\w*')
+    compile_search_patterns(search_com)
+    re_match_str = search_com.re_match_str
+    matches = []
+
+    for search_base_dir, calls in tree_list:
+      if calls is None: calls = index.calls(search_base_dir, search_com.xref, search_com.match_str.lower())
+      for rel_name, caller, callee, kind, line in calls:
+        if search_com.xref == 'callers':
+          if not re_match_str.match(callee): continue
+        else:
+          if not re_match_str.match(caller): continue
+        matches.append({'caller': caller, 'callee': callee, 'kind': kind,
+                        'file': search_base_dir + rel_name, 'line': line})
+
+    if index is not None:
+      ref_names = set(match['callee'] for match in matches if match['kind'] == 'ref')
+      routine_names = index.routines([search_base_dir for search_base_dir, calls in tree_list], ref_names)
+    matches = [match for match in matches if match['kind'] == 'call' or match['callee'] in routine_names]
+
+    if search_com.json:
+      results.append({'query': match_str_in, 'matches': matches})
+      continue
+
+    if len(matches) == 0:
+      print ('Cannot match String: ' + match_str_in)
+      print ('Use "-h" command line option to list options.')
+      continue
+
+    file_name = ''
+    for match in matches:
+      if match['file'] != file_name:
+        file_name = match['file']
+        print ('\nFile: ' + file_name)
+      if match['kind'] == 'call':
+        print ('    ' + match['caller'] + ' -> ' + match['callee'] + '   line ' + str(match['line']))
       else:
-        i += 1
+        print ('    ' + match['caller'] + ' -> ' + match['callee'] + '   line ' + str(match['line']) + '  (reference)')
+    print ('')
+
+  if search_com.json: print (json.dumps(results, indent = 1))
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_fuzzy function
+#
+# Ranked fuzzy search. For each string of match_list, the search_com.n_top symbol names that are
+# most similar to the string are listed, together with the kind and location of each definition.
+# The similarity of two names is the number of trigrams (three letter sequences) they have in
+# common divided by the number of distinct trigrams in both. Names are compared in lower case and
+# "*" in the search string is ignored. Ties are broken by the difference in length.
+
+def trigrams (name):
+  name = '  ' + name + ' '
+  return set(name[i:i+3] for i in range(len(name) - 2))
+
+def search_fuzzy (dir_list, match_list, search_com):
+
+  # Definitions of each name, in search order.
+
+  definitions = {}
+  for search_base_dir in dir_list:
+    if search_base_dir == '': continue    # Directory not found by choose_path
+    if search_base_dir[-1] != '/': search_base_dir = search_base_dir + '/'
+    for rel_name, kind, name, line, end_line, doc_line in tree_symbols(search_base_dir, search_com):
+      if not kind.startswith(search_com.search_only_for): continue
+      definitions.setdefault(name.lower(), []).append({'name': name, 'kind': kind,
+                                                       'file': search_base_dir + rel_name, 'line': line})
+
+  name_trigrams = [(name, trigrams(name)) for name in definitions]
+  results = []
+
+  for match_str_in in match_list:
+    query = match_str_in.replace('*', '').lower()
+    query_trigrams = trigrams(query)
+
+    scores = []
+    for name, these_trigrams in name_trigrams:
+      n_common = len(query_trigrams & these_trigrams)
+      if n_common == 0: continue
+      score = n_common / (len(query_trigrams) + len(these_trigrams) - n_common)
+      scores.append((-score, abs(len(name) - len(query)), name))
+    scores.sort()
+
+    matches = []
+    for score, length_diff, name in scores[:search_com.n_top]:
+      for definition in definitions[name]:
+        matches.append(dict(definition, score = round(-score, 3)))
+
+    if search_com.json:
+      results.append({'query': match_str_in, 'matches': matches})
+      continue
 
-    # Now loop over all files
+    if len(matches) == 0:
+      print ('Cannot match String: ' + match_str_in)
+      print ('Use "-h" command line option to list options.')
+      continue
 
-    for this_file in files: search_file (search_base_dir, this_search_base_dir, this_file, search_com)
+    print ('\nClosest names to: ' + match_str_in)
+    for match in matches:
+      print ('  %5.3f  %-40s %-10s %s:%d' % (match['score'], match['name'], match['kind'], match['file'], match['line']))
+    print ('')
 
-  # End
+  if search_com.json: print (json.dumps(results, indent = 1))
 
-  return
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# inotify_class
+#
+# Minimal interface to the Linux inotify file change notification system. The file descriptor is
+# non-blocking so read_events returns immediately if there are no events.
+# Raises OSError if inotify is not available.
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_ISDIR       = 0x40000000
+
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+                IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+class inotify_class:
+
+  def __init__(self):
+    if not sys.platform.startswith('linux'): raise OSError('inotify is only available on Linux')
+    import ctypes, ctypes.util      # Only the daemon needs these. Importing them slows getf start up.
+    self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+    self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0: raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+  # Returns the watch descriptor or -1 if the directory cannot be watched.
+  def add_watch (self, dir_name):
+    return self.libc.inotify_add_watch(self.fd, os.fsencode(dir_name), IN_WATCH_MASK)
+
+  # Returns a list of (watch_descriptor, mask, name) events.
+  def read_events (self):
+    events = []
+    while True:
+      try:
+        buf = os.read(self.fd, 65536)
+      except BlockingIOError:
+        return events
+      ix = 0
+      while ix < len(buf):
+        wd, mask, cookie, length = struct.unpack_from('iIII', buf, ix)
+        name = buf[ix+16:ix+16+length].rstrip(b'\0').decode(errors = 'replace')
+        events.append((wd, mask, name))
+        ix += 16 + length
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# file_watch_class
+#
+# Used by the daemon to decide when the symbol index of a search directory needs to be refreshed.
+# With inotify, every sub-directory searched by walk_search_files is watched and a refresh is only
+# done after a search file or directory has changed. Without inotify, the search directories are
+# polled: a search directory is refreshed if it has not been refreshed in the last poll_interval seconds.
+
+POLL_INTERVAL = 2.0     # Seconds
+
+class file_watch_class:
+
+  def __init__(self, poll_interval = POLL_INTERVAL):
+    self.poll_interval = poll_interval
+    self.refresh_time = {}   # Search directory -> time of last refresh.
+    self.changed = set()     # Search directories changed since the last refresh.
+    self.wd_roots = {}       # Watch descriptor -> set of search directories.
+    try:
+      self.inotify = inotify_class()
+    except (OSError, AttributeError) as err:
+      print ('Note: File change notification not available. Polling instead: ' + str(err))
+      self.inotify = None
+
+  def needs_refresh (self, search_base_dir):
+    root = os.path.abspath(search_base_dir)
+    if root not in self.refresh_time: return True
+    if self.inotify is None: return time.time() - self.refresh_time[root] > self.poll_interval
+
+    for wd, mask, name in self.inotify.read_events():
+      if mask & IN_Q_OVERFLOW:
+        self.changed.update(self.refresh_time)
+      elif name == '' or mask & IN_ISDIR or is_search_file(name):
+        self.changed.update(self.wd_roots.get(wd, ()))
+
+    return root in self.changed
+
+  # Called after the index of search_base_dir has been refreshed. Directories created since the last
+  # refresh are watched from now on.
+
+  def refreshed (self, search_base_dir):
+    root = os.path.abspath(search_base_dir)
+    self.refresh_time[root] = time.time()
+    self.changed.discard(root)
+    if self.inotify is None: return
+
+    for this_dir, sub_dirs, files in os.walk(search_base_dir):
+      sub_dirs[:] = [d for d in sub_dirs if d != 'production' and d != 'debug' and d[0] != '.']
+      wd = self.inotify.add_watch(this_dir)
+      if wd >= 0: self.wd_roots.setdefault(wd, set()).add(root)
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# run_daemon function
+#
+# Runs the searchf daemon. The daemon keeps the symbol index open, refreshes it only when files
+# have changed (see file_watch_class), and answers the searches sent by searchf_client over a
+# Unix socket. Searches are done one at a time in the current directory of the client.
+
+# Raised by the SIGTERM handler of the daemon. This is not a SystemExit so that it is not mistaken for
+# the sys.exit() of print_help_message during a search.
+
+class daemon_stop_class(BaseException):
+  pass
+
+def daemon_stop (signum, frame):
+  raise daemon_stop_class()
+
+class daemon_class:
+  def __init__(self):
+    self.index = symbol_index_class(default_index_file())
+    self.watcher = file_watch_class()
+
+def daemon_search (daemon, request):
+  global release_dir, dist_dir
+
+  os.chdir(request['cwd'])
+  env = request['env']
+  release_dir = env['ACC_RELEASE_DIR'] + '/' if 'ACC_RELEASE_DIR' in env else ''
+  dist_dir = env['DIST_BASE_DIR'] + '/' if 'DIST_BASE_DIR' in env else ''
+
+  stdout = sys.stdout
+  sys.stdout = io.StringIO()
+  try:
+    search_all(request['doc_type'], request['argv'], daemon)
+  except SystemExit:
+    pass         # From print_help_message.
+  except Exception as err:
+    print ('searchf daemon error: ' + repr(err))
+  finally:
+    output = sys.stdout.getvalue()
+    sys.stdout = stdout
+
+  return output
+
+def run_daemon (socket_file = None):
+
+  if socket_file is None: socket_file = searchf_client.default_socket_file()
+  socket_dir = os.path.dirname(socket_file)
+  if socket_dir != '' and not os.path.isdir(socket_dir): os.makedirs(socket_dir)
+
+  # Remove the socket file of a daemon that is no longer running.
+
+  if os.path.exists(socket_file):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      sock.connect(socket_file)
+      print ('searchf daemon already running: ' + socket_file)
+      return
+    except OSError:
+      os.remove(socket_file)
+    finally:
+      sock.close()
+
+  daemon = daemon_class()
+  signal.signal(signal.SIGTERM, daemon_stop)
+
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  old_umask = os.umask(0o077)   # Only the user may connect.
+  try:
+    server.bind(socket_file)
+  finally:
+    os.umask(old_umask)
+  server.listen(16)
+  print ('searchf daemon listening on: ' + socket_file)
+  sys.stdout.flush()
+
+  try:
+    while True:
+      conn, address = server.accept()
+      try:
+        chunks = []
+        while True:
+          chunk = conn.recv(65536)
+          if chunk == b'': break
+          chunks.append(chunk)
+        request = json.loads(b''.join(chunks).decode())
+        conn.sendall(daemon_search(daemon, request).encode())
+      except (OSError, ValueError, KeyError) as err:
+        print ('searchf daemon: Bad request: ' + repr(err))
+      finally:
+        conn.close()
+  except (KeyboardInterrupt, daemon_stop_class):
+    pass
+  finally:
+    server.close()
+    os.remove(socket_file)
 
 #------------------------------------------------------------------------------------
 #------------------------------------------------------------------------------------
 # Main routine
 
-def search_all (doc_type):
+def search_all (doc_type, argv = None, daemon = None):
+
+  if argv is None: argv = searchf_client.read_stdin_args(sys.argv)
 
   search_com = search_com_class()
   search_com.found_one = False
   search_com.doc_type = doc_type
+  if daemon is not None:
+    search_com.index = daemon.index
+    search_com.watcher = daemon.watcher
 
   #-----------------------------------------------------------
   # Look for arguments
@@ -572,10 +2107,10 @@ def search_all (doc_type):
   search_com.search_only_for = ''
 
   i = 0
-  while i < len(sys.argv):
+  while i < len(argv):
     i += 1
-    if i >= len(sys.argv): break
-    arg = sys.argv[i]
+    if i >= len(argv): break
+    arg = argv[i]
 
     if i == 1 and len(arg) == 0:
       print_help_message ()
@@ -586,25 +2121,51 @@ def search_all (doc_type):
       search_all = True    # Not used.
       continue
 
+    if arg == '--json':
+      search_com.json = True
+      continue
+
+    if arg == '--callers' or arg == '--callees':
+      search_com.xref = arg[2:]
+      continue
+
+    if arg == '--fuzzy':
+      search_com.fuzzy = True
+      continue
+
+    if arg == '--top':
+      search_com.n_top = int(argv[i+1])
+      i += 1
+      continue
+
     if arg == '-c':
       search_com.case_sensitive = True
       continue
 
     if arg == '-d':
-      dir_list = [sys.argv[i+1]]
+      dir_list = [argv[i+1]]
       i += 1
       continue
 
     if arg == '-h':
       print_help_message ()
 
+    if arg == '-j':
+      search_com.n_processes = int(argv[i+1])
+      i += 1
+      continue
+
+    if arg == '-n':
+      search_com.use_index = False
+      continue
+
     if arg == '-r':
-      root_dir = sys.argv[i+1]
+      root_dir = argv[i+1]
       i += 1
       continue
 
     if arg == '-s':
-      s = sys.argv[i+1] 
+      s = argv[i+1] 
       search_com.search_only_for = s
       if not 'struct'.startswith(s) and not 'routine'.startswith(s) and \
          not 'parameter'.startswith(s) and not 'module'.startswith(s):
@@ -620,24 +2181,30 @@ def search_all (doc_type):
   # Setup dir_list list, etc
 
   if len(dir_list) == 0:    # If no -d command line arg
-    choose_path (dir_list, root_dir, r'util_programs', '/mad_to_bmad/madx_to_bmad.py', '')
-    choose_path (dir_list, root_dir, r'forest', '/code/i_tpsa.f90', '')
-    choose_path (dir_list, root_dir, r'bsim', '/code/bsim_interface.f90', '')
-    choose_path (dir_list, root_dir, r'code_examples', '/simple_bmad_program/simple_bmad_program.f90', '')
-    choose_path (dir_list, root_dir, r'sim_utils', '/interfaces/sim_utils.f90', '')
-    choose_path (dir_list, root_dir, r'tao', '/code/tao_struct.f90', '')
-    choose_path (dir_list, root_dir, r'bmad', '/modules/bmad_struct.f90', '')
+    dir_list = standard_dir_list(root_dir)
 
   if search_com.doc_type == 'LIST':
     search_com.match_str = r'(\w+)'
-    if i > 0 and i < len(sys.argv): dir_list = [sys.argv[i]]
+    if i > 0 and i < len(argv): dir_list = [argv[i]]
   else:
-    if i == 0 or i >= len(sys.argv): 
+    if i == 0 or i >= len(argv): 
       print ('NO SEARCH STRING FOUND!')
       print_help_message()  # Nothing to match to
-    match_str_in = sys.argv[i]
+    match_list = argv[i:]
+    if search_com.xref != '':
+      search_xref (dir_list, match_list, search_com)
+      return
+    if search_com.fuzzy:
+      search_fuzzy (dir_list, match_list, search_com)
+      return
+    if search_com.json or len(match_list) > 1:
+      search_batch (dir_list, match_list, search_com)
+      return
+    match_str_in = match_list[0]
     search_com.match_str = match_str_in.replace(r'*', r'\w*') 
 
+  compile_search_patterns(search_com)
+
   # Search for a match.
 
   for dir in dir_list:
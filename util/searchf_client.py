@@ -0,0 +1,104 @@
+#+
+# searchf_client.py is the start up code for the scripts:
+#   getf
+#   listf
+#   raw_list
+#
+# If a searchf daemon is running (see searchf_daemon), the command line is passed to the daemon
+# and its output is printed. Otherwise searchf.py is imported and the search is done in this process.
+# This module only imports what is needed to talk to the daemon so that getf starts quickly.
+#
+# See searchf.py for all other documentation.
+#-
+
+import json
+import os
+import socket
+import sys
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# cache_dir function
+#
+# Directory for the searchf symbol index and daemon socket.
+
+def cache_dir ():
+  base_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+  return os.path.join(base_dir, 'searchf')
+
+def default_socket_file ():
+  if 'SEARCHF_SOCKET' in os.environ: return os.environ['SEARCHF_SOCKET']
+  return os.path.join(cache_dir(), 'daemon.sock')
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# query_daemon function
+#
+# Sends a search to the daemon. Returns the output of the search, or None if no daemon is running
+# or the daemon does not answer within READ_TIMEOUT. The search is then done in this process.
+
+CONNECT_TIMEOUT = 1.0     # Seconds
+READ_TIMEOUT = 10.0       # Seconds. Allows for the daemon refreshing the symbol index of a large tree.
+
+def query_daemon (doc_type, argv, socket_file = None):
+
+  if socket_file is None: socket_file = default_socket_file()
+  if not os.path.exists(socket_file): return None
+
+  request = {
+    'doc_type': doc_type,
+    'argv':     argv,
+    'cwd':      os.getcwd(),
+    'env':      {name: os.environ[name] for name in ('ACC_RELEASE_DIR', 'DIST_BASE_DIR') if name in os.environ},
+  }
+
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.settimeout(CONNECT_TIMEOUT)
+    sock.connect(socket_file)
+    sock.settimeout(READ_TIMEOUT)     # For each send and receive.
+    sock.sendall(json.dumps(request).encode() + b'\n')
+    sock.shutdown(socket.SHUT_WR)
+
+    chunks = []
+    while True:
+      chunk = sock.recv(65536)
+      if chunk == b'': break
+      chunks.append(chunk)
+  except OSError:
+    return None
+  finally:
+    sock.close()
+
+  if len(chunks) == 0: return None    # Daemon died before answering.
+  return b''.join(chunks).decode()
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# read_stdin_args function
+#
+# If the last argument is "-", it is replaced by the search strings read from standard input.
+# Search strings are separated by white space or new lines.
+
+def read_stdin_args (argv):
+  if len(argv) < 2 or argv[-1] != '-': return argv
+  return argv[:-1] + sys.stdin.read().split()
+
+#------------------------------------------------------------------------------------
+#------------------------------------------------------------------------------------
+# search_all function
+#
+# The "-n" option (do not use the symbol index) always searches in this process.
+
+def search_all (doc_type):
+
+  argv = read_stdin_args(sys.argv)
+
+  if '-n' not in argv[1:]:
+    output = query_daemon(doc_type, argv)
+    if output is not None:
+      sys.stdout.write(output)
+      return
+
+  import searchf
+  searchf.search_all(doc_type, argv)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+#+
+# Benchmark for madx_to_bmad.py.
+#
+# Writes a synthetic MADX deck with many variables (default 50000) to a scratch directory, translates it
+# with madx_to_bmad.py, and prints the time taken. The variables depend upon each other and are defined
+# in scrambled order with some redefinitions so the deck exercises the ordering of the variable
+# definitions. The Bmad file is checked to make sure that all variables are defined before they are used.
+# With the -l option the variable definitions are all put on one line.
+#
+# Usage:
+#   python benchmark_madx_to_bmad.py {-n <number_of_vars>} {-l} {-k}
+#-
+
+import sys, os, re, argparse, random, shutil, subprocess, tempfile, time
+
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Write the synthetic deck.
+# Variable v<i> only depends upon variables v<j> with j < i so there are no circular definitions.
+
+def write_deck(madx_file, n_var, one_line = False, seed = 1):
+  rand = random.Random(seed)
+
+  defs = []
+  for i in range(n_var):
+    if i == 0:
+      value = '0.1'
+    else:
+      deps = set(rand.randrange(max(0, i-100), i) for n in range(rand.randint(1, 3)))
+      value = ' + '.join(f'{rand.uniform(0.1, 2):.4f} * v{j}' for j in sorted(deps))
+    defs.append(f'v{i} = {value};')
+    if rand.random() < 0.01: defs.append(f'v{i} = {rand.uniform(0.1, 2):.4f};')   # Gets redefined later
+
+  rand.shuffle(defs)
+
+  with open(madx_file, 'w') as f_out:
+    f_out.write('! Synthetic deck written by benchmark_madx_to_bmad.py\n')
+    if one_line:
+      f_out.write(' '.join(defs) + '\n')
+    else:
+      for vdef in defs:
+        f_out.write(vdef + '\n')
+    f_out.write(f'qf: quadrupole, l = 0.5, k1 := v{n_var-1};\n')
+    f_out.write(f'qd: quadrupole, l = 0.5, k1 := -v{n_var//2};\n')
+    f_out.write('ring: sequence, l = 10;\n')
+    f_out.write('qf, at = 2;\n')
+    f_out.write('qd, at = 7;\n')
+    f_out.write('endsequence;\n')
+    f_out.write('use, sequence = ring;\n')
+
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Check that no variable is used in the Bmad file before it is defined.
+
+def check_var_order(bmad_file):
+  re_def = re.compile(r'^(v\d+) = (.*)$')
+  defined = set()
+  n_def = 0
+
+  with open(bmad_file, 'r') as f_in:
+    for line in f_in:
+      match = re_def.match(line)
+      if not match: continue
+      for name in re.findall(r'v\d+', match.group(2)):
+        if name not in defined: return f'{name} used before being defined in: {line.strip()}'
+      defined.add(match.group(1))
+      n_def += 1
+
+  return f'{n_def} variable definitions in order'
+
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Main program.
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-n', '--n_var', help = 'Number of variables in the deck. Default is 50000.', type = int, default = 50000)
+argp.add_argument('-l', '--one_line', help = 'Put all variable definitions on one line.', action = 'store_true')
+argp.add_argument('-k', '--keep', help = 'Keep the scratch directory with the deck and Bmad file.', action = 'store_true')
+arg = argp.parse_args()
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'madx_to_bmad.py')
+work_dir = tempfile.mkdtemp(prefix = 'madx_to_bmad_bench_')
+madx_file = os.path.join(work_dir, 'synthetic.madx')
+
+write_deck(madx_file, arg.n_var, arg.one_line)
+
+start_time = time.time()
+subprocess.run([sys.executable, script, os.path.basename(madx_file)], cwd = work_dir, check = True, stdout = subprocess.DEVNULL)
+run_time = time.time() - start_time
+
+print (f'Variables: {arg.n_var}')
+print (f'Translation time: {run_time:.2f} sec')
+print ('Check: ' + check_var_order(os.path.join(work_dir, 'synthetic.bmad')))
+
+if arg.keep:
+  print ('Scratch directory: ' + work_dir)
+else:
+  shutil.rmtree(work_dir)
@@ -3,9 +3,16 @@
 #+
 # Script to convert from MADX lattice format to Bmad lattice format.
 # See the README file for more details
+#
+# The conversion can also be done from Python:
+#   import madx_to_bmad
+#   madx_to_bmad.convert('lattice.madx')                          # Writes lattice.bmad
+#   bmad_text = madx_to_bmad.convert(madx_text, madx_to_bmad.options_struct(superimpose = True))
+# See the convert function for details.
 #-
 
-import sys, re, math, argparse, time
+import sys, os, io, re, math, argparse, heapq, shutil, tempfile, contextlib
+import concurrent.futures
 from collections import OrderedDict
 
 if sys.version_info[0] < 3 or sys.version_info[1] < 6:
@@ -33,15 +40,29 @@ class seq_struct:
     self.refpos = ''
     self.seq_ele_dict = OrderedDict()
     self.last_ele_offset = ''
-    self.line = ''                   # For when turning a sequence into a line
+    self.line = []                   # Names in line. For when turning a sequence into a line
     self.drift_list = []
 
+# Conversion options. The names are the same as the command line arguments.
+
+class options_struct:
+  def __init__(self, debug = False, many_files = False, superimpose = False, no_prepend_vars = False, jobs = 1):
+    self.debug = debug
+    self.many_files = many_files
+    self.superimpose = superimpose
+    self.no_prepend_vars = no_prepend_vars
+    self.jobs = jobs
+
+# State of a conversion. A new common_struct is used for each conversion.
+
 class common_struct:
-  def __init__(self):
-    self.debug = False               # Command line argument.
-    self.prepend_vars = True         # Command line argument.
-    self.superimpose_eles = False    # Command line argument.
-    self.one_file = True             # Command line argument.
+  def __init__(self, options = None):
+    if options is None: options = options_struct()
+    self.debug = options.debug                      # Command line argument.
+    self.prepend_vars = not options.no_prepend_vars # Command line argument.
+    self.superimpose_eles = options.superimpose     # Command line argument.
+    self.one_file = not options.many_files          # Command line argument.
+    self.jobs = options.jobs                        # Command line argument.
     self.in_seq = False              # Inside a sequence/endsequence construct?
     self.in_track = False            # Inside a track/endtrack construct?
     self.in_match = False            # Inside a match/endmatch construct?
@@ -50,12 +71,13 @@ class common_struct:
     self.seq_dict = OrderedDict()    # List of all sequences.
     self.ele_dict = {}               # Dict of elements
     self.var_def_list = []           # List of "A = B" sets after translation to Bmad. Does not Include "A->P = B" parameter sets.
-    self.var_name_list = []          # List of madx variable names.
+    self.var_name_set = set()        # Set of madx variable names.
     self.super_list = []             # List of superimpose statements to be prepended to the bmad file.
     self.f_in = []         # MADX input files
     self.f_out = []        # Bmad output files
+    self.bmad_files = []   # Names of Bmad files written for called files (many_files option).
+    self.leaf_results = {} # Called file name -> Future for the translation of the file in the process pool.
     self.use = ''
-    self.command = ''    # Scratch storage for read_madx_command routine.
     self.drift_count = 0
 
 #------------------------------------------------------------------
@@ -179,55 +201,62 @@ def is_label_char(char):
 #------------------------------------------------------------------
 # Order var defs so that vars that depend upon other vars are come later.
 # Also comment out first occurances if there are multiple defs of the same var.
+#
+# The defs form a dependency graph where a def depends upon the defs of the variables named in its value.
+# The graph is sorted topologically (Kahn's algorithm). Of the defs that are ready to be written, the one
+# that comes first in the MADX file is written first so that the order of the MADX file is kept as much as possible.
 
-def order_var_def_list():
+re_label = re.compile(r'[\w.]+')   # Label characters. See is_label_char.
 
-  # Mark duplicates
-  dependent_list = {}   # Stores names and dependencies
-  new_def_list = []
+def order_var_def_list(common):
+
+  # Mark duplicates. Only the last def of a variable is kept.
+  last_def = {}
+  for ix, vdef in enumerate(common.var_def_list):
+    last_def[vdef[0]] = ix
 
-  for vdef in reversed(common.var_def_list):
-    if vdef[0] in dependent_list:
-      new_def_list.insert(0, ['! Duplicate: ' + vdef[0], vdef[1]])
+  new_def_list = []
+  for ix, vdef in enumerate(common.var_def_list):
+    if last_def[vdef[0]] == ix:
+      new_def_list.append(vdef)
     else:
-      new_def_list.insert(0, vdef)
-      exp_list = re.split(r'\+|-|\*|/|\(|\)|\^|,', vdef[1])
-      dependent_list[vdef[0]] = list(x.split() for x in exp_list)
+      new_def_list.append(['! Duplicate: ' + vdef[0], vdef[1]])
 
-  common.var_def_list = new_def_list
+  # Dependency graph. n_depend[ix] is the number of vars that def ix depends upon that are not yet written.
 
-  # Move vars that are dependent upon vars defined further up the list.
-  new_def_list = common.var_def_list[:]
+  n_depend = [0] * len(new_def_list)
+  dependents = [[] for vdef in new_def_list]
 
-  ix = 0
-  while ix < len(new_def_list):
-    vdef = new_def_list[ix]
+  for ix, vdef in enumerate(new_def_list):
+    if vdef[0][0] == '!': continue
+    for name in set(re_label.findall(vdef[1])):
+      ix2 = last_def.get(name)
+      if ix2 is None or ix2 == ix: continue
+      dependents[ix2].append(ix)
+      n_depend[ix] += 1
 
-    if vdef[0][0] == '!':
-      ix += 1
-      continue
+  # Topological sort
 
-    moved = False
-    for ix2 in range(len(new_def_list)-1, ix, -1):
-      sub = new_def_list[ix2][0]
-      str = vdef[1]
-      ns = len(str)
-      found = False
-
-      for match in re.finditer(sub, str):
-        j = match.start()
-        k = match.end()
-        if (j == 0 or not is_label_char(str[j-1])) and (k > len(str)-1 or not is_label_char(str[k])): found = True
-
-      if found:
-        new_def_list.pop(ix)
-        new_def_list.insert(ix2, vdef)
-        moved = True
-        break
+  ready = [ix for ix in range(len(new_def_list)) if n_depend[ix] == 0]
+  heapq.heapify(ready)
+  order = []
+
+  while len(ready) > 0:
+    ix = heapq.heappop(ready)
+    order.append(ix)
+    for ix2 in dependents[ix]:
+      n_depend[ix2] -= 1
+      if n_depend[ix2] == 0: heapq.heappush(ready, ix2)
 
-    if not moved: ix += 1
+  # Circular definitions cannot be sorted. Leave them at the end in their original order.
 
-  common.var_def_list = new_def_list
+  if len(order) < len(new_def_list):
+    circular = [ix for ix in range(len(new_def_list)) if n_depend[ix] > 0]
+    print ('CIRCULAR VARIABLE DEFINITIONS: ' + ', '.join(new_def_list[ix][0] for ix in circular) + '\n' +
+           '  You will have to edit the Bmad lattice file by hand to resolve this.')
+    order += circular
+
+  common.var_def_list = [new_def_list[ix] for ix in order]
 
 #------------------------------------------------------------------
 #------------------------------------------------------------------
@@ -249,15 +278,15 @@ def is_zero(input):
 #------------------------------------------------------------------
 # Convert from madx parameter name to bmad parameter name.
 
-def bmad_param(param, ele_name):
+def bmad_param(common, param, ele_name):
   global bmad_param_name
 
-  if ele_name in common.ele_dict:
-    madx_type = common.ele_dict[ele_name].madx_base_type
-  else:
-    madx_type = 'xxxx'
-
   if param == 'tilt':
+    if ele_name in common.ele_dict:
+      madx_type = common.ele_dict[ele_name].madx_base_type
+    else:
+      madx_type = 'xxxx'
+
     if madx_type == 'sbend' or madx_type == 'rbend':
       return 'ref_tilt'
     else:
@@ -339,7 +368,7 @@ def parameter_dictionary(word_lst):
 # Convert expression from MADX format to Bmad format
 # To convert <expression> a construct that look like "<target_param> = <expression>".
 
-def bmad_expression(line, target_param):
+def bmad_expression(common, line, target_param):
   global const_trans, ele_param_factor, negate_param, ele_inv_param_factor
 
   # Remove {, and } chars for something like "kn := {a, b, c}". Also remove leading and ending quote marks
@@ -356,11 +385,11 @@ def bmad_expression(line, target_param):
     if len(lst) >= 4 and lst[1] == '-' and lst[2] =='>':
       if lst[3] in ele_param_factor:
         if (len(lst) >= 5 and lst[4] == '^') or (len(out.strip()) > 0 and out.strip()[-1] == '/'):
-          out += '(' + lst[0] + '[' + bmad_param(lst[3].strip(), lst[0]) + ']' + ele_param_factor[lst[3]]
+          out += '(' + lst[0] + '[' + bmad_param(common, lst[3].strip(), lst[0]) + ']' + ele_param_factor[lst[3]]
         else:
-          out += lst[0] + '[' + bmad_param(lst[3].strip(), lst[0]) + ']' + ele_param_factor[lst[3]]
+          out += lst[0] + '[' + bmad_param(common, lst[3].strip(), lst[0]) + ']' + ele_param_factor[lst[3]]
       else:
-        out += lst[0] + '[' + bmad_param(lst[3].strip(), lst[0]) + ']'
+        out += lst[0] + '[' + bmad_param(common, lst[3].strip(), lst[0]) + ']'
       lst = lst[4:]
 
     elif lst[0] in const_trans:
@@ -402,25 +431,29 @@ def wrap_write(line, f_out):
   MAXLEN = 120
   tab = ''
   line = line.rstrip()
+  ix0 = 0     # Start of the part of the line not yet written.
 
   while True:
-    if len(line) <= MAXLEN+1:
-      f_out.write(tab + line + '\n')
+    if len(line) - ix0 <= MAXLEN+1:
+      f_out.write(tab + line[ix0:] + '\n')
       return
 
-    if ',' in line[:MAXLEN]:
-      ix = line[:MAXLEN].rfind(',')
-      f_out.write(tab + line[:ix+1] + '\n')  # Don't need '&' after a comma
+    ix = line.rfind(',', ix0, ix0+MAXLEN)
+    if ix != -1:
+      f_out.write(tab + line[ix0:ix+1] + '\n')  # Don't need '&' after a comma
 
     else:
       for char in ' -+/*':
-        if char in line[:MAXLEN]:
-          ix = line[:MAXLEN].rfind(char)
-          f_out.write(tab + line[:ix+1] + ' &\n')
+        ix = line.rfind(char, ix0, ix0+MAXLEN)
+        if ix != -1:
+          f_out.write(tab + line[ix0:ix+1] + ' &\n')
           break
+      else:     # No place to break the line
+        f_out.write(tab + line[ix0:] + '\n')
+        return
 
     tab = '         '
-    line = line[ix+1:]
+    ix0 = ix + 1
 
 #------------------------------------------------------------------
 #------------------------------------------------------------------
@@ -472,8 +505,8 @@ def negate(str):
 # Parse a lattice element
 # Assumed to be of the form dlist = ["name", ":", "type", ",", ...]
 
-def parse_and_write_element(dlist, write_to_file, command):
-  global common, ele_type_translate, ignore_madx_param
+def parse_and_write_element(common, dlist, write_to_file, command):
+  global ele_type_translate, ignore_madx_param
 
   if dlist[2] == 'dipedge':
     print ('DIPEDGE ELEMENT NOT TRANSLATED. SUGGESTION: MODIFY THE LATTICE FILE AND MERGE THE DIPEDGE ELEMENT WITH THE NEIGHBORING BEND.')
@@ -627,11 +660,11 @@ def parse_and_write_element(dlist, write_to_file, command):
     if 'knl' in params:
       for n, knl in enumerate(params.pop('knl').split(',')): 
         if knl == '0': continue
-        params['k' + str(n) + 'l'] = bmad_expression(knl, '')
+        params['k' + str(n) + 'l'] = bmad_expression(common, knl, '')
     if 'ksl' in params:
       for n, ksl in enumerate(params.pop('ksl').split(',')):  
         if ksl == '0': continue
-        params['k' + str(n) + 'sl'] = bmad_expression(ksl, '')
+        params['k' + str(n) + 'sl'] = bmad_expression(common, ksl, '')
 
 
   elif ele.madx_base_type == 'collimator':
@@ -649,7 +682,7 @@ def parse_and_write_element(dlist, write_to_file, command):
   # collimator conversion
 
   if 'apertype' in params:
-    aperture = bmad_expression(params.pop('aperture').replace('{', '').replace('}', ''), '')
+    aperture = bmad_expression(common, params.pop('aperture').replace('{', '').replace('}', ''), '')
     [params['x_limit'], params['y_limit']] = aperture.split(',')[2:4]
 
     if params['apertype'] in ['ellipse', 'circle']:
@@ -675,7 +708,7 @@ def parse_and_write_element(dlist, write_to_file, command):
     for param in ele.param:
       if param in ignore_madx_param: continue
       if ele.madx_base_type in ignore_madx_ele_param and param in ignore_madx_ele_param[ele.madx_base_type]: continue
-      line += ', ' + bmad_param(param, ele.name) + ' = ' + bmad_expression(params[param], param)
+      line += ', ' + bmad_param(common, param, ele.name) + ' = ' + bmad_expression(common, params[param], param)
     f_out = common.f_out[-1]
     # Can have situation where an element is defined outside of a sequence ("this_name: that_class") and
     # inside of the sequence get the same definition.
@@ -690,13 +723,31 @@ def parse_and_write_element(dlist, write_to_file, command):
 
   return ele
 
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Name of the MADX file in a "call, file = ..." command.
+
+def call_file_name(command):
+  file = command.split('=')[1].strip()
+  if '"' in file or "'" in file:
+    return file.replace('"', '').replace("'", '')
+  else:
+    return file.lower()    
+
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+
+def print_duplicate_var(name):
+  print (f'Duplicate variable name: {name}\n' + 
+         f'  You may have to edit the Bmad lattice file by hand to resolve this.')
+
 #------------------------------------------------------------------
 #------------------------------------------------------------------
 # The "command" arg is the unsplit madx command.
 # The "dlist" arg is the command split into pieces and converted to lower case.
 
-def parse_command(command, dlist):
-  global common, sequence_refer
+def parse_command(common, command, dlist):
+  global sequence_refer
 
   f_out = common.f_out[-1]
 
@@ -745,16 +796,18 @@ def parse_command(command, dlist):
 
   if common.debug: print (str(dlist))
 
-  i = 0
-  while i < len(dlist):
-    if ' ' in dlist[i] and not any(char in dlist[i] for char in '"\'+-*/^'):
-      split = dlist[i].split()
-      dlist = dlist[:i] + [split[0], ',', split[1]] + dlist[i+1:]
-    i += 1
+  words = []
+  for word in dlist:
+    if ' ' in word and not any(char in word for char in '"\'+-*/^'):
+      split = word.split()
+      words += [split[0], ',', split[1]]
+    else:
+      words.append(word)
+  dlist = words
 
   # Ignore the following.
 
-  if dlist[0] in ['exec' 'while', 'if']: 
+  if dlist[0] in ['while', 'if']: 
     print (f'ERROR: "{dlist[0]}" COMMAND IGNORED: {command}\n' +
             '  THIS MEANS THAT IT IS LIKELY THAT THE BMAD LATTICE WILL BE DIFFERENT FROM THE MADX LATTICE!')
     return
@@ -807,6 +860,7 @@ def parse_command(command, dlist):
   if dlist[0] == 'return':
     common.f_in[-1].close()
     common.f_in.pop()       # Remove last file handle
+    if len(common.f_in) == 0: return    # Return from root file. The root Bmad file is closed by convert.
     if common.one_file:
       f_out.write(f'\n! Returned to File: {common.f_in[-1].name}\n')
     else:
@@ -847,7 +901,7 @@ def parse_command(command, dlist):
     if not common.superimpose_eles and not is_zero(offset):
       drift_name = f'drift{common.drift_count}'
       seq.drift_list.append(f'{drift_name}: drift, l = {offset}')
-      seq.line += drift_name + ', '
+      seq.line.append(drift_name)
       common.drift_count += 1
     
     for ix, drift in enumerate(seq.drift_list):
@@ -858,8 +912,8 @@ def parse_command(command, dlist):
         from_ref_ele = seq.seq_ele_dict[ref_ele_name]
         offset = from_ref_ele.at
         if 'l' in from_ref_ele.param:
-          if seq.refer == 'entry': offset += f' + {add_parens(bmad_expression(from_ref_ele.param["l"], ""), False)/2}'
-          if seq.refer == 'exit': offset += f' - {add_parens(bmad_expression(from_ref_ele.param["l"], ""), False)/2}'
+          if seq.refer == 'entry': offset += f' + {add_parens(bmad_expression(common, from_ref_ele.param["l"], ""), False)/2}'
+          if seq.refer == 'exit': offset += f' - {add_parens(bmad_expression(common, from_ref_ele.param["l"], ""), False)/2}'
         drift = f'{drift[:ix1]}({offset}){drift[ix2+2:]}'
         seq.drift_list[ix] = drift
 
@@ -869,7 +923,7 @@ def parse_command(command, dlist):
     #
 
     if not common.superimpose_eles:
-      wrap_write (f'{seq.name}: line = ({seq.line[:-2]})', f_out)
+      wrap_write (f'{seq.name}: line = ({", ".join(seq.line)})', f_out)
 
     return
 
@@ -919,27 +973,27 @@ def parse_command(command, dlist):
     # This is an element in the sequence...
     # If "name: name, at = X" construct
     if dlist[0] == dlist[2] and dlist[1] == ':':
-      ele = parse_and_write_element(dlist, False, command)
-      offset = bmad_expression(ele.at, '')
+      ele = parse_and_write_element(common, dlist, False, command)
+      offset = bmad_expression(common, ele.at, '')
       ele_name = ele.name
 
     # "name: type, ..." construct
     elif dlist[1] == ':':
-      ele = parse_and_write_element(dlist, True, command)
+      ele = parse_and_write_element(common, dlist, True, command)
       common.last_seq.seq_ele_dict[ele.name] = ele
       ele_name = ele.name
-      offset = bmad_expression(ele.at, '')
+      offset = bmad_expression(common, ele.at, '')
 
     # If "name, at = X, ..." construct
     elif dlist[0] in common.ele_dict:
-      ele = parse_and_write_element([dlist[0], ':']+dlist, False, command)
-      offset = bmad_expression(ele.at, '')
+      ele = parse_and_write_element(common, [dlist[0], ':']+dlist, False, command)
+      offset = bmad_expression(common, ele.at, '')
       ele_name = ele.name
       # If element has modified parameters. Need to create a new element with a unique name with "__N" suffix.
       if len(ele.param) > 0:
         common.ele_dict[dlist[0]].count += 1
         ele_name = f'{dlist[0]}__{common.ele_dict[dlist[0]].count}'
-        ele = parse_and_write_element([ele_name, ':']+dlist, True, command)
+        ele = parse_and_write_element(common, [ele_name, ':']+dlist, True, command)
       seq.seq_ele_dict[ele_name] = ele    # In case this element is used as a positional reference
 
     else:   # Subsequence
@@ -955,10 +1009,10 @@ def parse_command(command, dlist):
       if ele.from_ref_ele != '':
         if ele.from_ref_ele in seq.seq_ele_dict:
           from_ref_ele = seq.seq_ele_dict[ele.from_ref_ele]
-          offset += f' + {add_parens(bmad_expression(from_ref_ele.at, ""), False)}'
+          offset += f' + {add_parens(bmad_expression(common, from_ref_ele.at, ""), False)}'
           if 'l' in from_ref_ele.param:
-            if seq.refer == 'entry': offset += f' + {add_parens(bmad_expression(from_ref_ele.param["l"], ""), False)/2}'
-            if seq.refer == 'exit': offset += f' - {add_parens(bmad_expression(from_ref_ele.param["l"], ""), False)/2}'
+            if seq.refer == 'entry': offset += f' + {add_parens(bmad_expression(common, from_ref_ele.param["l"], ""), False)/2}'
+            if seq.refer == 'exit': offset += f' - {add_parens(bmad_expression(common, from_ref_ele.param["l"], ""), False)/2}'
         else:
           # Ref element is not yet defined so put in marker string "[[...]]" that will be removed later to
           # be replaced by the actual offset.
@@ -988,7 +1042,7 @@ def parse_command(command, dlist):
           else:
             length = ele2.param['l']
 
-        if length != '': length = add_parens(bmad_expression(length, ''), False)
+        if length != '': length = add_parens(bmad_expression(common, length, ''), False)
 
         if seq.refer == 'entry':
           if length != '': last_offset += f' + {length}'
@@ -1001,13 +1055,13 @@ def parse_command(command, dlist):
         if seq.last_ele_offset != '': this_offset += f' - {add_parens(seq.last_ele_offset, False)}'
 
         if is_zero(this_offset):
-          seq.line += f'{ele_name}, '
+          seq.line.append(ele_name)
           seq.last_ele_offset = last_offset
         else:
           drift_name = f'drift{common.drift_count}'
           drift_line = f'{drift_name}: drift, l = {this_offset}'
           seq.drift_list.append(drift_line)
-          seq.line += f'{drift_name}, {ele_name}, '
+          seq.line += [drift_name, ele_name]
           seq.last_ele_offset = last_offset
           common.drift_count += 1
 
@@ -1015,7 +1069,7 @@ def parse_command(command, dlist):
 
     # Must be sequence within a sequence.
 
-    ele = parse_and_write_element([dlist[0], ':', 'sequence']+dlist[1:], False, command)
+    ele = parse_and_write_element(common, [dlist[0], ':', 'sequence']+dlist[1:], False, command)
     ele_name = ele.name
 
     try:
@@ -1024,14 +1078,14 @@ def parse_command(command, dlist):
       print (f'CANNOT IDENTIFY THIS AS AN ELEMENT OR SEQUENCE: {dlist[0]}\n  IN LINE IN SEQUENCE: {command}')
       return
 
-    offset = bmad_expression(ele.at, '')
+    offset = bmad_expression(common, ele.at, '')
 
     if ele.from_ref_ele != '':
       from_ref_ele = seq.ele_dict[ele.from_ref_ele]
-      offset = f'{offset} - {add_parens(bmad_expression(from_ref_ele.at, ""), False)}'
+      offset = f'{offset} - {add_parens(bmad_expression(common, from_ref_ele.at, ""), False)}'
 
     last_offset = offset
-    length = add_parens(bmad_expression(seq2.l, ''), False)
+    length = add_parens(bmad_expression(common, seq2.l, ''), False)
     this_offset = f'{offset}'
 
     if seq2.refpos != '':
@@ -1063,7 +1117,7 @@ def parse_command(command, dlist):
       if seq.last_ele_offset != '': drift_line += f' - {add_parens(seq.last_ele_offset, False)}'
       seq.drift_list.append(drift_line)
       print (f'3: {seq.drift_list[-1]}')
-      seq.line += f'{drift_name}, {ele_name}, '
+      seq.line += [drift_name, ele_name]
       seq.last_ele_offset = last_offset
 
     return
@@ -1085,12 +1139,10 @@ def parse_command(command, dlist):
   # the def to before the point where the element is defined.
 
   if dlist[1] == '=' and not '->' in dlist[0]:
-    if dlist[0] in common.var_name_list:
-      print (f'Duplicate variable name: {dlist[0]}\n' + 
-             f'  You may have to edit the Bmad lattice file by hand to resolve this.')
-    common.var_name_list.append(dlist[0])
+    if dlist[0] in common.var_name_set: print_duplicate_var(dlist[0])
+    common.var_name_set.add(dlist[0])
     name = dlist[0]
-    value = bmad_expression(command.split('=')[1].strip(), '')
+    value = bmad_expression(common, command.split('=')[1].strip(), '')
 
     for param in ele_inv_param_factor:   # Converting something like "z[volt] = xxx" to "z[voltage] = xxx * 1e6"
       str = '[' + param + ']'
@@ -1107,7 +1159,7 @@ def parse_command(command, dlist):
   # "qf, k1 = ..." parameter set
 
   if len(dlist) > 4 and dlist[0] in common.ele_dict and dlist[1] == ',' and dlist[3] == '=':
-    f_out.write(dlist[0] + '[' + bmad_param(dlist[2]) + '] = ' + bmad_expression(''.join(dlist[4:]), dlist[2]) + '\n')
+    f_out.write(dlist[0] + '[' + bmad_param(common, dlist[2]) + '] = ' + bmad_expression(common, ''.join(dlist[4:]), dlist[2]) + '\n')
     return
 
 
@@ -1115,8 +1167,8 @@ def parse_command(command, dlist):
 
   if dlist[1] == '=' and '->' in dlist[0]:
     [ele_name, dummy, param] = dlist[0].partition('->')
-    value = bmad_expression(command.split('=')[1].strip(), param)
-    name = f'{ele_name}[{bmad_param(param, ele_name)}]'
+    value = bmad_expression(common, command.split('=')[1].strip(), param)
+    name = f'{ele_name}[{bmad_param(common, param, ele_name)}]'
     f_out.write(f'{name} = {value}\n')
     return
 
@@ -1124,11 +1176,11 @@ def parse_command(command, dlist):
 
   if dlist[0] == 'call':
 
-    file = command.split('=')[1].strip()
-    if '"' in file or "'" in file:
-      file = file.replace('"', '').replace("'", '')
-    else:
-      file = file.lower()    
+    file = call_file_name(command)
+
+    if file in common.leaf_results and stitch_leaf_file(common, file):
+      f_out.write(f'call, file = {bmad_file_name(file)}\n')
+      return
 
     common.f_in.append(open(file, 'r'))  # Store file handle
     if common.one_file:
@@ -1136,6 +1188,7 @@ def parse_command(command, dlist):
     else:
       f_out.write(f'call, file = {bmad_file_name(file)}\n')
       common.f_out.append(open(bmad_file_name(file), 'w'))
+      common.bmad_files.append(bmad_file_name(file))
     return
 
   # Use
@@ -1156,11 +1209,11 @@ def parse_command(command, dlist):
   if dlist[0] == 'beam' or dlist[2] == 'beam':
     if dlist[0] == 'beam': param = parameter_dictionary(dlist[2:])
     if dlist[2] == 'beam': param = parameter_dictionary(dlist[4:])
-    if 'particle' in param:  f_out.write('parameter[particle] = ' + bmad_expression(param['particle'], '') + '\n')
-    if 'energy'   in param:  f_out.write('parameter[E_tot] = ' + bmad_expression(param['energy'], 'energy') + '\n')
-    if 'pc'       in param:  f_out.write('parameter[p0c] = ' + bmad_expression(param['pc'], 'pc') + '\n')
-    if 'gamma'    in param:  f_out.write('parameter[E_tot] = mass_of(parameter[particle]) * ' + add_parens(bmad_expression(param['gamma'], ''), False) + '\n')
-    if 'npart'    in param:  f_out.write('parameter[n_part] = ' + bmad_expression(param['npart'], '') + '\n')
+    if 'particle' in param:  f_out.write('parameter[particle] = ' + bmad_expression(common, param['particle'], '') + '\n')
+    if 'energy'   in param:  f_out.write('parameter[E_tot] = ' + bmad_expression(common, param['energy'], 'energy') + '\n')
+    if 'pc'       in param:  f_out.write('parameter[p0c] = ' + bmad_expression(common, param['pc'], 'pc') + '\n')
+    if 'gamma'    in param:  f_out.write('parameter[E_tot] = mass_of(parameter[particle]) * ' + add_parens(bmad_expression(common, param['gamma'], ''), False) + '\n')
+    if 'npart'    in param:  f_out.write('parameter[n_part] = ' + bmad_expression(common, param['npart'], '') + '\n')
     return
 
   # twiss
@@ -1170,26 +1223,26 @@ def parse_command(command, dlist):
       param = parameter_dictionary(dlist[2:])
     else:
       param = parameter_dictionary(dlist[4:])
-    if 'betx'   in param: f_out.write(f'beginning[beta_a] = {bmad_expression(param["betx"], "")}\n')
-    if 'bety'   in param: f_out.write(f'beginning[beta_b] = {bmad_expression(param["bety"], "")}\n')
-    if 'alfx'   in param: f_out.write(f'beginning[alpha_a] = {bmad_expression(param["alfx"], "")}\n')
-    if 'alfy'   in param: f_out.write(f'beginning[alpha_a] = {bmad_expression(param["alfy"], "")}\n')
-    if 'mux'    in param: f_out.write(f'beginning[phi_a] = twopi * {add_parens(bmad_expression(param["mux"], ""), False)}\n')
-    if 'muy'    in param: f_out.write(f'beginning[phi_b] = twopi * {add_parens(bmad_expression(param["muy"], ""), False)}\n')
-    if 'dx'     in param: f_out.write(f'beginning[eta_x] = {bmad_expression(param["dx"], "")}\n')
-    if 'dy'     in param: f_out.write(f'beginning[eta_y] = {bmad_expression(param["dy"], "")}\n')
-    if 'dpx'    in param: f_out.write(f'beginning[etap_x] = {bmad_expression(param["dpx"], "")}\n')
-    if 'dpy'    in param: f_out.write(f'beginning[etap_y] = {bmad_expression(param["dpy"], "")}\n')
-    if 'x'      in param: f_out.write(f'particle_start[x] = {bmad_expression(param["x"], "")}\n')
-    if 'y'      in param: f_out.write(f'particle_start[y] = {bmad_expression(param["y"], "")}\n')
-    if 'px'     in param: f_out.write(f'particle_start[px] = {bmad_expression(param["px"], "")}\n')
-    if 'py'     in param: f_out.write(f'particle_start[py] = {bmad_expression(param["py"], "")}\n')
+    if 'betx'   in param: f_out.write(f'beginning[beta_a] = {bmad_expression(common, param["betx"], "")}\n')
+    if 'bety'   in param: f_out.write(f'beginning[beta_b] = {bmad_expression(common, param["bety"], "")}\n')
+    if 'alfx'   in param: f_out.write(f'beginning[alpha_a] = {bmad_expression(common, param["alfx"], "")}\n')
+    if 'alfy'   in param: f_out.write(f'beginning[alpha_a] = {bmad_expression(common, param["alfy"], "")}\n')
+    if 'mux'    in param: f_out.write(f'beginning[phi_a] = twopi * {add_parens(bmad_expression(common, param["mux"], ""), False)}\n')
+    if 'muy'    in param: f_out.write(f'beginning[phi_b] = twopi * {add_parens(bmad_expression(common, param["muy"], ""), False)}\n')
+    if 'dx'     in param: f_out.write(f'beginning[eta_x] = {bmad_expression(common, param["dx"], "")}\n')
+    if 'dy'     in param: f_out.write(f'beginning[eta_y] = {bmad_expression(common, param["dy"], "")}\n')
+    if 'dpx'    in param: f_out.write(f'beginning[etap_x] = {bmad_expression(common, param["dpx"], "")}\n')
+    if 'dpy'    in param: f_out.write(f'beginning[etap_y] = {bmad_expression(common, param["dpy"], "")}\n')
+    if 'x'      in param: f_out.write(f'particle_start[x] = {bmad_expression(common, param["x"], "")}\n')
+    if 'y'      in param: f_out.write(f'particle_start[y] = {bmad_expression(common, param["y"], "")}\n')
+    if 'px'     in param: f_out.write(f'particle_start[px] = {bmad_expression(common, param["px"], "")}\n')
+    if 'py'     in param: f_out.write(f'particle_start[py] = {bmad_expression(common, param["py"], "")}\n')
     return
 
   # Element def
 
   if dlist[1] == ':':
-    parse_and_write_element(dlist, True, command)
+    parse_and_write_element(common, dlist, True, command)
     return
 
   # Unknown
@@ -1198,227 +1251,510 @@ def parse_command(command, dlist):
 
 #------------------------------------------------------------------
 #------------------------------------------------------------------
-# Get next madx command.
-# Read in MADX file line-by-line.  Assemble lines into commands, which are delimited by a ; (colon).
+# Get the madx commands.
+# Read in MADX file line-by-line and split the lines into commands, which are delimited by a ; (semicolon).
+# Yields [command, dlist] for each command. See parse_command for what "command" and "dlist" are.
+#
+# Each line is scanned once: re_madx_delim finds the next character (or "/*" or "//") that ends a word
+# and the text in between is added to the command in one piece. Inside of a quoted string only the closing
+# quote mark and curly braces are looked at.
+#
+# Note: "macro" and "if" statements are strange since they are permitted to 
+# not end with a ';' but with a matching '}'. Internal ";" characters are ignored.
+
+block_commands = ['if', 'elseif', 'else', 'while']
 
-def read_madx_command ():
-  global common
+re_madx_delim = re.compile(r'''[{}"'!;:,=(]|/[*/]''')
+re_madx_in_string = {'"': re.compile(r'[{}"]'), "'": re.compile(r"[{}']")}
+re_blank = re.compile(r'\s*')
 
-  quote_delim = ''  # Quote mark delimiting a string. Blank means not parsing a string yet.
-  in_extended_comment = False
-  command = ''
-  dlist = []
-  curly_brace_count = 0   # Count "{", "}" pairs
+def madx_commands(common):
 
-  # Loop until a command has been found.
-  # Note: "macro" and "if" statements are strange since they are permitted to 
-  # not end with a ';' but with a matching '}'
+  line = ''      # Line being parsed.
+  ix_line = 0    # Start of the part of the line still to be parsed.
+
+  # Loop over commands.
 
   while True:
+    command = []              # Pieces of the command.
+    dlist = []
+    is_block = False          # An "if", "while", etc. or "macro" command?
+    quote_delim = ''          # Quote mark delimiting a string. Blank means not parsing a string yet.
+    quote_text = ''           # Part of a string that is on previous lines.
+    in_extended_comment = False
+    curly_brace_count = 0     # Count "{", "}" pairs
+    found = False             # End of command found?
 
-    # Get a line
+    # Loop over lines until the end of the command has been found.
 
-    if common.command == '':
-      while True:
-        f_in = common.f_in[-1]
-        f_out = common.f_out[-1]
-
-        line = f_in.readline()
-        if len(line) > 0: break    # Check for end of file
-        
-        common.f_in[-1].close()
-        common.f_in.pop()          # Remove last file handle
-        if not common.one_file:
-          common.f_out[-1].close()
-          common.f_out.pop()       # Remove last file handle
-        if len(common.f_in) == 0: return ['', dlist]  # If root file was closed
+    while not found:
 
-    else:
-      f_in = common.f_in[-1]
-      f_out = common.f_out[-1]
-      line = common.command
-      common.command = ''
+      # Get a line
 
-    # Parse line
+      if ix_line == len(line):
+        while True:
+          line = common.f_in[-1].readline()
+          if len(line) > 0: break    # Check for end of file
 
-    line = line.strip()
-    if line.strip() == '':
-      f_out.write('\n')
-      continue
+          common.f_in[-1].close()
+          common.f_in.pop()          # Remove last file handle
+          if len(common.f_in) == 0: return    # If root file was closed
+          if not common.one_file:
+            common.f_out[-1].close()
+            common.f_out.pop()       # Remove last file handle
 
-    if len(line) > 1 and line[0:2] == '#!':   # "#!madx" line
-      f_out.write('! ' + line + '\n')
-      line = ''
-      continue
+        line = line.strip()
+        ix_line = 0
+
+      f_out = common.f_out[-1]
 
-    if in_extended_comment:
-      if '*/' in line:
-        ix = line.find('*/')
-        f_out.write('! ' + line[:ix] + '\n')
-        line = line[ix+2:].strip()
+      # Parse line
+
+      ix_line = re_blank.match(line, ix_line).end()
+      if ix_line == len(line):
+        f_out.write('\n')
+        continue
+
+      if line.startswith('#!', ix_line):   # "#!madx" line
+        f_out.write('! ' + line[ix_line:] + '\n')
+        ix_line = len(line)
+        continue
+
+      if in_extended_comment:
+        ix = line.find('*/', ix_line)
+        if ix == -1:
+          f_out.write('! ' + line[ix_line:] + '\n')
+          ix_line = len(line)
+          continue
+        f_out.write('! ' + line[ix_line:ix] + '\n')
+        ix_line = re_blank.match(line, ix+2).end()
         in_extended_comment = False
-      else:
-        f_out.write ('! ' + line + '\n')
-        line = ''
-      continue
+        if ix_line == len(line): continue
 
-    while line != '':
-      for ix in range(len(line)):
-        #print (f'Ix: {ix} {line[ix]} -{quote_delim}- ' + line)
-        #print (f'C: {command}')
-        #print (f'D: {dlist}')
-
-        if line[ix] == '{': curly_brace_count += 1
-        if line[ix] == '}': 
-          curly_brace_count -= 1
-          if curly_brace_count == 0 and len(dlist) > 0 and (dlist[0] in ['if', 'elseif', 'else' 'while'] or 'macro' in dlist):
-            command += line[:ix]
-            if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
-            common.command = line[ix+1:]
-            return [command, dlist]
-
-        if (line[ix] == '"' or line[ix] == "'"):
-          if line[ix] == quote_delim:      # Found end of string
-            command += quote_delim + line[:ix+1]
-            dlist.append(quote_delim + line[:ix+1])
-            line = line[ix+1:]
-            quote_delim = ''
-            break
+      ix0 = ix_line   # Start of text not yet added to the command.
+      ix = ix_line    # Where to look for the next delimiter.
 
-          elif quote_delim == '':          # Found start of string
-            quote_delim = line[ix]
-            command += line[:ix]
-            if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
-            line = line[ix+1:]
-            break
+      while True:
+        if quote_delim == '':
+          match = re_madx_delim.search(line, ix)
+        else:
+          match = re_madx_in_string[quote_delim].search(line, ix)
+
+        if match is None:   # End of line
+          if quote_delim != '':
+            quote_text += line[ix0:]
+          elif ix0 < len(line):
+            command.append(line[ix0:])
+            dlist.append(line[ix0:].strip())
+            if dlist[-1] == 'macro' or (len(dlist) == 1 and dlist[0] in block_commands): is_block = True
+          ix_line = len(line)
+          break
 
-        if quote_delim != '': continue    # Cycle if in quote string
+        ix = match.start()
+        delim = match.group()
+        if delim == '{': curly_brace_count += 1
+        if delim == '}': curly_brace_count -= 1
 
-        if line[ix] == '!':
-          if len(line) > ix+10 and line[ix:ix+10] == '!!verbatim':
-            f_out.write(line[ix+10:].strip() + '\n')
-          else:
-            f_out.write(line[ix:] + '\n')
-          command += line[:ix]
-          if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
-          line = ''
-          break
+        if delim == '}' and curly_brace_count == 0 and is_block:
+          command.append(quote_text + line[ix0:ix])
+          word = command[-1].strip().lower()
+          found = True
 
-        # "if" or "macro" commands can have internal ";" characters that need to be ignored.
-        elif line[ix] == ';' and not ((len(dlist) > 0 and dlist[0] in ['if', 'elseif', 'else', 'while']) or 'macro' in dlist):
-          command += line[:ix]
-          if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
-          common.command = line[ix+1:]
-          return [command, dlist]
-
-        # Need to split "if(" or "while(" constructs at "(". 
-        # This only is necessary at the start of the command string.
-        elif line[ix] in '{}:,=' or (len(dlist) == 0 and line[ix] == '('):
-          command += line[:ix+1]
-          if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
-          dlist.append(line[ix])
-          line = line[ix+1:]
-          break
+        elif delim == quote_delim:      # Found end of string
+          command.append(quote_delim + quote_text + line[ix0:ix+1])
+          dlist.append(command[-1])
+          quote_delim = ''
+          quote_text = ''
+          ix0 = ix = ix + 1
+          continue
+
+        elif quote_delim != '' or (delim == ';' and is_block) or (delim == '(' and len(dlist) > 0):
+          ix += 1
+          continue
+
+        else:
+          command.append(line[ix0:ix])
+          word = line[ix0:ix].strip().lower()
+
+        # Add word before the delimiter and then handle the delimiter.
 
-        elif ix == len(line) - 1:
-          command += line
-          dlist.append(line.strip())
-          line = ''
+        if word != '': dlist.append(word)
+        if word == 'macro' or (len(dlist) == 1 and word in block_commands): is_block = True
+
+        if found or delim == ';':
+          ix_line = ix + 1
+          found = True
           break
 
-        if ix > len(line) - 2: continue
+        elif delim == '"' or delim == "'":   # Found start of string
+          quote_delim = delim
+          ix0 = ix = ix + 1
 
-        if line[ix:ix+2] == '/*':
-          command += line[:ix]
-          if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
-          if '*/' in line[ix:]:
-            ix2 = line.find('*/', ix)
-            f_out.write('!' + line[ix+2:ix2] + '\n')
-            line = line[ix+3:]
+        elif delim == '!':
+          if len(line) > ix+10 and line[ix:ix+10] == '!!verbatim':
+            f_out.write(line[ix+10:].strip() + '\n')
           else:
+            f_out.write(line[ix:] + '\n')
+          ix_line = len(line)
+          break
+
+        elif delim == '/*':
+          ix2 = line.find('*/', ix+2)
+          if ix2 == -1:
             f_out.write('!' + line[ix+2:] + '\n')
-            line = ''
             in_extended_comment = True
-          break
+            ix_line = len(line)
+            break
+          f_out.write('!' + line[ix+2:ix2] + '\n')
+          ix0 = ix = ix2 + 2
 
-        elif line[ix:ix+2] == '//':
-          command += line[:ix]
-          if line[:ix].strip() != '': dlist.append(line[:ix].strip().lower())
+        elif delim == '//':
           f_out.write('!' + line[ix+2:] + '\n')
-          line = ''
+          ix_line = len(line)
           break
 
+        else:   # One of "{}:,=("
+          command[-1] += delim
+          dlist.append(delim)
+          ix0 = ix = ix + 1
+
+    yield [''.join(command), dlist]
+
+#------------------------------------------------------------------
 #------------------------------------------------------------------
+# Translate the MADX commands from common.f_in[-1] (and files it calls).
+
+def translate(common):
+  f_root = common.f_out[0]
+
+  try:
+    for [command, dlist] in madx_commands(common):
+      parse_command(common, command, dlist)
+      if len(common.f_in) == 0: break   # Hit Quit/Exit/Stop statement.
+
+  finally:
+    for f_in in common.f_in: f_in.close()
+    for f_out in common.f_out:
+      if f_out is not f_root: f_out.close()
+
 #------------------------------------------------------------------
 #------------------------------------------------------------------
-# Main program.
+# Parallel translation of called files. Used with the many_files option when jobs > 1.
+#
+# Before the translation starts, the files called by the lattice are found (leaf_files). Files that do not
+# call other files and are called only once (leaf files) are translated in a process pool while the rest
+# of the lattice is translated in order. When the translation gets to the call of a leaf file, the result
+# from the pool is stitched in: The Bmad file for the leaf file is written and the elements, variables,
+# etc. defined in the leaf file are added to common.
+#
+# A leaf file is translated starting from an empty common_struct. The result is only used if this gives
+# the same Bmad file as translating the file in order. That is, the leaf file must not have a sequence or
+# be called from inside a sequence, match, track or seqedit construct, and it must not use any element
+# defined before it is called. Otherwise the leaf file is translated in order as usual.
+# Note: Messages printed when translating a leaf file are printed when the file is stitched in.
+
+# Dict that records the element names looked up that are not in it. Used to find what elements a leaf file
+# translation depends upon from the files translated before it.
+
+class lookup_dict(dict):
+  def __init__(self):
+    super().__init__()
+    self.missing = OrderedDict()
+
+  def __contains__(self, name):
+    if dict.__contains__(self, name): return True
+    self.missing[name] = None
+    return False
+
+# Set of variable names used for a leaf file translation. When a name that is not in the set is looked up,
+# a mark is written to the messages. When the file is stitched in, the mark is replaced by the duplicate
+# variable message if the name was defined before the file was called. This keeps the messages in order.
+
+LEAF_VAR_MARK = '\0'
+re_leaf_var_mark = re.compile(LEAF_VAR_MARK + '([^\n]*)\n')
+
+class leaf_var_set(set):
+  def __contains__(self, name):
+    if set.__contains__(self, name): return True
+    sys.stdout.write(f'{LEAF_VAR_MARK}{name}\n')
+    return False
+
+class leaf_result_struct:
+  def __init__(self, common, bmad_text, messages):
+    self.bmad_text = bmad_text
+    self.messages = messages
+    self.ele_dict = dict(common.ele_dict)
+    self.missing_eles = list(common.ele_dict.missing)
+    self.var_names = set(common.var_name_set)
+    self.var_def_list = common.var_def_list
+    self.use = common.use
+    self.independent = not (common.in_seq or common.in_match or common.in_track) and common.seqedit_name == '' and \
+                       len(common.seq_dict) == 0 and common.drift_count == 0 and len(common.super_list) == 0
 
-start_time = time.time()
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Files called by a MADX file in the order they are called.
 
-# Read the parameter file specifying the MADX lattice file, etc.
+def called_files(f_in):
+  common = common_struct()
+  common.f_in.append(f_in)
+  common.f_out.append(open(os.devnull, 'w'))   # Comments are not needed
+  files = []
+  ignore = False    # In match or track construct?
 
-argp = argparse.ArgumentParser()
-argp.add_argument('madx_file', help = 'Name of input MADX lattice file')
-argp.add_argument('-d', '--debug', help = 'Print debug info (not of general interest).', action = 'store_true')
-argp.add_argument('-f', '--many_files', help = 'Create a Bmad file for each MADX input file.', action = 'store_true')
-argp.add_argument('-s', '--superimpose', help = 'Superimpose elements in a sequence.', action = 'store_true')
-argp.add_argument('-v', '--no_prepend_vars', help = 'Do not move variables to the beginning of the Bmad file.', action = 'store_true')
-arg = argp.parse_args()
+  try:
+    for [command, dlist] in madx_commands(common):
+      if len(dlist) == 0: continue
+      if dlist[0] in ['match', 'track']:
+        ignore = True
+      elif dlist[0] in ['endmatch', 'endtrack']:
+        ignore = False
+      elif ignore:
+        continue
+      elif dlist[0] in ['return', 'exit', 'quit', 'stop']:
+        break
+      elif dlist[0].split()[:1] == ['call']:
+        files.append(call_file_name(command))
 
-common = common_struct()
-common.debug = arg.debug
-common.superimpose_eles = arg.superimpose
-common.prepend_vars = not arg.no_prepend_vars
-common.one_file = not arg.many_files
+  finally:
+    for f_in in common.f_in: f_in.close()
+    common.f_out[0].close()
 
-madx_lattice_file = arg.madx_file
-bmad_lattice_file = bmad_file_name(madx_lattice_file)
+  return files
 
-print ('Input lattice file is:  ' + madx_lattice_file)
-print ('Output lattice file is: ' + bmad_lattice_file)
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Leaf files of the include graph of the lattice in the order they are called.
+# The f_root argument is the open root MADX file.
+
+def leaf_files(f_root):
+  calls = {'': called_files(f_root)}    # File name -> files called. Root file has blank name.
+  n_called = {}
+  todo = calls[''][:]
+
+  while len(todo) > 0:
+    file = todo.pop()
+    n_called[file] = n_called.get(file, 0) + 1
+    if file in calls or not os.path.isfile(file): continue
+    with open(file, 'r') as f_in:
+      text = f_in.read()
+    if 'call' not in text.lower():
+      calls[file] = []
+    else:
+      calls[file] = called_files(io.StringIO(text))
+      todo += calls[file]
 
-# Open files for reading and writing
+  leaves = []
+  done = set()
 
-common.f_in.append(open(madx_lattice_file, 'r'))  # Store file handle
-common.f_out.append(open(bmad_lattice_file, 'w'))
+  def add_leaves(file):
+    for file2 in calls[file]:
+      if file2 in done or file2 not in calls: continue
+      done.add(file2)
+      if len(calls[file2]) == 0 and n_called[file2] == 1: leaves.append(file2)
+      add_leaves(file2)
 
-f_out = common.f_out[-1]
+  add_leaves('')
+  return leaves
 
 #------------------------------------------------------------------
-# parse, convert and output madx commands
+#------------------------------------------------------------------
+# Translate a leaf file. This is run in a pool process.
+
+def translate_leaf(madx_file, options):
+  common = common_struct(options)
+  common.ele_dict = lookup_dict()
+  common.var_name_set = leaf_var_set()
+  f_out = io.StringIO()
+  common.f_in.append(open(madx_file, 'r'))
+  common.f_out.append(f_out)
 
-common.command = ''  # init
+  with contextlib.redirect_stdout(io.StringIO()) as messages:
+    translate(common)
 
-while True:
-  [command, dlist] = read_madx_command()
-  if len(common.f_in) == 0: break
-  parse_command(command, dlist)
-  if len(common.f_in) == 0: break   # Hit Quit/Exit/Stop statement.
+  return leaf_result_struct(common, f_out.getvalue(), messages.getvalue())
 
-f_out.close()
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Stitch in the translation of a leaf file.
+# Returns False if the translation cannot be used and the file must be translated in order.
 
+def stitch_leaf_file(common, madx_file):
+  future = common.leaf_results.pop(madx_file)
+  if common.in_seq or common.in_match or common.in_track or common.seqedit_name != '': return False
+
+  try:
+    result = future.result()
+  except Exception:
+    return False      # Translating in order will give the error.
+
+  if not result.independent: return False
+  if any(name in common.ele_dict for name in result.missing_eles): return False
+
+  # re.split gives the message text and the marked names alternately.
+  for ix, text in enumerate(re_leaf_var_mark.split(result.messages)):
+    if ix % 2 == 0:
+      sys.stdout.write(text)
+    elif text in common.var_name_set:
+      print_duplicate_var(text)
+
+  common.var_name_set.update(result.var_names)
+  common.var_def_list += result.var_def_list
+  common.ele_dict.update(result.ele_dict)
+  if result.use != '': common.use = result.use
+
+  with open(bmad_file_name(madx_file), 'w') as f_out:
+    f_out.write(result.bmad_text)
+  common.bmad_files.append(bmad_file_name(madx_file))
+
+  return True
+
+#------------------------------------------------------------------
 #------------------------------------------------------------------
-# Prepend variables and superposition statements as needed
+# Sections of the Bmad file.
+# The Bmad file is: Header, variable definitions, superposition statements and then the translated
+# lattice (the body). The variable definitions and superposition statements are only known after the
+# translation is done so the body is spooled until then. The spool is kept in memory and is moved
+# to a temporary file if it gets larger than BODY_SPOOL_SIZE characters.
 
-f_out = open(bmad_lattice_file, 'r')
-lines = f_out.readlines()
-f_out.close()
+BODY_SPOOL_SIZE = 2**24
 
-f_out = open(bmad_lattice_file, 'w')
-f_out.write (f'!+\n! Translated from MADX to Bmad by madx_to_bmad.py\n! File: {madx_lattice_file}\n!-\n\n')
+def write_header(f_out, madx_file):
+  if madx_file is None:
+    f_out.write ('!+\n! Translated from MADX to Bmad by madx_to_bmad.py\n!-\n\n')
+  else:
+    f_out.write (f'!+\n! Translated from MADX to Bmad by madx_to_bmad.py\n! File: {madx_file}\n!-\n\n')
 
-if common.prepend_vars:
-  order_var_def_list()
+def write_var_defs(common, f_out):
+  if not common.prepend_vars: return
+  order_var_def_list(common)
   for vdef in common.var_def_list:
     wrap_write(f'{vdef[0]} = {vdef[1]}\n', f_out)
   f_out.write('\n')
 
-if len(common.super_list) > 0:
+def write_super_list(common, f_out):
+  if len(common.super_list) == 0: return
   for line in common.super_list:
     f_out.write(line)
   f_out.write('\n')
 
-for line in lines:
-  f_out.write(line)
+def write_body(body, f_out):
+  body.seek(0)
+  shutil.copyfileobj(body, f_out)
+
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Convert a MADX lattice to Bmad.
+#
+# The madx_input argument is the name of the MADX lattice file or is the MADX lattice itself. It is taken to be
+# the lattice if it contains a ";" or a new line.
+# The options argument is an options_struct. The parsed command line arguments may also be used.
+# The bmad_file argument is the name of the Bmad file (default is given by bmad_file_name) or is an open
+# file (like sys.stdout) to write the Bmad lattice to.
+#
+# If madx_input is a file name, the Bmad lattice is written to bmad_file and the list of Bmad files written
+# is returned. If madx_input is the lattice itself and bmad_file is not given, the Bmad lattice is returned
+# as a string. In all cases files called by the lattice are read from disk and, with the many_files option,
+# the Bmad files for these are written to disk.
+#
+# All the state of a conversion is kept in a common_struct local to the call so any number of lattices can
+# be converted in one program.
+
+def convert(madx_input, options = None, bmad_file = None):
+  common = common_struct(options)
+
+  if isinstance(madx_input, os.PathLike) or not ('\n' in madx_input or ';' in madx_input):
+    madx_file = os.fspath(madx_input)
+    if bmad_file is None: bmad_file = bmad_file_name(madx_file)
+    common.f_in.append(open(madx_file, 'r'))
+  else:
+    madx_file = None
+    common.f_in.append(io.StringIO(madx_input))
+    common.f_in[-1].name = 'MADX input string'
+
+  if bmad_file is None:
+    f_bmad = io.StringIO()
+    bmad_files = []
+  elif isinstance(bmad_file, str):
+    f_bmad = open(bmad_file, 'w')
+    bmad_files = [bmad_file]
+  else:
+    f_bmad = bmad_file
+    bmad_files = []
+
+  # The body only needs to be spooled if something has to be put in front of it.
+
+  write_header(f_bmad, madx_file)
+
+  if common.prepend_vars or common.superimpose_eles:
+    body = tempfile.SpooledTemporaryFile(max_size = BODY_SPOOL_SIZE, mode = 'w+')
+  else:
+    body = f_bmad
+
+  common.f_out.append(body)
+
+  # Start translating leaf files in parallel.
+
+  pool = None
+  if not common.one_file and common.jobs > 1:
+    if madx_file is None:
+      leaves = leaf_files(io.StringIO(madx_input))
+    else:
+      leaves = leaf_files(open(madx_file, 'r'))
+
+    if len(leaves) > 0:
+      pool = concurrent.futures.ProcessPoolExecutor(common.jobs)
+      for file in leaves:
+        common.leaf_results[file] = pool.submit(translate_leaf, file, options)
+
+  # Parse, convert and output madx commands
+
+  try:
+    translate(common)
+    write_var_defs(common, f_bmad)
+    write_super_list(common, f_bmad)
+    if body is not f_bmad: write_body(body, f_bmad)
+
+  finally:
+    if pool is not None: pool.shutdown()
+    if body is not f_bmad: body.close()
+    if isinstance(bmad_file, str): f_bmad.close()
+
+  if bmad_file is None: return f_bmad.getvalue()
+  return bmad_files + common.bmad_files
+
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+#------------------------------------------------------------------
+# Main program.
+
+def main():
+  argp = argparse.ArgumentParser()
+  argp.add_argument('madx_file', help = 'Name of input MADX lattice file')
+  argp.add_argument('-d', '--debug', help = 'Print debug info (not of general interest).', action = 'store_true')
+  argp.add_argument('-f', '--many_files', help = 'Create a Bmad file for each MADX input file.', action = 'store_true')
+  argp.add_argument('-s', '--superimpose', help = 'Superimpose elements in a sequence.', action = 'store_true')
+  argp.add_argument('-v', '--no_prepend_vars', help = 'Do not move variables to the beginning of the Bmad file.', action = 'store_true')
+  argp.add_argument('-j', '--jobs', help = 'With --many_files, number of processes used to translate called files. Default is 1.',
+                    type = int, default = 1)
+  argp.add_argument('-c', '--stdout', help = 'Write the Bmad lattice to stdout instead of to a file.', action = 'store_true')
+  arg = argp.parse_args()
+
+  # With the stdout option, the Bmad lattice goes to stdout and all messages go to stderr.
+
+  if arg.stdout:
+    f_bmad = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+      print ('Input lattice file is:  ' + arg.madx_file)
+      convert(arg.madx_file, arg, f_bmad)
+    return
+
+  print ('Input lattice file is:  ' + arg.madx_file)
+  print ('Output lattice file is: ' + bmad_file_name(arg.madx_file))
+
+  convert(arg.madx_file, arg)
+
+#------------------------------------------------------------------
 
-f_out.close()
+if __name__ == '__main__':
+  main()